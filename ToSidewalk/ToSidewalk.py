@@ -1,16 +1,15 @@
 import logging as log
 import math
+import multiprocessing
 import numpy as np
-import os
-import gzip
-import glob
 import shutil
-from latlng import LatLng
+from ids import IdAllocator, default_ids
+from latlng import LatLng, vector_to_array
 from node import Node
 from nodes import Nodes
 from ways import Sidewalk, Sidewalks, Street
 from utilities import window, latlng_offset_size, latlng_offset
-from network import OSM, parse
+from network import OSM, parse, rebuild_network, way_state
 import time
 from datetime import datetime
 log.basicConfig(format="", level=log.DEBUG)
@@ -19,6 +18,55 @@ log.basicConfig(format="", level=log.DEBUG)
 distance_to_sidewalk = 0.00008
 
 
+def make_sidewalk_coordinates(coordinates, distance_to_sidewalk, lengths=None):
+    """
+    Compute the sidewalk points on both sides of every node of one or more streets at once. This is the batched
+    version of make_sidewalk_nodes. Each point is offset from its street node along the bisector of the vectors to
+    the previous and the next nodes, or perpendicular to the street where the street is straight. The missing
+    neighbor of an end node is extrapolated by reflecting the other neighbor.
+
+    :param coordinates: A (n, 2) array of (lat, lng) of street nodes. The nodes of several streets can be
+        concatenated (a ragged array), in which case lengths gives the number of nodes in each street
+    :param distance_to_sidewalk: A distance in degrees. Either a scalar or an array with one value per node
+    :param lengths: A list of the numbers of nodes of the streets. Defaults to a single street
+    :return: A tuple (p1, p2, p1_first). p1 and p2 are (n, 2) arrays of the sidewalk points on the bisector and
+        on the opposite side. p1_first is a boolean array that is True where p1 belongs to the first sidewalk
+        (i.e., where make_sidewalk_nodes returns (p1, p2) rather than (p2, p1))
+    """
+    curr = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    lengths = np.asarray([len(curr)] if lengths is None else lengths, dtype=np.intp)
+    if (lengths < 2).any():
+        raise ValueError("A street needs at least two nodes to have sidewalks")
+    ends = np.cumsum(lengths) - 1
+    starts = ends - lengths + 1
+
+    prev = np.empty_like(curr)
+    prev[1:] = curr[:-1]
+    next_ = np.empty_like(curr)
+    next_[:-1] = curr[1:]
+    prev[starts] = curr[starts] + -(next_[starts] - curr[starts])
+    next_[ends] = curr[ends] + -(prev[ends] - curr[ends])
+
+    v_cp_n = vector_to_array(curr, prev, normalize=True)
+    v_cn_n = vector_to_array(curr, next_, normalize=True)
+    v_sidewalk = v_cp_n + v_cn_n
+    norms = np.sqrt(v_sidewalk[:, 0] * v_sidewalk[:, 0] + v_sidewalk[:, 1] * v_sidewalk[:, 1])
+
+    # The bisector is not defined where the street goes straight through the node. Use the normal of the street.
+    degenerate = norms < 1e-10
+    v_sidewalk[~degenerate] /= norms[~degenerate, np.newaxis]
+    v_sidewalk[degenerate] = np.column_stack((v_cn_n[degenerate, 1], - v_cn_n[degenerate, 0]))
+
+    offsets = np.reshape(distance_to_sidewalk, (-1, 1)) * v_sidewalk
+    p1 = curr + offsets
+    p2 = curr - offsets
+
+    # Figure out on which side each sidewalk point is
+    v_c1 = p1 - curr
+    p1_first = v_cn_n[:, 0] * v_c1[:, 1] - v_cn_n[:, 1] * v_c1[:, 0] > 0
+    return p1, p2, p1_first
+
+
 def make_sidewalk_nodes(street, prev_node, curr_node, next_node):
     """
     Create two sidewalk nodes from three nodes in a street.
@@ -29,38 +77,18 @@ def make_sidewalk_nodes(street, prev_node, curr_node, next_node):
     :param next_node:
     :return:
     """
-    if prev_node is None:
-        v = - curr_node.vector_to(next_node, normalize=False)
-        vec_prev = curr_node.vector() + v
-        prev_node = Node(None, vec_prev[0], vec_prev[1])
-    elif next_node is None:
-        v = - curr_node.vector_to(prev_node, normalize=False)
-        vec_next = curr_node.vector() + v
-        next_node = Node(None, vec_next[0], vec_next[1])
-
-    curr_latlng = np.array(curr_node.location())
-
-    v_cp_n = curr_node.vector_to(prev_node, normalize=True)
-    v_cn_n = curr_node.vector_to(next_node, normalize=True)
-    v_sidewalk = v_cp_n + v_cn_n
+    nodes = [node for node in (prev_node, curr_node, next_node) if node is not None]
+    row = 0 if prev_node is None else 1
+    p1, p2, p1_first = make_sidewalk_coordinates([(node.lat, node.lng) for node in nodes],
+                                                   street.distance_to_sidewalk)
 
-    if np.linalg.norm(v_sidewalk) < 1e-10:
-        v_sidewalk_n = np.array([v_cn_n[1], - v_cn_n[0]])
-    else:
-        v_sidewalk_n = v_sidewalk / np.linalg.norm(v_sidewalk)
-
-    p1 = curr_latlng + street.distance_to_sidewalk * v_sidewalk_n
-    p2 = curr_latlng - street.distance_to_sidewalk * v_sidewalk_n
-
-    p_sidewalk_1 = Node(None, p1[0], p1[1])
-    p_sidewalk_2 = Node(None, p2[0], p2[1])
+    p_sidewalk_1 = Node(None, p1[row, 0], p1[row, 1])
+    p_sidewalk_2 = Node(None, p2[row, 0], p2[row, 1])
 
     curr_node.append_sidewalk_node(street.id, p_sidewalk_1)
     curr_node.append_sidewalk_node(street.id, p_sidewalk_2)
 
-    # Figure out on which side you want to put each sidewalk node
-    v_c1 = curr_node.vector_to(p_sidewalk_1)
-    if np.cross(v_cn_n, v_c1) > 0:
+    if p1_first[row]:
         return p_sidewalk_1, p_sidewalk_2
     else:
         return p_sidewalk_2, p_sidewalk_1
@@ -72,17 +100,38 @@ def make_sidewalks(street_network):
     sidewalk_nodes = Nodes()
     sidewalk_network = OSM(sidewalk_nodes, sidewalks, street_network.bounds)
 
+    streets = []
     for street in street_network.ways.get_list():
+        if len(street.nids) < 2:
+            log.debug("make_sidewalks(): Skipping street %s with less than two nodes" % str(street.id))
+            continue
+        streets.append(street)
+    if not streets:
+        return sidewalk_network
+
+    # Compute the sidewalk points of all the streets with one call on the concatenated street coordinates
+    lengths = [len(street.nids) for street in streets]
+    coordinates = street_network.nodes.get_coordinates([nid for street in streets for nid in street.nids])
+    distances = np.repeat([street.distance_to_sidewalk for street in streets], lengths)
+    p1, p2, p1_first = make_sidewalk_coordinates(coordinates, distances, lengths)
+
+    row = 0
+    for street in streets:
         sidewalk_1_nodes = []
         sidewalk_2_nodes = []
 
         # Create sidewalk nodes
-        for prev_nid, curr_nid, next_nid in window(street.nids, 3, padding=1):
+        for curr_nid in street.nids:
             curr_node = street_network.nodes.get(curr_nid)
-            prev_node = street_network.nodes.get(prev_nid)
-            next_node = street_network.nodes.get(next_nid)
-
-            n1, n2 = make_sidewalk_nodes(street, prev_node, curr_node, next_node)
+            p_sidewalk_1 = Node(sidewalk_network.node_ids.allocate(), p1[row, 0], p1[row, 1])
+            p_sidewalk_2 = Node(sidewalk_network.node_ids.allocate(), p2[row, 0], p2[row, 1])
+            curr_node.append_sidewalk_node(street.id, p_sidewalk_1)
+            curr_node.append_sidewalk_node(street.id, p_sidewalk_2)
+            if p1_first[row]:
+                n1, n2 = p_sidewalk_1, p_sidewalk_2
+            else:
+                n1, n2 = p_sidewalk_2, p_sidewalk_1
+            row += 1
 
             sidewalk_network.add_node(n1)
             sidewalk_network.add_node(n2)
@@ -94,8 +143,8 @@ def make_sidewalks(street_network):
         # And set nodes' adjacency information
         sidewalk_1_nids = [node.id for node in sidewalk_1_nodes]
         sidewalk_2_nids = [node.id for node in sidewalk_2_nodes]
-        sidewalk_1 = Sidewalk(None, sidewalk_1_nids, "footway")
-        sidewalk_2 = Sidewalk(None, sidewalk_2_nids, "footway")
+        sidewalk_1 = Sidewalk(sidewalk_network.way_ids.allocate(), sidewalk_1_nids, "footway")
+        sidewalk_2 = Sidewalk(sidewalk_network.way_ids.allocate(), sidewalk_2_nids, "footway")
         sidewalk_1.set_street_id(street.id)
         sidewalk_2.set_street_id(street.id)
         street.append_sidewalk_id(sidewalk_1.id)
@@ -125,13 +174,14 @@ def sort_nodes(center_node, nodes):
     return sorted(nodes, cmp=cmp)
 
 
-def make_crosswalk_node(node, n1, n2):
+def make_crosswalk_node(node, n1, n2, ids=default_ids):
     """
     Make a crosswalk node from three nodes. The first one is a pivot node and two other nodes are ones that are
     connected to the pivot node. The new node is created between the two nodes.
     :param node:
     :param n1:
     :param n2:
+    :param ids: An IdAllocator to allocate the id of the new node from
     :return:
     """
     v_curr = node.vector()
@@ -142,14 +192,15 @@ def make_crosswalk_node(node, n1, n2):
     v /= np.linalg.norm(v)  # Normalize the vector
     v_new = v_curr + v * 0.00011
     # v_new = v_curr + np.array(latlng_offset(v_curr[0], vector=v, distance=7))
-    return Node(None, v_new[0], v_new[1])
+    return Node(ids.allocate(), v_new[0], v_new[1])
 
 
-def make_crosswalk_nodes(intersection_node, adj_street_nodes):
+def make_crosswalk_nodes(intersection_node, adj_street_nodes, ids=default_ids):
     """
     Create new crosswalk nodes
     :param intersection_node:
     :param adj_street_nodes:
+    :param ids: An IdAllocator to allocate the ids of the new nodes from
     :return: crosswalk_nodes, source_table
     """
     if len(adj_street_nodes) < 4:
@@ -159,7 +210,7 @@ def make_crosswalk_nodes(intersection_node, adj_street_nodes):
     for i in range(len(adj_street_nodes)):
         n1 = adj_street_nodes[i - 1]
         n2 = adj_street_nodes[i]
-        crosswalk_node = make_crosswalk_node(intersection_node, n1, n2)
+        crosswalk_node = make_crosswalk_node(intersection_node, n1, n2, ids)
 
         # Keep track of from which streets the crosswalk nodes are created.
         way_ids = []
@@ -266,7 +317,7 @@ def make_crosswalks(street_network, sidewalk_network):
 
             # Create crosswalk nodes and add a cross walk to the data structure
             try:
-                crosswalk_nodes = make_crosswalk_nodes(intersection_node, adj_street_nodes)
+                crosswalk_nodes = make_crosswalk_nodes(intersection_node, adj_street_nodes, sidewalk_network.node_ids)
             except ValueError:
                 raise
 
@@ -285,9 +336,9 @@ def make_crosswalks(street_network, sidewalk_network):
                 n1 = sidewalk_network.nodes.get(node_id_pair[0])
                 n2 = sidewalk_network.nodes.get(node_id_pair[1])
                 if len(n1.get_way_ids()) == 1 and len(n2.get_way_ids()) == 1:
-                    crosswalk = Sidewalk(None, list(node_id_pair), "footway")
+                    crosswalk = Sidewalk(sidewalk_network.way_ids.allocate(), list(node_id_pair), "footway")
                 else:
-                    crosswalk = Sidewalk(None, list(node_id_pair), "crosswalk")
+                    crosswalk = Sidewalk(sidewalk_network.way_ids.allocate(), list(node_id_pair), "crosswalk")
                 sidewalk_network.add_way(crosswalk)
 
             # Connect the crosswalk nodes with correct sidewalk nodes
@@ -298,65 +349,253 @@ def make_crosswalks(street_network, sidewalk_network):
     return
 
 
-def split_large_osm_file(filename):
-    """Splits a large OSM files
+def make_grid(bounds, rows, columns):
+    """
+    Divide a bounding box into a grid of rows x columns cells
 
-    :param filename:
-    :return:
+    :param bounds: A bounding box [min lat, min lng, max lat, max lng]
+    :param rows: The number of rows
+    :param columns: The number of columns
+    :return: A tuple of the latitudes and the longitudes of the cell boundaries (rows + 1 and columns + 1 values)
     """
-    command = "java -Xmx4000M -jar ./lib/splitter.jar --output=xml --output-dir=data --max-nodes=15000 " + filename + " > splitter.log"
-    os.system(command)
+    min_lat, min_lng, max_lat, max_lng = map(float, bounds)
+    return np.linspace(min_lat, max_lat, rows + 1), np.linspace(min_lng, max_lng, columns + 1)
 
 
-def merge_sidewalks(sidewalk_network1, sidewalk_network2):
-    """Returns a merged sidewalk network
+def get_cells(coordinates, grid):
+    """
+    Find the grid cell of each point. Every point is assigned to exactly one cell. Points on a boundary go to the
+    cell above or to the right, and points outside the grid go to the nearest cell.
+
+    :param coordinates: A (n, 2) array of (lat, lng)
+    :param grid: A tuple of the cell boundaries (see make_grid)
+    :return: A tuple of two arrays of the rows and the columns of the cells
+    """
+    lat_edges, lng_edges = grid
+    coordinates = np.reshape(coordinates, (-1, 2))
+    rows = np.searchsorted(lat_edges[1:-1], coordinates[:, 0], side="right")
+    columns = np.searchsorted(lng_edges[1:-1], coordinates[:, 1], side="right")
+    return rows, columns
+
+
+def split_network(street_network, rows, columns, halo=0.002):
+    """
+    Partition a street network into a grid of tiles. Replaces splitting the OSM file with the external splitter.
+
+    Each tile gets a copy of every street whose bounding box overlaps with the tile expanded by the halo (in degrees).
+    A street near the edge of a tile is therefore in more than one tile, so each tile sees the streets around its
+    edges when it is preprocessed. The duplicated sidewalks are removed later by crop_sidewalks.
+
+    :param street_network: A street network
+    :param rows: The number of rows of the grid
+    :param columns: The number of columns of the grid
+    :param halo: The width of the overlap around each tile in degrees
+    :return: A tuple of the grid (see make_grid) and a list of ((row, column), network) tuples. Tiles without any
+        streets are skipped
+    """
+    streets = [street for street in street_network.get_ways() if len(street.nids) > 0]
+    if not streets:
+        return make_grid(street_network.bounds, rows, columns), []
+
+    # Compute the bounding box of every street with one pass over the concatenated coordinates
+    lengths = [len(street.nids) for street in streets]
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    coordinates = street_network.nodes.get_coordinates([nid for street in streets for nid in street.nids])
+    street_min = np.minimum.reduceat(coordinates, starts, axis=0)
+    street_max = np.maximum.reduceat(coordinates, starts, axis=0)
+
+    grid = make_grid(np.concatenate((coordinates.min(axis=0), coordinates.max(axis=0))), rows, columns)
+    lat_edges, lng_edges = grid
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            overlaps = (street_max[:, 0] >= lat_edges[row] - halo) & (street_min[:, 0] <= lat_edges[row + 1] + halo) & \
+                (street_max[:, 1] >= lng_edges[column] - halo) & (street_min[:, 1] <= lng_edges[column + 1] + halo)
+            if not overlaps.any():
+                continue
+            tile = street_network.extract([streets[i].id for i in np.flatnonzero(overlaps)])
+            tile.bounds = [lat_edges[row] - halo, lng_edges[column] - halo,
+                           lat_edges[row + 1] + halo, lng_edges[column + 1] + halo]
+            tiles.append(((row, column), tile))
+    return grid, tiles
 
-    Takes two sidewalk networks and merges them without duplicating sidewalk data"""
-
-    for node in sidewalk_network1.nodes.get_list():
-        node.confirmed = True
-
-    '''
-    # add new nodes from sidewalk_network2 to sidewalk_network1
-    for sidewalk_node in sidewalk_network2.nodes.get_list():
-        in_other = False
-        same_node = None
-        for other_sidewalk_node in sidewalk_network1.nodes.get_list():
-            if sidewalk_node.location() == other_sidewalk_node.location():
-                in_other = True
-                same_node = other_sidewalk_node
-        if not in_other: # If street network 2 contains the node but street network 1 does not
-            sidewalk_network1.add_node(sidewalk_node) # Add node from street network 2 to street network 1
-        else: # If both networks contain the node
-            sidewalk_network2.nodes.update(sidewalk_node.id, same_node)
-    '''
-    # add new nodes from sidewalk_network2 to sidewalk_network1
-
-    network1_dict = {}
-    for sidewalk_node in sidewalk_network1.nodes.get_list():
-        network1_dict[sidewalk_node.location] = sidewalk_node
-
-    for sidewalk_node in sidewalk_network2.nodes.get_list():
-        if sidewalk_node.location not in network1_dict:
-            sidewalk_network1.add_node(sidewalk_node)
-        else:
-            sidewalk_network2.nodes.update(sidewalk_node.id, network1_dict[sidewalk_node.location])
 
-    # add new ways from sidewalk_network2 to sidewalk_network1
-    for way in sidewalk_network2.ways.get_list():
-        # ensure all ways have correct nids, if incorrect update to correct nid from network1
-        for nid in way.get_node_ids():
-            if sidewalk_network1.nodes.get(nid) is None:
-                 way.swap_nodes(nid, sidewalk_network2.nodes.get(nid).id)
+def crop_sidewalks(sidewalk_network, grid, cell):
+    """
+    Remove the sidewalks that belong to other tiles. A sidewalk belongs to the cell that contains the middle of its
+    middle segment, so each sidewalk that is created in more than one tile is kept in exactly one of them.
 
-        has_confirmed_parents = False
-        for nid in way.get_node_ids():
-            if sidewalk_network1.nodes.get(nid).confirmed:
-                has_confirmed_parents = True
-        if not has_confirmed_parents:
-            sidewalk_network1.add_way(way)
+    :param sidewalk_network: A sidewalk network of a tile
+    :param grid: The grid (see make_grid)
+    :param cell: The (row, column) of the tile
+    :return: The sidewalk network
+    """
+    ways = [way for way in sidewalk_network.get_ways() if len(way.nids) > 1]
+    middle = [len(way.nids) // 2 for way in ways]
+    points = (sidewalk_network.nodes.get_coordinates([way.nids[i - 1] for way, i in zip(ways, middle)]) +
+              sidewalk_network.nodes.get_coordinates([way.nids[i] for way, i in zip(ways, middle)])) / 2
+    rows, columns = get_cells(points, grid)
+    for way, row, column in zip(ways, rows, columns):
+        if (row, column) != tuple(cell):
+            sidewalk_network.remove_way(way.id)
+
+    # remove_way deletes the orphaned nodes, including crosswalk nodes
+    nodes = sidewalk_network.nodes
+    nodes.crosswalk_node_ids = [nid for nid in nodes.crosswalk_node_ids if nid in nodes.nodes]
+    return sidewalk_network
 
-    return sidewalk_network1
+
+def process_tile(args):
+    """
+    Preprocess the street network of a tile, make its sidewalks, and crop them to the tile. Defined at the module
+    level so that it can be run by a worker process.
+
+    :param args: A tuple of the street network of the tile, the grid, and the (row, column) of the tile
+    :return: A sidewalk network, or None if the sidewalks could not be made
+    """
+    street_network, grid, cell = args
+    try:
+        street_network.preprocess()
+    except Exception:
+        log.exception("Error preprocessing the street network of tile %s. Skipping." % str(cell))
+        return None
+
+    try:
+        sidewalk_network = main(street_network)
+    except Exception:
+        log.exception("Creating the sidewalk network of tile %s failed. Skipping..." % str(cell))
+        return None
+    return crop_sidewalks(sidewalk_network, grid, cell)
+
+
+def make_sidewalks_in_tiles(street_network, rows, columns, halo=0.002, processes=None):
+    """
+    Split a street network into tiles (see split_network) and make the sidewalks of the tiles in parallel. The tile
+    networks are sent to a pool of worker processes and the sidewalk networks are sent back (see
+    Network.__reduce__).
+
+    :param street_network: A street network
+    :param rows: The number of rows of the grid
+    :param columns: The number of columns of the grid
+    :param halo: The width of the overlap around each tile in degrees
+    :param processes: The number of worker processes. Defaults to the number of CPUs. If it is 1, the tiles are
+        processed in the calling process
+    :return: A list of the sidewalk networks of the tiles, in the row-major order of the tiles
+    """
+    grid, tiles = split_network(street_network, rows, columns, halo)
+    tasks = [(tile, grid, cell) for cell, tile in tiles]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes <= 1 or len(tasks) <= 1:
+        sidewalk_networks = map(process_tile, tasks)
+    else:
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            sidewalk_networks = pool.map(process_tile, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+    return [sidewalk_network for sidewalk_network in sidewalk_networks if sidewalk_network is not None]
+
+
+def stitch_sidewalks(sidewalk_networks, precision=1e-7):
+    """
+    Merge sidewalk networks (e.g., the sidewalk networks of tiles) into one network in a single pass.
+
+    Nodes are deduplicated by snapping their coordinates to a grid of precision degrees: nodes from any of the
+    networks that fall on the same grid point become one node. The node ids of the ways are then rewritten in bulk,
+    and ways that end up with the same sequence of nodes (in either direction) are kept once. The networks allocate
+    ids independently, so the nodes and the ways of the stitched network are given new ids.
+
+    :param sidewalk_networks: A list of sidewalk networks. None entries are ignored
+    :param precision: The spacing of the grid in degrees
+    :return: A new sidewalk network
+    """
+    sidewalk_networks = [network for network in sidewalk_networks if network is not None]
+    if not sidewalk_networks:
+        return OSM(Nodes(), Sidewalks(), None)
+
+    node_ids = [np.array(network.nodes.get_ids(), dtype=np.int64) for network in sidewalk_networks]
+    coordinates = np.concatenate([np.reshape(network.nodes.get_coordinates(nids), (-1, 2))
+                                  for network, nids in zip(sidewalk_networks, node_ids)])
+    offsets = np.concatenate(([0], np.cumsum([len(nids) for nids in node_ids])))
+
+    # Number the grid points in the order they first appear, and give every input node the id of its grid point
+    node_allocator = IdAllocator()
+    way_allocator = IdAllocator()
+    if len(coordinates):
+        keys = np.rint(coordinates / precision).astype(np.int64)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind="mergesort")
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[order] = np.arange(len(first))
+        stitched_ids = [node_allocator.allocate() for _ in range(len(first))]
+        new_ids = np.array(stitched_ids, dtype=np.int64)[rank[np.reshape(inverse, -1)]]
+        stitched_coordinates = coordinates[first[order]]
+    else:
+        new_ids = np.zeros(0, dtype=np.int64)
+        stitched_ids, stitched_coordinates = [], np.zeros((0, 2))
+
+    ways = []
+    crosswalk_node_ids = []
+    seen = set()
+    for i, network in enumerate(sidewalk_networks):
+        # Map the node ids of all the ways of the network at once
+        sorter = np.argsort(node_ids[i])
+        sorted_ids = node_ids[i][sorter]
+
+        def rewire(nids):
+            """
+            Map node ids of the network to stitched ids. Returns the stitched ids and a mask of the ids that are nodes
+            of the network; the stitched ids of the other ids are meaningless.
+            """
+            nids = np.asarray(nids, dtype=np.int64)
+            if not len(sorted_ids):
+                return np.zeros(len(nids), dtype=np.int64), np.zeros(len(nids), dtype=np.bool_)
+            positions = np.minimum(np.searchsorted(sorted_ids, nids), len(sorted_ids) - 1)
+            return new_ids[offsets[i] + sorter[positions]], sorted_ids[positions] == nids
+
+        network_ways = [way for way in network.get_ways() if len(way.nids) > 0]
+        way_nids = [nid for way in network_ways for nid in way.nids]
+        flat, found = rewire(way_nids)
+        if not found.all():
+            raise KeyError("Node %d of a way is not in the sidewalk network" % way_nids[np.flatnonzero(~found)[0]])
+        flat = flat.tolist()
+        position = 0
+        for way in network_ways:
+            nids = flat[position:position + len(way.nids)]
+            position += len(way.nids)
+            # Drop the nodes that were merged with the node before them
+            nids = [nid for j, nid in enumerate(nids) if j == 0 or nid != nids[j - 1]]
+            key = min(tuple(nids), tuple(nids[::-1]))
+            if len(nids) < 2 or key in seen:
+                continue
+            seen.add(key)
+
+            state = way_state(way)
+            state["id"] = str(way_allocator.allocate())
+            state["nids"] = nids
+            ways.append((way.__class__, state))
+
+        if network.nodes.crosswalk_node_ids:
+            # Skip the ids of crosswalk nodes that were removed from the network
+            stitched, found = rewire(network.nodes.crosswalk_node_ids)
+            crosswalk_node_ids.extend(stitched[found].tolist())
+
+    bounds = np.array([map(float, network.bounds) for network in sidewalk_networks if network.bounds])
+    if len(bounds):
+        bounds = np.concatenate((bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0))).tolist()
+    else:
+        bounds = None
+    return rebuild_network(OSM, Sidewalks, bounds, stitched_ids, stitched_coordinates, ways, node_allocator,
+                           way_allocator, sorted(set(crosswalk_node_ids)))
+
+
+def merge_sidewalks(sidewalk_network1, sidewalk_network2):
+    """Returns a merged sidewalk network
+
+    Takes two sidewalk networks and merges them without duplicating sidewalk data (see stitch_sidewalks)"""
+    return stitch_sidewalks([sidewalk_network1, sidewalk_network2])
 
 def main(street_network):
     sidewalk_network = make_sidewalks(street_network)
@@ -404,81 +643,28 @@ if __name__ == "__main__":
 
         # street_network.merge_parallel_street_segments2()
         with open("../output/Sidewalk_Output.geojson", "wb") as f:
-            sidewalk_geojson = sidewalk_network.export(data_type="ways")
-            #print geojson
-            print >>f, sidewalk_geojson
+            sidewalk_network.export_to(f, format="geojson", data_type="ways")
 
         with open("../output/Sidewalk_Nodes_Output.geojson", "wb") as f:
-            sidewalk_nodes_geojson = sidewalk_network.export(data_type="nodes")
-            print >>f, sidewalk_nodes_geojson
+            sidewalk_network.export_to(f, format="geojson", data_type="nodes")
 
         with open("../output/Streets_Output.geojson", "wb") as f:
-            streets_geojson = street_network.export(data_type="ways")
-            print >>f, streets_geojson
+            street_network.export_to(f, format="geojson", data_type="ways")
 
         with open("../output/Street_Nodes_Output.geojson", "wb") as f:
-            street_nodes_geojson = street_network.export(data_type="nodes")
-            print >>f, street_nodes_geojson
+            street_network.export_to(f, format="geojson", data_type="nodes")
 
-            # print geojson
-        f = open('../output/output.geojson', 'w')
-
-        print >>f, sidewalk_geojson
+        shutil.copyfile("../output/Sidewalk_Output.geojson", "../output/output.geojson")
         # print sidewalk_network.export()
 
 
     elif runmode == "batch":
-        # Clear the data directory before beginning
-        shutil.rmtree('data/')
-        split_large_osm_file(filename)
-        files = glob.glob("data/*.gz")
-        log.debug("Working with " + str(files))
-        # Decompress each GZ file
-        for filename in files:
-            f = gzip.open(filename, 'rb')
-            file_content = f.read()
-            log.debug("writing to "+filename+".osm")
-            outfile = open(filename+".osm", "w")
-            outfile.write(file_content)
-            outfile.close()
-        files = glob.glob("data/*.osm")
-        # Parse, preprocess, main, join
-        street_networks = []
-        print "Batch parsing files..."
-        for filename in files:
-            #log.debug("Parsing " + filename)
-            try:
-                new_street_network = parse(filename)
-                street_networks.append(new_street_network)
-            except:
-                log.exception("Failed to create this street network, skipping...")
-                continue
-
-        print("Batch preprocessing street networks...")
-        for street_network in street_networks:
-            try:
-
-                street_network.preprocess()
-                print(street_network.export())
-            except:
-                log.exception("Error preprocessing this street network. Skipping.")
-                continue
+        # Split the network into tiles, and preprocess them and make their sidewalks in parallel
+        print "Batch processing tiles..."
+        street_network = parse(filename)
+        sidewalk_networks = make_sidewalks_in_tiles(street_network, rows=4, columns=4)
 
         print("Merging sidewalk networks...")
-        sidewalk_networks = []
-        #print("1")
-        for street_network in street_networks:
-            try:
-                sidewalk_networks.append(main(street_network))
-            except:
-                log.exception("Uh oh, creating this sidewalk network failed. Skipping...")
-                continue
-        sidewalk_network_main = sidewalk_networks[0]
-        #print("2")
-        for sidewalk_network in sidewalk_networks[1:]:
-            sidewalk_network_main = merge_sidewalks(sidewalk_network_main, sidewalk_network)
-        #print("3")
-        geojson = sidewalk_network_main.export(format="geojson")
-
-        f = open('../output/output.geojson', 'w')
-        print >>f, geojson
+        sidewalk_network_main = stitch_sidewalks(sidewalk_networks)
+        with open("../output/output.geojson", "wb") as f:
+            sidewalk_network_main.export_to(f, format="geojson")
@@ -0,0 +1,116 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class Adjacency(object):
+    """
+    A compressed sparse row (CSR) snapshot of the adjacency of an undirected graph. Nodes are identified by keys
+    (e.g., node ids), which are mapped to integer indices in the order they are passed. The neighbors of the node with
+    index i are self.indices[self.indptr[i]:self.indptr[i + 1]], in the order the edges were passed.
+
+    Like HoughIndex, the snapshot does not track changes to the graph. Build a new one after mutating the graph (see
+    Network.get_adjacency and GeometricGraph.get_adjacency).
+    """
+    def __init__(self, keys, sources, targets, unique=False):
+        """
+        :param keys: A list of node keys
+        :param sources: Indices of the source nodes of the edges
+        :param targets: Indices of the target nodes of the edges
+        :param unique: If True, parallel edges are collapsed so each neighbor is listed once. Otherwise each edge
+            contributes one neighbor, so the degree of a node is the number of edges incident to it
+        """
+        self.keys = list(keys)
+        self._index = dict((key, i) for i, key in enumerate(self.keys))
+        n = len(self.keys)
+        sources = np.asarray(sources, dtype=np.intp).reshape(-1)
+        targets = np.asarray(targets, dtype=np.intp).reshape(-1)
+        if unique and len(sources):
+            pairs = np.column_stack((np.minimum(sources, targets), np.maximum(sources, targets)))
+            _, first = np.unique(pairs[:, 0] * n + pairs[:, 1], return_index=True)
+            first.sort()
+            sources, targets = sources[first], targets[first]
+
+        # Store each edge in both directions. A stable sort on the row keeps the order in which the edges were passed.
+        rows = np.concatenate((sources, targets))
+        columns = np.concatenate((targets, sources))
+        order = np.argsort(rows, kind='mergesort')
+        self.indices = columns[order]
+        self.indptr = np.zeros(n + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+
+    @classmethod
+    def from_edges(cls, keys, edges, unique=False):
+        """
+        Build an adjacency snapshot from a list of edges
+
+        :param keys: A list of node keys
+        :param edges: A list of (source key, target key) pairs. Both keys should be in keys
+        :param unique: See __init__
+        :return: An Adjacency object
+        """
+        index = dict((key, i) for i, key in enumerate(keys))
+        pairs = np.array([(index[source], index[target]) for source, target in edges], dtype=np.intp).reshape(-1, 2)
+        return cls(keys, pairs[:, 0], pairs[:, 1], unique)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def index(self, key):
+        """
+        Get the integer index of a node key
+        """
+        return self._index[key]
+
+    def degrees(self):
+        """
+        :return: An array of the degrees of all the nodes, in the order of self.keys
+        """
+        return np.diff(self.indptr)
+
+    def degree(self, key):
+        """
+        :return: The degree of the node
+        """
+        i = self._index[key]
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def neighbor_indices(self, i):
+        """
+        :return: An array of the indices of the neighbors of the node with index i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def neighbors(self, key):
+        """
+        :return: A list of the keys of the neighbors of the node
+        """
+        return [self.keys[j] for j in self.neighbor_indices(self._index[key])]
+
+    def intersections(self, min_degree=3):
+        """
+        Find the nodes with at least min_degree neighbors
+
+        :return: A list of node keys, in the order of self.keys
+        """
+        return [self.keys[i] for i in np.flatnonzero(self.degrees() >= min_degree)]
+
+    def connected_components(self):
+        """
+        Label the connected components of the graph
+
+        :return: A tuple of the number of components and an array of the component label of each node
+        """
+        n = len(self.keys)
+        matrix = csr_matrix((np.ones(len(self.indices)), self.indices, self.indptr), shape=(n, n))
+        return connected_components(matrix, directed=False)
+
+    def is_connected(self, key1, key2):
+        """
+        Check if there is a path between two nodes
+        """
+        _, labels = self.connected_components()
+        return labels[self._index[key1]] == labels[self._index[key2]]
@@ -71,7 +71,5 @@ class StreetEdgeAssignmentCountTable(db.Base):
 
 if __name__ == "__main__":
     database = db.DB("../../.settings")
-    session = database.session
-    query = session.query(StreetEdgeTable).filter_by(deleted=False)
-    for item in query:
+    for item in database.stream(StreetEdgeTable, deleted=False):
         print item.street_edge_id, item.x1, item.y1
@@ -0,0 +1,316 @@
+"""
+Bulk loading of networks into PostGIS.
+
+Rows are generated lazily and sent to the database in batches. On PostgreSQL each batch is streamed with
+COPY ... FROM STDIN, and geometries are passed as hex-encoded EWKB, which PostGIS parses on input, so no per-row
+INSERT statement or GeoAlchemy geometry object is created. On other databases each batch is inserted with a single
+executemany.
+"""
+from binascii import hexlify, unhexlify
+from cStringIO import StringIO
+import json
+from itertools import islice
+from struct import pack
+from types import BooleanType, FloatType, UnicodeType
+
+from geoalchemy2 import Geometry
+from geoalchemy2.elements import WKBElement
+from sqlalchemy import select
+
+from SidewalkTables import SidewalkEdgeTable
+from StreetTables import StreetEdgeParentEdgeTable, StreetEdgeStreetNodeTable, StreetEdgeTable, StreetNodeTable
+from ToSidewalk.ids import IdAllocator
+
+BATCH_SIZE = 10000
+SRID = 4326
+
+# Geometry type codes of (E)WKB, and the flag that marks that an SRID follows the type code
+_WKB_POINT = 1
+_WKB_LINESTRING = 2
+_EWKB_SRID_FLAG = 0x20000000
+
+STREET_NODE_COLUMNS = ("street_node_id", "geom", "lat", "lng")
+STREET_EDGE_COLUMNS = ("street_edge_id", "geom", "x1", "y1", "x2", "y2", "way_type", "source", "target", "deleted")
+STREET_EDGE_PARENT_EDGE_COLUMNS = ("street_edge_id", "parent_edge_id")
+STREET_EDGE_STREET_NODE_COLUMNS = ("street_edge_id", "street_node_id")
+SIDEWALK_EDGE_COLUMNS = ("sidewalk_edge_id", "geom", "x1", "y1", "x2", "y2", "way_type", "source", "target",
+                         "deleted")
+
+
+def point_ewkb(x, y, srid=SRID):
+    """
+    Encode a point as little-endian hex EWKB
+
+    :param x: Longitude
+    :param y: Latitude
+    :return: A hex string
+    """
+    return hexlify(pack("<BII2d", 1, _WKB_POINT | _EWKB_SRID_FLAG, srid, x, y))
+
+
+def linestring_ewkb(coordinates, srid=SRID):
+    """
+    Encode a line string as little-endian hex EWKB
+
+    :param coordinates: A list of (x, y) coordinates, i.e., (lng, lat)
+    :return: A hex string
+    """
+    values = [value for coordinate in coordinates for value in coordinate]
+    return hexlify(pack("<BIII%dd" % len(values), 1, _WKB_LINESTRING | _EWKB_SRID_FLAG, srid, len(coordinates),
+                        *values))
+
+
+def batches(rows, size):
+    """
+    Split an iterable into lists of at most size items
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy_value(value):
+    """
+    Format a value for the text format of COPY
+    """
+    if value is None:
+        return "\\N"
+    if type(value) is BooleanType:
+        return "t" if value else "f"
+    if type(value) is FloatType:
+        return repr(value)
+    if type(value) is UnicodeType:
+        value = value.encode("utf-8")
+    else:
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_batch(connection, table, columns, batch):
+    """
+    Send a batch of rows with COPY ... FROM STDIN through the DBAPI (psycopg2) connection
+    """
+    data = StringIO()
+    for row in batch:
+        data.write("\t".join(map(_copy_value, row)))
+        data.write("\n")
+    data.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table.name, ", ".join(columns)), data)
+    finally:
+        cursor.close()
+
+
+def _insert_batch(connection, table, columns, batch):
+    """
+    Insert a batch of rows with one executemany. Hex EWKB geometries are wrapped in WKBElement objects.
+    """
+    table_columns = dict((column.name, column) for column in table.columns)
+    keys = [table_columns[name].key for name in columns]
+    geometries = [i for i, name in enumerate(columns) if isinstance(table_columns[name].type, Geometry)]
+    parameters = []
+    for row in batch:
+        row = list(row)
+        for i in geometries:
+            if row[i] is not None:
+                row[i] = WKBElement(buffer(unhexlify(row[i])), srid=SRID, extended=True)
+        parameters.append(dict(zip(keys, row)))
+    connection.execute(table.insert(), parameters)
+
+
+def copy_rows(connection, table, columns, rows, batch_size=BATCH_SIZE, skip_existing=False):
+    """
+    Load rows into a table in batches (see the module docstring)
+
+    :param connection: An SQLAlchemy connection
+    :param table: An SQLAlchemy Table object
+    :param columns: The column names, in the order of the values in each row
+    :param rows: An iterable of tuples of values. Geometries are hex EWKB strings (see point_ewkb and linestring_ewkb)
+    :param batch_size: The number of rows sent at once
+    :param skip_existing: If True, rows whose first value is already in the first column are skipped
+    :return: The number of rows loaded
+    """
+    use_copy = connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2"
+    key_column = dict((column.name, column) for column in table.columns)[columns[0]]
+    count = 0
+    for batch in batches(rows, batch_size):
+        if skip_existing:
+            query = select([key_column]).where(key_column.in_([row[0] for row in batch]))
+            existing = set(key for key, in connection.execute(query))
+            batch = [row for row in batch if row[0] not in existing]
+            if not batch:
+                continue
+
+        if use_copy:
+            _copy_batch(connection, table, columns, batch)
+        else:
+            _insert_batch(connection, table, columns, batch)
+        count += len(batch)
+    return count
+
+
+def street_node_rows(street_network):
+    """
+    Generate the rows of the street_node table (see STREET_NODE_COLUMNS)
+    """
+    nids = street_network.nodes.get_ids()
+    for nid, (lat, lng) in zip(nids, street_network.nodes.get_coordinates(nids).tolist()):
+        yield int(nid), point_ewkb(lng, lat), lat, lng
+
+
+def street_edge_rows(street_network):
+    """
+    Generate the rows of the street_edge table (see STREET_EDGE_COLUMNS)
+    """
+    for street in street_network.get_ways():
+        coordinates = street_network.get_coordinates(street, lnglat=True)
+        x1, y1 = coordinates[0]
+        x2, y2 = coordinates[-1]
+        yield (int(street.id), linestring_ewkb(coordinates), x1, y1, x2, y2, street.type, int(street.nids[0]),
+               int(street.nids[-1]), False)
+
+
+def street_edge_parent_edge_rows(street_network):
+    """
+    Generate the rows of the street_edge_parent_edge table (see STREET_EDGE_PARENT_EDGE_COLUMNS)
+    """
+    for street in street_network.get_ways():
+        for parent_way_id in street.get_original_ways():
+            yield int(street.id), int(parent_way_id)
+
+
+def street_edge_street_node_rows(street_network):
+    """
+    Generate the rows of the street_edge_street_node table (see STREET_EDGE_STREET_NODE_COLUMNS)
+    """
+    for street in street_network.get_ways():
+        for node_id in street.get_node_ids():
+            yield int(street.id), int(node_id)
+
+
+def load_streets(connection, street_network, batch_size=BATCH_SIZE):
+    """
+    Load a street network into the street_node, street_edge, street_edge_parent_edge, and street_edge_street_node
+    tables. Street nodes that are already in the database are skipped. Call this in a transaction.
+
+    :param connection: An SQLAlchemy connection
+    :param street_network: A network of streets
+    :return: A dictionary of the number of rows loaded into each table
+    """
+    return {
+        "street_node": copy_rows(connection, StreetNodeTable.__table__, STREET_NODE_COLUMNS,
+                                 street_node_rows(street_network), batch_size, skip_existing=True),
+        "street_edge": copy_rows(connection, StreetEdgeTable.__table__, STREET_EDGE_COLUMNS,
+                                 street_edge_rows(street_network), batch_size),
+        "street_edge_parent_edge": copy_rows(connection, StreetEdgeParentEdgeTable.__table__,
+                                             STREET_EDGE_PARENT_EDGE_COLUMNS,
+                                             street_edge_parent_edge_rows(street_network), batch_size),
+        "street_edge_street_node": copy_rows(connection, StreetEdgeStreetNodeTable.__table__,
+                                             STREET_EDGE_STREET_NODE_COLUMNS,
+                                             street_edge_street_node_rows(street_network), batch_size)
+    }
+
+
+def _strip_record(line):
+    """
+    Strip the whitespace and the record separator of RFC 8142, which GeoJSONSeq records may start with, from a line
+    """
+    return line.strip().lstrip("\x1e").strip()
+
+
+def geojson_features(fileobj):
+    """
+    Iterate over the features of a GeoJSON file. Newline-delimited GeoJSON (GeoJSONSeq, see
+    writers.GeoJSONWriter) is read one line at a time. A FeatureCollection is loaded as a whole.
+
+    :param fileobj: A file object
+    :return: A generator of dictionaries of GeoJSON features
+    """
+    first = ""
+    while not first:
+        line = fileobj.readline()
+        if not line:
+            return
+        first = _strip_record(line)
+    try:
+        data = json.loads(first)
+    except ValueError:
+        # A FeatureCollection that spans several lines
+        data = json.loads(first + fileobj.read())
+
+    if data.get("type") == "FeatureCollection":
+        for feature in data["features"]:
+            yield feature
+        return
+
+    yield data
+    for line in fileobj:
+        line = _strip_record(line)
+        if line:
+            yield json.loads(line)
+
+
+def sidewalk_edge_rows(sidewalk_network, edge_ids, node_ids):
+    """
+    Generate the rows of the sidewalk_edge table (see SIDEWALK_EDGE_COLUMNS) from a sidewalk network
+
+    :param edge_ids: An IdAllocator that maps the way ids to 32-bit sidewalk_edge_id values
+    :param node_ids: An IdAllocator that maps the node ids to 32-bit source and target values
+    """
+    for sidewalk in sidewalk_network.get_ways():
+        coordinates = sidewalk_network.get_coordinates(sidewalk, lnglat=True)
+        x1, y1 = coordinates[0]
+        x2, y2 = coordinates[-1]
+        yield (edge_ids.map_osm_id(sidewalk.id), linestring_ewkb(coordinates), x1, y1, x2, y2, sidewalk.type,
+               node_ids.map_osm_id(sidewalk.nids[0]), node_ids.map_osm_id(sidewalk.nids[-1]), False)
+
+
+def sidewalk_edge_feature_rows(features, edge_ids, node_ids):
+    """
+    Generate the rows of the sidewalk_edge table (see SIDEWALK_EDGE_COLUMNS) from GeoJSON features, e.g., of
+    OSM.export_to(format="geojson"). Features that are not line strings (e.g., nodes) or that have no geometry are
+    skipped.
+
+    :param edge_ids: An IdAllocator that maps the way ids to 32-bit sidewalk_edge_id values
+    :param node_ids: An IdAllocator that maps the node ids to 32-bit source and target values
+    """
+    for feature in features:
+        if not feature.get("geometry") or feature["geometry"]["type"] != "LineString":
+            continue
+        coordinates = feature["geometry"]["coordinates"]
+        properties = feature["properties"]
+        edge_id = properties["way_id"] if "way_id" in properties else properties["sidewalk_edge_id"]
+        way_type = properties["way_type"] if "way_type" in properties else properties.get("type")
+        x1, y1 = coordinates[0]
+        x2, y2 = coordinates[-1]
+        yield (edge_ids.map_osm_id(edge_id), linestring_ewkb(coordinates), float(x1), float(y1), float(x2),
+               float(y2), way_type, node_ids.map_osm_id(properties["source"]),
+               node_ids.map_osm_id(properties["target"]), False)
+
+
+def load_sidewalks(connection, sidewalks, batch_size=BATCH_SIZE, edge_ids=None, node_ids=None):
+    """
+    Load sidewalks into the sidewalk_edge table. Call this in a transaction.
+
+    pgRouting assumes 32-bit ids, so the way and node ids are mapped with IdAllocator.map_osm_id: ids that fit in
+    32 bits are kept, and larger or already taken ids are given new ones instead of being truncated. Pass the same
+    allocators to load several networks without collisions, and use their get_osm_id to look up the original ids.
+
+    :param connection: An SQLAlchemy connection
+    :param sidewalks: A sidewalk network, or a file object of GeoJSON (see geojson_features)
+    :param edge_ids: An IdAllocator for the sidewalk_edge_id values
+    :param node_ids: An IdAllocator for the source and target values
+    :return: A dictionary of the number of rows loaded into each table
+    """
+    edge_ids = edge_ids if edge_ids is not None else IdAllocator()
+    node_ids = node_ids if node_ids is not None else IdAllocator()
+    if hasattr(sidewalks, "get_ways"):
+        rows = sidewalk_edge_rows(sidewalks, edge_ids, node_ids)
+    else:
+        rows = sidewalk_edge_feature_rows(geojson_features(sidewalks), edge_ids, node_ids)
+    return {"sidewalk_edge": copy_rows(connection, SidewalkEdgeTable.__table__, SIDEWALK_EDGE_COLUMNS, rows,
+                                       batch_size)}
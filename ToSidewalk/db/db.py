@@ -1,11 +1,82 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from urllib import quote
 import json
 import os
 
 Base = declarative_base()
 
+# The number of rows fetched at a time by DB.stream
+YIELD_PER = 1000
+
+# Engines shared by all the DB objects, keyed by the URL and the pool options (see get_engine)
+_engines = {}
+
+
+def read_settings(setting_file):
+    """
+    Read the database settings, e.g., {"username": "root", "database": "routing", "host": "localhost", "port": 5432}.
+    A "url" (e.g., "sqlite:///sidewalk.db") can be given instead of the connection parameters.
+
+    :param setting_file: A file name of a JSON settings file
+    :return: A dictionary of settings with the defaults filled in
+    """
+    with file(setting_file) as f:
+        j = json.loads(f.read())
+
+    settings = {
+        "username": "root",
+        "password": "",
+        "database": "routing",
+        "host": "localhost",
+        "port": None,
+        "url": None,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "server_side_cursors": False
+    }
+    settings.update(j)
+    return settings
+
+
+def get_url(settings):
+    """
+    Build the database URL from the settings (see read_settings)
+    """
+    if settings.get("url"):
+        return str(settings["url"])
+    user = quote(settings["username"], safe="")
+    if settings["password"]:
+        user += ":" + quote(settings["password"], safe="")
+    host = settings["host"]
+    if settings["port"]:
+        host += ":%d" % int(settings["port"])
+    return "postgresql://%s@%s/%s" % (user, host, settings["database"])
+
+
+def get_engine(url, pool_size=5, max_overflow=10, server_side_cursors=False):
+    """
+    Get an engine for the URL. Engines are created once per process and shared, so the DB objects that connect to
+    the same database share one connection pool.
+
+    :param url: A database URL
+    :param pool_size: The number of connections kept in the pool. Only used for PostgreSQL
+    :param max_overflow: The number of connections that can be opened beyond pool_size. Only used for PostgreSQL
+    :param server_side_cursors: If True, all the queries use server-side cursors. Streamed queries (see DB.stream)
+        use them either way. Only used for PostgreSQL
+    :return: An Engine object
+    """
+    key = (url, pool_size, max_overflow, server_side_cursors)
+    if key not in _engines:
+        if url.startswith("postgresql"):
+            _engines[key] = create_engine(url, echo=False, pool_size=pool_size, max_overflow=max_overflow,
+                                          server_side_cursors=server_side_cursors)
+        else:
+            # E.g., SQLite, which uses its own pool classes
+            _engines[key] = create_engine(url, echo=False)
+    return _engines[key]
+
 
 class DB(object):
 
@@ -14,31 +85,26 @@ class DB(object):
         http://gis.stackexchange.com/questions/147240/how-to-efficiently-use-a-postgres-db-with-python
         http://geoalchemy-2.readthedocs.org/en/latest/orm_tutorial.html
         """
-        with file(setting_file) as f:
-
-            j = json.loads(f.read())
-
-            if "username" in j:
-                user_name = j["username"]
-            else:
-                user_name = "root"
-
-            if "password" in j:
-                password = j["password"]
-            else:
-                password = ""
-
-            if "database" in j:
-                database_name = j["database"]
-            else:
-                database_name = "routing"
-
-        self.engine = create_engine('postgresql://%s@localhost/%s' % (user_name, database_name), echo=False)
+        settings = read_settings(setting_file)
+        self.engine = get_engine(get_url(settings), settings["pool_size"], settings["max_overflow"],
+                                 settings["server_side_cursors"])
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
 
+    def stream(self, entity, batch_size=YIELD_PER, **filters):
+        """
+        Query the rows of a table without loading them all, e.g., database.stream(StreetEdgeTable, deleted=False).
+        The rows are fetched batch_size at a time (with a server-side cursor on PostgreSQL).
+
+        :param entity: A mapped class, e.g., StreetEdgeTable or SidewalkEdgeTable
+        :param batch_size: The number of rows fetched at a time
+        :param filters: Column values to filter by (see Query.filter_by)
+        :return: An iterable of the mapped objects
+        """
+        query = self.session.query(entity).filter_by(**filters)
+        return query.execution_options(stream_results=True).yield_per(batch_size)
+
 
 if __name__ == "__main__":
     setting_file = os.path.relpath("../../", os.path.dirname(__file__)) + "/.settings"
     db = DB(setting_file)
-
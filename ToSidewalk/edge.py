@@ -1,19 +1,22 @@
-import os
+import numpy as np
+from math import sqrt
 from shapely.geometry import LineString
 
+from latlng import distance_in_meters_array
 
-class Edge(LineString):
+
+class Edge(object):
+    """
+    A straight segment between two nodes. Like LatLng, the shapely LineString is only created when a caller asks for
+    the geometry.
+    """
+    __slots__ = ('source', 'target', '_id', '_path', '_geometry')
     unique_id_counter = 0
 
     def __init__(self, source, target):
-        if os.name == 'posix':
-            # Need this because Shapely 1.3 for OS X has different constructor for LineString.
-            super(Edge, self).__init__([(source.lng, source.lat), (target.lng, target.lat)])
-        else:
-            super(Edge, self).__init__([source, target])
-
         self.source = source
         self.target = target
+        self._geometry = None
         source.append_edge(self)
         target.append_edge(self)
         self._id = self.get_uid()
@@ -31,6 +34,47 @@ class Edge(LineString):
     def path(self):
         return self._path
 
+    @property
+    def geometry(self):
+        """
+        A shapely LineString (in lng, lat) of this edge. It is created on the first access.
+        """
+        if self._geometry is None:
+            self._geometry = LineString(self.coords)
+        return self._geometry
+
+    @property
+    def __geo_interface__(self):
+        return {'type': 'LineString', 'coordinates': tuple(self.coords)}
+
+    @property
+    def coords(self):
+        return [(self.source.lng, self.source.lat), (self.target.lng, self.target.lat)]
+
+    @property
+    def xy(self):
+        return [self.source.lng, self.target.lng], [self.source.lat, self.target.lat]
+
+    @property
+    def bounds(self):
+        return (min(self.source.lng, self.target.lng), min(self.source.lat, self.target.lat),
+                max(self.source.lng, self.target.lng), max(self.source.lat, self.target.lat))
+
+    def distance(self, other):
+        """
+        Planar (i.e., shapely) distance in degrees to another geometry such as a LatLng, an Edge, or a shapely object
+        """
+        return self.geometry.distance(getattr(other, 'geometry', other))
+
+    @property
+    def length(self):
+        """
+        Length of this edge in degrees (i.e., the planar length of the LineString)
+        """
+        dx = self.target.lng - self.source.lng
+        dy = self.target.lat - self.source.lat
+        return sqrt(dx * dx + dy * dy)
+
     @path.setter
     def path(self, p):
         self._path = p
@@ -44,6 +88,22 @@ class Edge(LineString):
     def __reduce__(self):
         return (self.__class__, (self.source, self.target))
 
+
+def get_lengths(edges, in_meters=False):
+    """
+    Vectorized version of Edge.get_length
+
+    :param edges: A list of Edge objects
+    :param in_meters: If True, the lengths are great circle distances in meters. Otherwise they are in degrees
+    :return: An array of lengths
+    """
+    sources = np.array([(edge.source.lat, edge.source.lng) for edge in edges], dtype=np.float64).reshape(-1, 2)
+    targets = np.array([(edge.target.lat, edge.target.lng) for edge in edges], dtype=np.float64).reshape(-1, 2)
+    if in_meters:
+        return distance_in_meters_array(sources, targets)
+    d = targets - sources
+    return np.sqrt(d[:, 1] * d[:, 1] + d[:, 0] * d[:, 0])
+
 if __name__ == "__main__":
     from node import Node
     source = Node(0, 0., 0.)
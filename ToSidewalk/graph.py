@@ -1,8 +1,13 @@
 import numpy as np
+from collections import deque
+from cStringIO import StringIO
 from node import Node
-from edge import Edge
+from adjacency import Adjacency
+from edge import Edge, get_lengths
+from ids import IdAllocator
 from path import Path
-from utilities import window
+from utilities import window, iterparse_osm, highway_node_ids
+from writers import GeoJSONWriter, OSMWriter
 from types import *
 
 import sys
@@ -14,8 +19,8 @@ class GeometricGraph(object):
     def __init__(self):
         self.nodes = {}
         self.paths = {}
-        self.node_id_counter = 0
-        self.path_id_counter = 0
+        self.node_ids = IdAllocator(start=0)
+        self.path_ids = IdAllocator(start=0)
         self.bounds = None
 
     @property
@@ -54,6 +59,7 @@ class GeometricGraph(object):
         """
         if int(node.id) not in self.nodes:
             self.nodes[int(node.id)] = node
+            self.node_ids.reserve(int(node.id))
 
     def create_node(self, x, y, id=None):
         """
@@ -65,8 +71,9 @@ class GeometricGraph(object):
         :return:
         """
         if not id:
-            id = self.node_id_counter
-            self.node_id_counter += 1
+            id = self.node_ids.allocate()
+        else:
+            self.node_ids.reserve(id)
 
         assert type(x) == FloatType
         assert type(y) == FloatType
@@ -82,6 +89,7 @@ class GeometricGraph(object):
         """
         if path.id not in self.paths:
             self.paths[path.id] = path
+            self.path_ids.reserve(path.id)
 
     def create_path(self, **kwargs):
         """
@@ -92,10 +100,10 @@ class GeometricGraph(object):
         :return:
         """
         if "id" not in kwargs:
-            id = self.path_id_counter
-            self.path_id_counter += 1
+            id = self.path_ids.allocate()
         else:
             id = kwargs["id"]
+            self.path_ids.reserve(id)
 
         if "nodes" in kwargs:
             edges = [Edge(source, target) for source, target in window(kwargs["nodes"], 2)]
@@ -156,6 +164,16 @@ class GeometricGraph(object):
         """
         return self.paths.values()
 
+    def get_adjacency(self):
+        """
+        Build a CSR adjacency snapshot of this graph over the node ids. Each edge contributes one neighbor, so the
+        degree of a node is the number of its edges. Build a new snapshot after modifying the graph.
+
+        :return: An Adjacency object
+        """
+        edges = [(edge.source.id, edge.target.id) for path in self.get_paths() for edge in path.edges]
+        return Adjacency.from_edges(self.nodes.keys(), edges)
+
     def get_adjacent_nodes(self, node):
         """
         This method returns a set of nodes that are connected to the given node.
@@ -182,7 +200,8 @@ class GeometricGraph(object):
 
         :return: A list of (degree, node)
         """
-        return [(len(node.edges), node) for node in self.nodes.values()]
+        adjacency = self.get_adjacency()
+        return [(degree, self.nodes[key]) for key, degree in zip(adjacency.keys, adjacency.degrees().tolist())]
 
     @staticmethod
     def get_connected_paths(node):
@@ -266,6 +285,7 @@ class GeometricGraph(object):
                 new_edge.path = path
                 path.remove_edge(old_edge)
                 path.edges.insert(e_idx, new_edge)
+        path.invalidate_nodes()
 
     def swap_edge_node(self, edge, node_from, node_to):
         """
@@ -286,6 +306,7 @@ class GeometricGraph(object):
         idx = path.edges.index(edge)
         path.remove_edge(edge)
         path.edges.insert(idx, new_edge)
+        path.invalidate_nodes()
 
     def swap_edge(self, edge, nodes_from, nodes_to):
         """
@@ -306,6 +327,7 @@ class GeometricGraph(object):
         new_edge.path = path
         path.remove_edge(edge)
         path.edges.append(new_edge)
+        path.invalidate_nodes()
 
     def remove_node(self, node_id):
         """
@@ -367,6 +389,13 @@ class GeometricGraph(object):
         Path.copy_properties(path, path2)
         del self.paths[path.id]
 
+    def __reduce__(self):
+        """
+        Pickle the graph as plain data, e.g., to send it to a worker process (see graph_state and rebuild_graph)
+        """
+        return (rebuild_graph, graph_state(self.get_paths(), self.get_nodes(), self._bounds) +
+                (self.node_ids, self.path_ids))
+
     def subgraph(self, bounds, remove=False):
         """
         Extract a subgraph that is in the area bounded by the boudning box (minlat, minlng, maxlat, maxlng)
@@ -374,20 +403,15 @@ class GeometricGraph(object):
         :param bounds: (minlat, minlng, maxlat, maxlng)
         :return:
         """
-        from shapely.geometry import Polygon
-        coords = ((bounds[1], bounds[0]),
-                  (bounds[3], bounds[0]),
-                  (bounds[3], bounds[2]),
-                  (bounds[1], bounds[2]),
-                  (bounds[1], bounds[0]))
-        bounding_box = Polygon(coords)
         nodes = self.get_nodes()
+        latlngs = np.array([(node.lat, node.lng) for node in nodes]).reshape(-1, 2)
+        inside = (latlngs[:, 0] > bounds[0]) & (latlngs[:, 0] < bounds[2]) & \
+            (latlngs[:, 1] > bounds[1]) & (latlngs[:, 1] < bounds[3])
 
         # Get all the paths to extract
         paths = []
-        for node in nodes:
-            if bounding_box.contains(node):
-                paths += node.paths
+        for i in np.flatnonzero(inside):
+            paths += nodes[i].paths
         paths = set(paths)
 
         if not paths:
@@ -442,91 +466,100 @@ class GeometricGraph(object):
         """
         Todo
         """
-        if format == "geojson":
-            import json
-            geojson = {}
-            geojson['type'] = "FeatureCollection"
-            geojson['features'] = []
-
-            for path in self.get_paths():
-                geojson['features'].append(path.geojson_feature)
-
-            return json.dumps(geojson)
-        elif format == "osm":
-            header_string = """<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">"""
-            bounding_box_string = """<bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>""" % tuple(map(str, self.bounds))
-
-            node_to_node_element = lambda n: """<node id="%s" lat="%s" lon="%s" osm_id="%s"/>""" % (str(n.id), str(n.lat), str(n.lng), str(n.osm_id))
-            nodes_string = "\n".join(map(node_to_node_element, self.get_nodes()))
-
-            ways_string_list = []
-            node_to_nd_element = lambda n: """  <nd ref="%s"/>""" % str(n.id)
-            osm_id_to_tag_element = lambda tag: """  <tag k="osm_id" v="%s"/>""" % str(tag)
-            for path in self.get_paths():
-                ways_string_list.append("<way id=\"%s\">" % str(path.id))
-                ways_string_list += map(node_to_nd_element, path.get_nodes())
-                ways_string_list += map(osm_id_to_tag_element, path.osm_ids)
-                ways_string_list.append("</way>")
-            ways_string = "\n".join(ways_string_list)
-            osm_string = "\n".join((header_string, bounding_box_string, nodes_string, ways_string, "</osm>"))
-            return osm_string
+        output = StringIO()
+        self.export_to(output, format)
+        return output.getvalue()
+
+    def export_to(self, fileobj, format="osm", compress=False):
+        """
+        Write the graph to a file object in chunks (see writers.ChunkedWriter), so exporting a large graph does not
+        build the whole document in memory.
+
+        :param fileobj: A file object opened for writing in binary mode
+        :param format: "osm", "geojson" (a FeatureCollection), or "geojsonseq" (newline-delimited GeoJSON features)
+        :param compress: If True, the output is gzip-compressed
+        """
+        if format == "osm":
+            with OSMWriter(fileobj, compress) as writer:
+                writer.start(self.bounds)
+                for node in self.get_nodes():
+                    attributes = [("id", node.id), ("lat", node.lat), ("lon", node.lng)]
+                    if getattr(node, "osm_id", None) is not None:
+                        attributes.append(("osm_id", node.osm_id))
+                    writer.node(attributes)
+
+                for path in self.get_paths():
+                    tags = [("highway", path.way_type)] if path.way_type is not None else []
+                    tags += [("osm_id", osm_id) for osm_id in path.osm_ids]
+                    writer.way((("id", path.id),), [node.id for node in path.get_nodes()], tags)
+                writer.end()
+        elif format in ("geojson", "geojsonseq"):
+            with GeoJSONWriter(fileobj, format == "geojsonseq", compress) as writer:
+                writer.start()
+                for path in self.get_paths():
+                    writer.feature(path.geojson_feature)
+                writer.end()
         else:
-            raise ValueError("format should be either 'geojson' or 'osm'")
+            raise ValueError("format should be either 'geojson', 'geojsonseq', or 'osm'")
 
 
-def parse_osm(filename, valid_highways={'primary', 'secondary', 'tertiary', 'residential'}):
+def parse_osm(filename, valid_highways={'primary', 'secondary', 'tertiary', 'residential'}, highway_nodes_only=False):
     """
-    Parse an OSM file
+    Parse an OSM file. The file is streamed with utilities.iterparse_osm, so the whole element tree is never held
+    in memory.
+
+    :param filename: A file name of an OSM file
+    :param valid_highways: Highway tag values of the ways to parse
+    :param highway_nodes_only: If True, parse the file in two passes and only create the nodes that are referenced
+        by the ways in valid_highways
     """
     debug("Opening the file: %s" % filename)
 
-    from xml.etree import cElementTree as ET
-    with open(filename, "rb") as osm:
-        # Find element
-        # http://stackoverflow.com/questions/222375/elementtree-xpath-select-element-based-on-attribute
-        tree = ET.parse(osm)
-        nodes_tree = tree.findall(".//node")
-        ways_tree = tree.findall(".//way")
-        bounds_elem = tree.find(".//bounds")
-        padding = 5e-2
-        bounds = [float(bounds_elem.get("minlat")) - padding,
-                  float(bounds_elem.get("minlon")) - padding,
-                  float(bounds_elem.get("maxlat")) + padding,
-                  float(bounds_elem.get("maxlon")) + padding]
+    referenced_node_ids = None
+    if highway_nodes_only:
+        with open(filename, "rb") as osm:
+            referenced_node_ids = highway_node_ids(osm, valid_highways)
 
     debug("Started parsing the file...")
     geometric_graph = GeometricGraph()
-    geometric_graph.bounds = bounds
-
-    osm_id_to_node_id = {}
-    for node in nodes_tree:
-        try:
-            n = geometric_graph.create_node(x=float(node.get("lon")), y=float(node.get("lat")))
-            if node.get("osm_id"):
-                n.osm_id = int(node.get("osm_id"))
-            else:
-                n.osm_id = int(node.get("id"))
-            assert n.osm_id != None
-
-            osm_id_to_node_id[n.osm_id] = int(n.id)
-
-            for tag in node.findall('tag'):
-                n.tags.append(tag)
-        except AssertionError:
-            raise
-
-    # Parse ways
-    for way in ways_tree:
-        highway_tag = way.find(".//tag[@k='highway']")
-        if highway_tag is not None and highway_tag.get("v") in valid_highways:
-            node_elements = filter(lambda elem: elem.tag == "nd", list(way))
-            nodes = [geometric_graph.get_node(osm_id_to_node_id[int(element.get("ref"))]) for element in node_elements]
-            path = geometric_graph.create_path(nodes=nodes)
-            path.way_type = highway_tag.get('v')
-            path.osm_ids.append(int(way.get("id")))
-            for tag in way.findall('tag'):
-                if tag.attrib['k'] != "highway":
-                    path.tags.append(tag.attrib)
+    node_id_mapping = {}  # Maps the node ids in the file, which nd elements refer to, to the node ids in the graph
+    with open(filename, "rb") as osm:
+        for elem in iterparse_osm(osm):
+            if elem.tag == "node":
+                node = elem
+                if node.get("osm_id"):
+                    osm_id = int(node.get("osm_id"))
+                else:
+                    osm_id = int(node.get("id"))
+                if referenced_node_ids is not None and int(node.get("id")) not in referenced_node_ids:
+                    continue
+
+                n = geometric_graph.create_node(x=float(node.get("lon")), y=float(node.get("lat")))
+                n.osm_id = osm_id
+                geometric_graph.node_ids.add_osm_id(n.id, osm_id)
+                node_id_mapping[int(node.get("id"))] = n.id
+
+                for tag in node.findall('tag'):
+                    n.tags.append(tag.attrib)
+            elif elem.tag == "way":
+                way = elem
+                highway_tag = way.find(".//tag[@k='highway']")
+                if highway_tag is not None and highway_tag.get("v") in valid_highways:
+                    node_elements = filter(lambda e: e.tag == "nd", list(way))
+                    nodes = [geometric_graph.get_node(node_id_mapping.get(int(element.get("ref"))))
+                             for element in node_elements]
+                    path = geometric_graph.create_path(nodes=nodes)
+                    path.way_type = highway_tag.get('v')
+                    path.osm_ids.append(int(way.get("id")))
+                    for tag in way.findall('tag'):
+                        if tag.attrib['k'] != "highway":
+                            path.tags.append(tag.attrib)
+            elif elem.tag == "bounds":
+                padding = 5e-2
+                geometric_graph.bounds = [float(elem.get("minlat")) - padding,
+                                          float(elem.get("minlon")) - padding,
+                                          float(elem.get("maxlat")) + padding,
+                                          float(elem.get("maxlon")) + padding]
 
     return geometric_graph
 
@@ -540,26 +573,37 @@ def remove_short_edges(graph, distance_threshold=15):
     """
     paths = graph.get_paths()
     debug("Size of the graph. N_path=%s" % str(len(paths)))
+
+    # Measure all the original edges with one vectorized call. Only the merged edges are measured one by one.
+    original_edges = [edge for path in paths if len(path.edges) >= 2 for edge in path.edges]
+    lengths = dict(zip(original_edges, get_lengths(original_edges, in_meters=True)))
+
+    def length_in_meters(edge):
+        length = lengths.get(edge)
+        return edge.get_length(in_meters=True) if length is None else length
+
     for path in paths:
         if len(path.edges) < 2:
             continue
 
-        edges = list(path.edges)
+        # Merge the edges front to back. path.edges is replaced once at the end, so join_edges is used instead of
+        # merge_edges, which would update the list of edges for every merge.
+        edges = deque(path.edges)
         new_edges = []
 
         while edges:
-            edge = edges.pop(0)
-            if edge.get_length(in_meters=True) < distance_threshold and len(edges) > 0:
-                other = edges.pop(0)
-                new_edge = path.merge_edges(edge, other)
-                edges.insert(0, new_edge)
+            edge = edges.popleft()
+            if length_in_meters(edge) < distance_threshold and len(edges) > 0:
+                other = edges.popleft()
+                new_edge = path.join_edges(edge, other)
+                edges.appendleft(new_edge)
             else:
                 new_edges.append(edge)
 
-        if len(new_edges) > 1 and new_edges[-1].get_length(in_meters=True) < distance_threshold:
+        if len(new_edges) > 1 and length_in_meters(new_edges[-1]) < distance_threshold:
             edge_1 = new_edges.pop()
             edge_2 = new_edges.pop()
-            new_edge = path.merge_edges(edge_1, edge_2)
+            new_edge = path.join_edges(edge_1, edge_2)
             new_edges.append(new_edge)
 
         path.edges = new_edges
@@ -578,12 +622,28 @@ def clean_edge_segmentation(graph):
     :return:
     """
     debug("Started cleaning edge segmentation...")
-    queue = graph.get_paths()
+    # Index the nodes that connect exactly two edges. Merging paths reuses their edges, so the degrees of the nodes
+    # do not change while cleaning and the index stays valid. Only the paths that end at one of these nodes can be
+    # merged, so the other paths are not queued at all.
+    adjacency = graph.get_adjacency()
+    degree_2_nodes = set(graph.nodes[adjacency.keys[i]] for i in np.flatnonzero(adjacency.degrees() == 2))
+
+    def is_segmented(path):
+        nodes = path.get_nodes()
+        return nodes[0] in degree_2_nodes or nodes[-1] in degree_2_nodes
+
+    # A work queue of paths. Merged paths are dropped from queued_path_ids and skipped when they are popped.
+    queue = deque(path for path in graph.get_paths() if is_segmented(path))
+    queued_path_ids = set(path.id for path in queue)
     while queue:
-        path = queue.pop(0)
+        path = queue.popleft()
+        if path.id not in queued_path_ids:
+            continue
+        queued_path_ids.remove(path.id)
+
         nodes = path.get_nodes()
         for node in [nodes[0], nodes[-1]]:
-            if len(node.edges) == 2:
+            if node in degree_2_nodes:
                 # Fix the segmentation by merging the two paths. Get the two path, sort the
                 # edges, and concatenate.
                 path1, path2 = node.edges[0].path, node.edges[1].path
@@ -598,12 +658,10 @@ def clean_edge_segmentation(graph):
                     debug(path2)
                     raise
 
-                if path1 in queue:
-                    queue.remove(path1)
-                if path2 in queue:
-                    queue.remove(path2)
-
+                queued_path_ids.discard(path1.id)
+                queued_path_ids.discard(path2.id)
                 queue.append(new_path)
+                queued_path_ids.add(new_path.id)
 
     return graph
 
@@ -615,37 +673,160 @@ def split_path(graph):
     :param graph:
     :return:
     """
-    intersection_nodes = filter(lambda node: node.is_intersection(), graph.get_nodes())
+    intersection_nodes = [graph.nodes[key] for key in graph.get_adjacency().intersections()]
     for node in intersection_nodes:
         for path in node.paths:
             graph.split_path(path, node)
     return graph
 
 
-def split_graph(graph, rows, columns, remove=False, pool=None):
+def graph_state(paths, nodes=None, bounds=None):
     """
-    This method splits the graph into row x col sub graphs
+    Describe paths (and their nodes) as plain data that can be pickled and sent across processes. This is the
+    inverse of rebuild_graph.
 
+    :param paths: A list of Path objects
+    :param nodes: A list of Node objects. Defaults to the nodes of the paths
+    :param bounds: The bounds of the graph
+    :return: A tuple of (bounds, node rows, path rows)
+    """
+    if nodes is None:
+        nodes = list(set(node for path in paths for node in path.get_nodes()))
+    node_rows = [(node.id, node.lat, node.lng, getattr(node, 'osm_id', None), list(node.tags)) for node in nodes]
+    path_rows = [(path.id, [(edge.source.id, edge.target.id) for edge in path.edges], path.way_type, list(path.tags),
+                  list(path.osm_ids)) for path in paths]
+    return bounds, node_rows, path_rows
 
-    :param rows: a number of rows
-    :param columns: a number of columns
-    :return:
+
+def rebuild_graph(bounds, node_rows, path_rows, node_ids=None, path_ids=None):
     """
-    dlat = (graph.bounds[2] - graph.bounds[0]) / rows
-    dlng = (graph.bounds[3] - graph.bounds[1]) / columns
+    Build a graph from plain data (see graph_state). The nodes and the paths are added in the order of their ids, so
+    the same data always gives the same graph.
 
-    from itertools import product
-    rows_columns = product(range(rows), range(columns))
+    :return: A GeometricGraph object
+    """
+    graph = GeometricGraph()
+    graph.bounds = bounds
+    for nid, lat, lng, osm_id, tags in sorted(node_rows, key=lambda row: row[0]):
+        node = Node(nid, lat, lng)
+        if osm_id is not None:
+            node.osm_id = osm_id
+        node.tags = tags
+        graph.add_node(node)
+
+    for path_id, edges, way_type, tags, osm_ids in sorted(path_rows, key=lambda row: row[0]):
+        path = Path(path_id, [Edge(graph.nodes[source], graph.nodes[target]) for source, target in edges])
+        path.way_type = way_type
+        path.tags = tags
+        path.osm_ids = osm_ids
+        graph.add_path(path)
+
+    if node_ids is not None:
+        graph.node_ids = node_ids
+    if path_ids is not None:
+        graph.path_ids = path_ids
+    return graph
+
+
+def _rebuild_graph(state):
+    """
+    Build a graph from graph_state(...). Defined at the module level so that it can be run by a worker process.
+    """
+    return rebuild_graph(*state)
+
+
+def _make_cell_sidewalks(args):
+    """
+    Build the subgraph of a cell and run the street cleaning and sidewalk generation on it. Defined at the module
+    level so that it can be run by a worker process.
+    """
+    state, distance_to_sidewalk = args
+    graph = rebuild_graph(*state)
+    graph = clean_edge_segmentation(graph)
+    graph = split_path(graph)
+    graph = remove_short_edges(graph)
+    return make_sidewalks(graph, distance_to_sidewalk)
 
-    to_bound = lambda row_column: (graph.bounds[0] + row_column[0] * dlat, graph.bounds[1] + row_column[1] * dlng,
-                             graph.bounds[0] + (row_column[0] + 1) * dlat, graph.bounds[1] + (row_column[1] + 1) * dlng)
-    to_subgraph = lambda bound: graph.subgraph(bound, remove=remove)
-    bounds = map(to_bound, rows_columns)
 
+def get_cell_states(graph, rows, columns, remove=False):
+    """
+    Partition the paths of a graph into a grid of rows x columns cells over graph.bounds. Every node is assigned to
+    a cell in one vectorized pass, and a path goes to the cells of all its nodes. Nodes outside the bounds are not in
+    any cell.
+
+    :param remove: If True, each path only goes to the first cell (in row-major order) and is removed from the graph
+    :return: A list of graph_state tuples in row-major order. The entry of a cell without paths is None
+    """
+    lat_min, lng_min, lat_max, lng_max = graph.bounds
+    dlat = (lat_max - lat_min) / rows
+    dlng = (lng_max - lng_min) / columns
+
+    nodes = graph.get_nodes()
+    latlngs = np.array([(node.lat, node.lng) for node in nodes]).reshape(-1, 2)
+    node_rows = np.floor((latlngs[:, 0] - lat_min) / dlat).astype(np.int64)
+    node_columns = np.floor((latlngs[:, 1] - lng_min) / dlng).astype(np.int64)
+    # Nodes on the upper edges of the bounds belong to the last row and column
+    node_rows[latlngs[:, 0] == lat_max] = rows - 1
+    node_columns[latlngs[:, 1] == lng_max] = columns - 1
+    inside = (node_rows >= 0) & (node_rows < rows) & (node_columns >= 0) & (node_columns < columns)
+    cells = np.where(inside, node_rows * columns + node_columns, -1).tolist()
+    cell_of = dict(zip(nodes, cells))
+
+    cell_paths = [[] for _ in range(rows * columns)]
+    for path in graph.get_paths():
+        path_cells = sorted(set(cell_of[node] for node in path.get_nodes()) - {-1})
+        if remove:
+            path_cells = path_cells[:1]
+        for cell in path_cells:
+            cell_paths[cell].append(path)
+
+    states = []
+    for row in range(rows):
+        for column in range(columns):
+            paths = cell_paths[row * columns + column]
+            bounds = [lat_min + row * dlat, lng_min + column * dlng,
+                      lat_min + (row + 1) * dlat, lng_min + (column + 1) * dlng]
+            states.append(graph_state(paths, bounds=bounds) if paths else None)
+
+    if remove:
+        for paths in cell_paths:
+            for path in paths:
+                graph.remove_path(path.id)
+    return states
+
+
+def split_graph(graph, rows, columns, remove=False, pool=None):
+    """
+    This method splits the graph into row x col sub graphs (see get_cell_states). The subgraphs are copies, so they
+    can be modified without changing the graph or each other.
+
+    :param rows: a number of rows
+    :param columns: a number of columns
+    :param remove: If True, the paths are removed from the graph and each path is copied to one subgraph only
+    :param pool: A multiprocessing pool. If given, the subgraphs are built by its workers
+    :return: A list of subgraphs in row-major order. The entry of a cell without paths is None
+    """
     debug("Start splitting the graph...")
-    return map(to_subgraph, bounds)
+    states = get_cell_states(graph, rows, columns, remove)
+    tasks = [state for state in states if state is not None]
+    subgraphs = iter(pool.map(_rebuild_graph, tasks) if pool is not None else map(_rebuild_graph, tasks))
+    return [next(subgraphs) if state is not None else None for state in states]
 
 
+def make_sidewalks_in_cells(graph, rows, columns, distance_to_sidewalk=15, pool=None):
+    """
+    Split the graph into a grid of cells and make the sidewalks of each cell. The subgraph of each cell is built and
+    cleaned (clean_edge_segmentation, split_path, and remove_short_edges), and its sidewalks are made, by one task,
+    so with a pool the cells are processed in parallel.
+
+    :param pool: A multiprocessing pool. If None, the cells are processed in the calling process
+    :return: A list of sidewalk graphs in row-major order. The entry of a cell without paths is None
+    """
+    states = get_cell_states(graph, rows, columns)
+    tasks = [(state, distance_to_sidewalk) for state in states if state is not None]
+    sidewalk_graphs = iter(pool.map(_make_cell_sidewalks, tasks) if pool is not None else
+                           map(_make_cell_sidewalks, tasks))
+    return [next(sidewalk_graphs) if state is not None else None for state in states]
 
 
 def merge_graph(graph1, graph2):
@@ -695,51 +876,82 @@ def make_sidewalks(street_graph, distance_to_sidewalk=15):
     Street:     *------*------*------*
     Sidewalk 2: +------+------+------+
 
+    The coordinates of all the sidewalk nodes, and then of all the crosswalk nodes, are computed in bulk on arrays.
+    The sidewalk edges that end at an intersection are looked up in index tables built while creating the sidewalks.
+
     Todo: Move this function to ToSidewalk.py
 
     :param graph:
     :return:
     """
-    import math
-    import numpy as np
-    from utilities import latlng_offset_size
-    from itertools import chain, product
+    from latlng import vector_to_array
+    from utilities import latlng_offset_size_array
+
+    def coordinates_of(nodes):
+        return np.array([(node.lat, node.lng) for node in nodes], dtype=np.float64).reshape(-1, 2)
+
+    def normalize(vectors):
+        vectors /= np.sqrt(vectors[:, 0] * vectors[:, 0] + vectors[:, 1] * vectors[:, 1])[:, np.newaxis]
+        return vectors
 
     sidewalk_graph = GeometricGraph()
 
     # Create sidewalks
-    for path in street_graph.get_paths():
+    # First compute the sidewalk coordinates on each side of every street node. Use three consecutive nodes to
+    # calculate the correct angle to place the sidewalk nodes. The nodes of all the paths are concatenated.
+    street_paths = street_graph.get_paths()
+    street_path_nodes = [path.get_nodes() for path in street_paths]
+    lengths = np.array([len(nodes) for nodes in street_path_nodes], dtype=np.intp)
+    ends = np.cumsum(lengths) - 1
+    starts = ends - lengths + 1
+    curr = coordinates_of([node for nodes in street_path_nodes for node in nodes])
+
+    prev = np.empty_like(curr)
+    prev[1:] = curr[:-1]
+    next_ = np.empty_like(curr)
+    next_[:-1] = curr[1:]
+    # Temporary neighbors of the end nodes to calculate vec_curr_to_sidewalk
+    prev[starts] = curr[starts] - (next_[starts] - curr[starts])
+    next_[ends] = curr[ends] - (prev[ends] - curr[ends])
+
+    # Calculate the angle from the current node to the sidewalk nodes.
+    vec_curr_to_prev = vector_to_array(curr, prev, normalize=True)
+    vec_curr_to_next = vector_to_array(curr, next_, normalize=True)
+    vec_curr_to_sidewalk = vec_curr_to_prev + vec_curr_to_next
+
+    # vec_curr_to_sidewalk is 0 if you are using temporary node for prev_node or next_node. Take care of it.
+    # Then normalize the vector.
+    norms = np.sqrt(vec_curr_to_sidewalk[:, 0] * vec_curr_to_sidewalk[:, 0] +
+                    vec_curr_to_sidewalk[:, 1] * vec_curr_to_sidewalk[:, 1])
+    degenerate = norms < 1e-10
+    vec_curr_to_sidewalk[degenerate] = np.column_stack((vec_curr_to_next[degenerate, 1],
+                                                        - vec_curr_to_next[degenerate, 0]))
+    vec_curr_to_sidewalk = normalize(vec_curr_to_sidewalk)
+
+    d = latlng_offset_size_array(curr[:, 0], vector=vec_curr_to_sidewalk, distance=distance_to_sidewalk)
+    latlng_1 = curr + vec_curr_to_sidewalk * d[:, np.newaxis]
+    latlng_2 = curr - vec_curr_to_sidewalk * d[:, np.newaxis]
+
+    # Figure out which side you want to put each node
+    vec_curr_to_sidewalk_node_1 = latlng_1 - curr
+    node_1_first = (vec_curr_to_next[:, 0] * vec_curr_to_sidewalk_node_1[:, 1] -
+                    vec_curr_to_next[:, 1] * vec_curr_to_sidewalk_node_1[:, 0]) > 0
+
+    # Then create the sidewalk nodes and paths. sidewalk_table maps a street path id to a tuple of
+    # (street nodes, the first index of each street node, (sidewalk nodes 1, sidewalk nodes 2),
+    # (sidewalk path 1, sidewalk path 2), node_1_first of the street nodes)
+    sidewalk_table = {}
+    for path, street_nodes, start in zip(street_paths, street_path_nodes, starts):
         sidewalk_nodes_1 = []
         sidewalk_nodes_2 = []
-
-        # Create sidewalk nodes
-        # First make new sidewalk nodes on each side of each street node. Use three consecutive
-        # nodes to calculate the correct angle to place the sidewalk nodes.
-        for prev_node, curr_node, next_node in window(path.get_nodes(), 3, padding=1):
-            if not prev_node:
-                vec_prev = curr_node.vector() - curr_node.vector_to(next_node)  # v is a vec of (lat, lng)
-                prev_node = Node(-1, vec_prev[0], vec_prev[1])  # a temporary node to calculate vec_curr_to_sidewalk
-            elif not next_node:
-                vec_next = curr_node.vector() - curr_node.vector_to(prev_node)
-                next_node = Node(-1, vec_next[0], vec_next[1])
-
-            # Calculate the angle from the current node to the sidewalk nodes.
-            vec_curr_to_prev = curr_node.vector_to(prev_node, normalize=True)
-            vec_curr_to_next = curr_node.vector_to(next_node, normalize=True)
-            vec_curr_to_sidewalk = vec_curr_to_prev + vec_curr_to_next
-
-            # vec_curr_to_sidewalk is 0 if you are using temporary node for prev_node or next_node. Take care of it.
-            # Then normalize the vector.
-            if np.linalg.norm(vec_curr_to_sidewalk) < 1e-10:
-                vec_curr_to_sidewalk = np.array([vec_curr_to_next[1], -vec_curr_to_next[0]])
-            vec_curr_to_sidewalk /= np.linalg.norm(vec_curr_to_sidewalk)
+        for i, curr_node in enumerate(street_nodes):
+            row = start + i
+            prev_node = street_nodes[i - 1] if i > 0 else Node(-1, prev[row, 0], prev[row, 1])
+            next_node = street_nodes[i + 1] if i < len(street_nodes) - 1 else Node(-1, next_[row, 0], next_[row, 1])
 
             # Create two sidewalk nodes next to the current node
-            d = latlng_offset_size(curr_node.lat, vector=vec_curr_to_sidewalk, distance=distance_to_sidewalk)
-            latlng_1 = np.array([curr_node.lat, curr_node.lng]) + vec_curr_to_sidewalk * d
-            latlng_2 = np.array([curr_node.lat, curr_node.lng]) - vec_curr_to_sidewalk * d
-            sidewalk_node_1 = sidewalk_graph.create_node(float(latlng_1[1]), float(latlng_1[0]))
-            sidewalk_node_2 = sidewalk_graph.create_node(float(latlng_2[1]), float(latlng_2[0]))
+            sidewalk_node_1 = sidewalk_graph.create_node(float(latlng_1[row, 1]), float(latlng_1[row, 0]))
+            sidewalk_node_2 = sidewalk_graph.create_node(float(latlng_2[row, 1]), float(latlng_2[row, 0]))
             sidewalk_node_1.parents = [prev_node, curr_node, next_node]
             sidewalk_node_2.parents = [prev_node, curr_node, next_node]
 
@@ -747,98 +959,118 @@ def make_sidewalks(street_graph, distance_to_sidewalk=15):
                 curr_node.children = {}
             curr_node.children.setdefault(path.id, []).append(sidewalk_node_1)
             curr_node.children[path.id].append(sidewalk_node_2)
-            # for n in [prev_node, curr_node, next_node]:
-            #     if not hasattr(n, 'children'):
-            #         n.children = {}
-            #     n.children.setdefault(path.id, []).append(sidewalk_node_1)
-            #     n.children[path.id].append(sidewalk_node_2)
-
-            # Figure out which side you want to put each node
-            vec_curr_to_sidewalk_node_1 = curr_node.vector_to(sidewalk_node_1)
-            if np.cross(vec_curr_to_next, vec_curr_to_sidewalk_node_1) > 0:
+
+            if node_1_first[row]:
                 sidewalk_nodes_1.append(sidewalk_node_1)
                 sidewalk_nodes_2.append(sidewalk_node_2)
             else:
                 sidewalk_nodes_2.append(sidewalk_node_1)
                 sidewalk_nodes_1.append(sidewalk_node_2)
 
-        sidewalk_graph.create_path(nodes=sidewalk_nodes_1)
-        sidewalk_graph.create_path(nodes=sidewalk_nodes_2)
+        sidewalk_path_1 = sidewalk_graph.create_path(nodes=sidewalk_nodes_1)
+        sidewalk_path_2 = sidewalk_graph.create_path(nodes=sidewalk_nodes_2)
 
-    # Create crosswalks
-    intersection_nodes = [node for node in street_graph.get_nodes() if node.is_intersection()]
-    edges_to_swap = {}
-    for intersection_node in intersection_nodes:
-        adjacent_nodes = street_graph.get_adjacent_nodes(intersection_node)
-        adjacent_nodes = sort_nodes(intersection_node, adjacent_nodes)
-
-        if len(adjacent_nodes) == 3:
-            # Take care of the case where len(adj_nodes) == 3.
-            # Identify the largest angle that are formed by three segments
-            # Make a dummy node between two vectors that form the largest angle
-            vectors = [intersection_node.vector_to(adjacent_node, normalize=True) for adjacent_node in adjacent_nodes]
-            angles = [math.acos(np.dot(vectors[i - 1], vectors[i])) for i in range(3)]
-            idx = np.argmax(angles)
-            vec_idx = (idx + 1) % 3
-            d = latlng_offset_size(intersection_node.lat, vector=vectors[vec_idx], distance=distance_to_sidewalk)
-            dummy_coordinate = intersection_node.vector() - vectors[vec_idx] * d
-            dummy_node = Node(-1, dummy_coordinate[0], dummy_coordinate[1])
-            adjacent_nodes.insert(idx, dummy_node)
+        positions = {}
+        for i, street_node in enumerate(street_nodes):
+            positions.setdefault(street_node, i)
+        sidewalk_table[path.id] = (street_nodes, positions, (sidewalk_nodes_1, sidewalk_nodes_2),
+                                   (sidewalk_path_1, sidewalk_path_2), node_1_first[start:start + len(street_nodes)])
 
+    # Create crosswalks
+    adjacency = street_graph.get_adjacency()
+    intersection_nodes = [street_graph.nodes[key] for key in adjacency.intersections()]
+    adjacent_nodes_list = [sort_nodes(node, [street_graph.nodes[key] for key in adjacency.neighbors(node.id)])
+                           for node in intersection_nodes]
+
+    # Take care of the case where len(adj_nodes) == 3.
+    # Identify the largest angle that are formed by three segments
+    # Make a dummy node between two vectors that form the largest angle
+    three_way = [i for i, adjacent_nodes in enumerate(adjacent_nodes_list) if len(adjacent_nodes) == 3]
+    if three_way:
+        centers = coordinates_of([intersection_nodes[i] for i in three_way])
+        vectors = vector_to_array(np.repeat(centers, 3, axis=0),
+                                  coordinates_of([node for i in three_way for node in adjacent_nodes_list[i]]),
+                                  normalize=True).reshape(-1, 3, 2)
+        previous_vectors = np.roll(vectors, 1, axis=1)
+        dots = previous_vectors[:, :, 0] * vectors[:, :, 0] + previous_vectors[:, :, 1] * vectors[:, :, 1]
+        angles = np.arccos(np.clip(dots, -1., 1.))
+        idx = np.argmax(angles, axis=1)
+        vec = vectors[np.arange(len(three_way)), (idx + 1) % 3]
+        d = latlng_offset_size_array(centers[:, 0], vector=vec, distance=distance_to_sidewalk)
+        dummy_coordinates = centers - vec * d[:, np.newaxis]
+        for i, index, dummy_coordinate in zip(three_way, idx, dummy_coordinates):
+            adjacent_nodes_list[i].insert(index, Node(-1, dummy_coordinate[0], dummy_coordinate[1]))
+
+    # Take a pair of adjacent nodes around each intersection and compute a crosswalk coordinate between them.
+    centers = coordinates_of([node for node, adjacent_nodes in zip(intersection_nodes, adjacent_nodes_list)
+                              for _ in adjacent_nodes])
+    vector_intersection_to_crosswalk = \
+        vector_to_array(centers, coordinates_of([adjacent_nodes[i - 1] for adjacent_nodes in adjacent_nodes_list
+                                                 for i in range(len(adjacent_nodes))]), normalize=True) + \
+        vector_to_array(centers, coordinates_of([node for adjacent_nodes in adjacent_nodes_list
+                                                 for node in adjacent_nodes]), normalize=True)
+    vector_intersection_to_crosswalk = normalize(vector_intersection_to_crosswalk)
+    d = latlng_offset_size_array(centers[:, 0], vector=vector_intersection_to_crosswalk, distance=distance_to_sidewalk)
+    crosswalk_coordinates = centers + vector_intersection_to_crosswalk * d[:, np.newaxis]
+
+    row = 0
+    connections = []
+    for intersection_node, adjacent_nodes in zip(intersection_nodes, adjacent_nodes_list):
         # Create crosswalk nodes
         assert len(adjacent_nodes) > 3
         crosswalk_nodes = []
+        crosswalk_table = {}  # An adjacent node -> the two crosswalk nodes that were created from it
         for i in range(len(adjacent_nodes)):
-            # Take a pair of adjacent nodes and make a new node between them.
-            vec_intersection_to_adjacent_1 = intersection_node.vector_to(adjacent_nodes[i - 1], normalize=True)
-            vec_intersection_to_adjacent_2 = intersection_node.vector_to(adjacent_nodes[i], normalize=True)
-            vector_intersection_to_crosswalk = vec_intersection_to_adjacent_1 + vec_intersection_to_adjacent_2
-            vector_intersection_to_crosswalk /= np.linalg.norm(vector_intersection_to_crosswalk)
-            d = latlng_offset_size(intersection_node.lat, vector=vector_intersection_to_crosswalk, distance=distance_to_sidewalk)
-            crosswalk_coordinate = intersection_node.vector() + vector_intersection_to_crosswalk * d
-            crosswalk_node = sidewalk_graph.create_node(float(crosswalk_coordinate[1]), float(crosswalk_coordinate[0]))
+            crosswalk_node = sidewalk_graph.create_node(float(crosswalk_coordinates[row, 1]),
+                                                        float(crosswalk_coordinates[row, 0]))
+            row += 1
             crosswalk_nodes.append(crosswalk_node)
             crosswalk_node.parents = [adjacent_nodes[i - 1], adjacent_nodes[i]]
+            for parent in crosswalk_node.parents:
+                crosswalk_table.setdefault(parent, []).append(crosswalk_node)
 
         # Create crosswalk paths
-        crosswalk_paths = []
         for crosswalk_node_pair in window(crosswalk_nodes, 2):
-            crosswalk = sidewalk_graph.create_path(nodes=crosswalk_node_pair)
-            crosswalk_paths.append(crosswalk)
-        crosswalk = sidewalk_graph.create_path(nodes=[crosswalk_nodes[-1], crosswalk_nodes[0]])
-        crosswalk_paths.append(crosswalk)
+            sidewalk_graph.create_path(nodes=crosswalk_node_pair)
+        sidewalk_graph.create_path(nodes=[crosswalk_nodes[-1], crosswalk_nodes[0]])
 
-        # Connect the crosswalk nodes to appropriate sidewalk nodes
+        # Find the sidewalk edges between the intersection and the adjacent node along each street, and the sidewalk
+        # node at the intersection end of each of them.
         for street_path_id in intersection_node.children:
-            street_path = street_graph.get_path(street_path_id)
-            street_nodes = street_path.get_nodes()
-            idx = street_nodes.index(intersection_node)
-            adjacent_node = street_nodes[1] if idx == 0 else street_nodes[idx - 1]
-
-            sidewalk_edges = map(lambda edge_set: list(edge_set)[0],
-                                 filter(lambda edges: len(edges) > 0,
-                                        map(lambda pair: set(pair[0].edges) & set(pair[1].edges),
-                                            product(adjacent_node.children[street_path_id], intersection_node.children[street_path_id]))))
-
-            for sidewalk_edge in sidewalk_edges:
-                if sidewalk_edge.source in intersection_node.children[street_path_id]:
-                    node_to_swap = sidewalk_edge.source
-                    other = sidewalk_edge.target
-                else:
-                    node_to_swap = sidewalk_edge.target
-                    other = sidewalk_edge.source
-
-                # Identify which one of crosswalk_nodes to swap
-                curr_crosswalk_nodes = filter(lambda node: adjacent_node in node.parents, crosswalk_nodes)
-                assert len(curr_crosswalk_nodes) == 2  # Two crosswalk nodes should have been created from each adj node
-
-                crosswalk_node = curr_crosswalk_nodes[0]
-                vec_intersection_to_adjacent_node = intersection_node.vector_to(adjacent_node, normalize=True)
-                vec_intersection_to_sidewalk_node = intersection_node.vector_to(other, normalize=True)
-                vec_intersection_to_crosswalk_node = intersection_node.vector_to(crosswalk_node, normalize=True)
-                if np.cross(vec_intersection_to_adjacent_node, vec_intersection_to_crosswalk_node) * np.cross(vec_intersection_to_adjacent_node, vec_intersection_to_sidewalk_node) < 0:
-                    crosswalk_node = curr_crosswalk_nodes[1]
-                edges_to_swap.setdefault(sidewalk_edge, []).append((node_to_swap, crosswalk_node))
+            street_nodes, positions, sidewalk_nodes, sidewalk_paths, node_1_first = sidewalk_table[street_path_id]
+            idx = positions[intersection_node]
+            adjacent_idx = 1 if idx == 0 else idx - 1
+            edge_idx = min(idx, adjacent_idx)
+            adjacent_node = street_nodes[adjacent_idx]
+
+            # Identify which one of crosswalk_nodes to swap
+            curr_crosswalk_nodes = crosswalk_table.get(adjacent_node, [])
+            assert len(curr_crosswalk_nodes) == 2  # Two crosswalk nodes should have been created from each adj node
+
+            for side in ((0, 1) if node_1_first[adjacent_idx] else (1, 0)):
+                connections.append((sidewalk_paths[side].edges[edge_idx], sidewalk_nodes[side][idx],
+                                    sidewalk_nodes[side][adjacent_idx], intersection_node, adjacent_node,
+                                    curr_crosswalk_nodes))
+
+    # Pick the crosswalk node on the same side of the street as each sidewalk edge
+    edges_to_swap = {}
+    if connections:
+        centers = coordinates_of([connection[3] for connection in connections])
+        vec_intersection_to_adjacent_node = vector_to_array(
+            centers, coordinates_of([connection[4] for connection in connections]), normalize=True)
+        vec_intersection_to_sidewalk_node = vector_to_array(
+            centers, coordinates_of([connection[2] for connection in connections]), normalize=True)
+        vec_intersection_to_crosswalk_node = vector_to_array(
+            centers, coordinates_of([connection[5][0] for connection in connections]), normalize=True)
+
+        def cross(v1, v2):
+            return v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+        use_second = cross(vec_intersection_to_adjacent_node, vec_intersection_to_crosswalk_node) * \
+            cross(vec_intersection_to_adjacent_node, vec_intersection_to_sidewalk_node) < 0
+
+        for (sidewalk_edge, node_to_swap, _, _, _, curr_crosswalk_nodes), second in zip(connections, use_second):
+            crosswalk_node = curr_crosswalk_nodes[1] if second else curr_crosswalk_nodes[0]
+            edges_to_swap.setdefault(sidewalk_edge, []).append((node_to_swap, crosswalk_node))
 
     # Swap sidewalk edges
     for sidewalk_edge in edges_to_swap:
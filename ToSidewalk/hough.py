@@ -0,0 +1,72 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Default origin (lat, lng) of the Hough transform. Lines are described by their distance from this point, so it
+# should be near the area being processed (the default is in Washington, DC).
+HOUGH_ORIGIN = (38.9, -76.988)
+
+
+class HoughIndex(object):
+    """
+    A KD-tree over the Hough points (r, theta) of a list of streets. Streets that lie on similar lines have nearby
+    Hough points, so the index is used to find candidate streets to merge. The index is a snapshot: it does not
+    track changes to the streets, so it is rebuilt when the ways change (see Network.ways_changed).
+    """
+    def __init__(self, streets, origin=HOUGH_ORIGIN):
+        self.origin = origin
+        self.streets = list(streets)
+        self._rows = dict((id(street), row) for row, street in enumerate(self.streets))
+        if self.streets:
+            self.points = np.array([street.get_hough_point(origin) for street in self.streets])
+            self.tree = cKDTree(self.points)
+        else:
+            self.points = np.zeros((0, 2))
+            self.tree = None
+
+    def __len__(self):
+        return len(self.streets)
+
+    def _points(self, streets):
+        """
+        Get the Hough points of streets, reusing the points of the streets in the index
+        """
+        return np.array([self.points[self._rows[id(street)]] if id(street) in self._rows else
+                         street.get_hough_point(self.origin) for street in streets]).reshape(-1, 2)
+
+    def _query(self, points, k):
+        """
+        Query the k nearest neighbors of points. k is clamped to the number of streets in the index.
+        :return: A tuple of (m, k) arrays of distances and rows
+        """
+        k = min(k, len(self.streets))
+        distances, rows = self.tree.query(points, k=k)
+        return np.reshape(distances, (len(points), k)), np.reshape(rows, (len(points), k))
+
+    def query(self, streets, k=10):
+        """
+        Find the streets that are closest to each of the passed streets in the Hough space with a single batch query
+
+        :param streets: A list of Street objects
+        :param k: The number of neighbors to find for each street
+        :return: A list of lists of Street objects, nearest first
+        """
+        if self.tree is None or not streets:
+            return [[] for _ in streets]
+        _, rows = self._query(self._points(streets), k)
+        return [[self.streets[row] for row in street_rows] for street_rows in rows]
+
+    def nearest_neighbors(self):
+        """
+        Find the nearest other street of every street in the index with a single batch query
+
+        :return: A tuple of (distances, rows) arrays. rows[i] is the row of the nearest street of self.streets[i],
+            or -1 if the index has only one street
+        """
+        n = len(self.streets)
+        if n < 2:
+            return np.full(n, np.inf), np.full(n, -1, dtype=np.intp)
+        distances, rows = self._query(self.points, 2)
+        # The nearest point is normally the query point itself. Take the second one unless the first is non-zero.
+        column = np.where(distances[:, 0] != 0, 0, 1)
+        arange = np.arange(n)
+        return distances[arange, column], rows[arange, column]
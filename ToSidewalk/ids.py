@@ -0,0 +1,113 @@
+from types import IntType, LongType, StringTypes
+
+# The largest id that is allocated. Ids are stored as 32-bit signed integers downstream (e.g., in the database).
+MAX_ID = 0x7fffffff
+
+
+class IdAllocator(object):
+    """
+    A monotonic allocator of compact integer ids. Each network (and graph) owns one allocator for its nodes and one
+    for its ways, so ids are unique within the network and the same input always produces the same ids.
+
+    Source (OSM) ids are kept as they are if they fit in 32 bits. Larger ones are given a new compact id, and the
+    mapping between the two is kept in a table so the original ids can be recovered (e.g., when exporting).
+
+    Reserved ids are kept in a set and skipped when allocating, so a kept OSM id near MAX_ID does not use up the
+    ids below it.
+    """
+    def __init__(self, start=1):
+        self.start = start
+        self.next_id = start
+        self._reserved = set()
+        self._osm_to_id = {}
+        self._id_to_osm = {}
+
+    def __len__(self):
+        return len(self._id_to_osm)
+
+    def allocate(self):
+        """
+        Allocate a new id. New ids are larger than all the ids allocated so far, and skip the reserved ids
+
+        :return: An integer id
+        """
+        while self.next_id in self._reserved:
+            self.next_id += 1
+        if self.next_id > MAX_ID:
+            raise OverflowError("Ran out of 32-bit ids")
+        nid = self.next_id
+        self.next_id += 1
+        return nid
+
+    def is_allocated(self, nid):
+        """
+        Check if an id was allocated by this allocator
+        """
+        return self.start <= nid < self.next_id and nid not in self._reserved
+
+    def reserve(self, nid):
+        """
+        Mark an id that was not allocated by this allocator (e.g., an OSM id) as used
+
+        :param nid: An integer id, or a string of one. Other ids (e.g., "2_1") are ignored
+        """
+        if type(nid) in StringTypes:
+            if not nid.isdigit():
+                return
+            nid = int(nid)
+        # Ids below next_id were allocated already, and ids above MAX_ID are never allocated
+        if self.next_id <= nid <= MAX_ID:
+            self._reserved.add(nid)
+
+    def map_osm_id(self, osm_id):
+        """
+        Get the id to use for an OSM id. The OSM id itself is used if it fits in 32 bits and is not taken by an
+        allocated or mapped id. Otherwise a new id is allocated, and the same id is returned for the same OSM id
+        afterwards.
+
+        :param osm_id: An integer OSM id
+        :return: An integer id
+        """
+        osm_id = int(osm_id)
+        if osm_id in self._osm_to_id:
+            return self._osm_to_id[osm_id]
+        if 0 <= osm_id <= MAX_ID and osm_id not in self._id_to_osm and not self.is_allocated(osm_id):
+            self.reserve(osm_id)
+            return osm_id
+        nid = self.allocate()
+        self.add_osm_id(nid, osm_id)
+        return nid
+
+    def add_osm_id(self, nid, osm_id):
+        """
+        Record that the id nid was given to the OSM id osm_id
+        """
+        self._osm_to_id[osm_id] = nid
+        self._id_to_osm[nid] = osm_id
+
+    def get_id(self, osm_id, default=None):
+        """
+        Look up the id that was given to an OSM id
+
+        :return: An integer id, or default if osm_id was not mapped
+        """
+        return self._osm_to_id.get(osm_id, default)
+
+    def get_osm_id(self, nid):
+        """
+        Look up the OSM id of an id
+
+        :return: The OSM id, or nid itself if it was not mapped
+        """
+        return self._id_to_osm.get(nid, nid)
+
+
+def is_large_id(nid):
+    """
+    Check if an id is an integer that does not fit in 32 bits
+    """
+    return type(nid) in (IntType, LongType) and nid > MAX_ID
+
+
+# The allocator used for nodes and ways that are created without a network (e.g., Node(None, lat, lng)).
+default_ids = IdAllocator()
@@ -1,18 +1,65 @@
 import numpy as np
 from math import radians, cos, sin, asin, sqrt, atan2
 from shapely.geometry import Point
-from shapely.wkt import loads
 
 
-class LatLng(Point):
+class LatLng(object):
+    """
+    A latlng coordinate. This is a lightweight value type; a shapely Point is only created when a caller asks for
+    the geometry (e.g., bounding_box.contains(latlng.geometry)).
+    """
+    __slots__ = ('lat', 'lng', '_geometry')
+
     def __init__(self, lat, lng):
-        super(LatLng, self).__init__(float(lng), float(lat))
         self.lat = float(lat)
         self.lng = float(lng)
+        self._geometry = None
 
     def __eq__(self, other):
         return self.lat == other.lat and self.lng == other.lng
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    @property
+    def geometry(self):
+        """
+        A shapely Point (x=lng, y=lat) of this coordinate. It is created on the first access.
+        """
+        if self._geometry is None:
+            self._geometry = Point(self.lng, self.lat)
+        return self._geometry
+
+    @property
+    def __geo_interface__(self):
+        return {'type': 'Point', 'coordinates': (self.lng, self.lat)}
+
+    @property
+    def x(self):
+        return self.lng
+
+    @property
+    def y(self):
+        return self.lat
+
+    @property
+    def coords(self):
+        return [(self.lng, self.lat)]
+
+    @property
+    def xy(self):
+        return [self.lng], [self.lat]
+
+    @property
+    def bounds(self):
+        return self.lng, self.lat, self.lng, self.lat
+
+    def distance(self, other):
+        """
+        Planar (i.e., shapely) distance in degrees to another geometry such as a LatLng, an Edge, or a shapely object
+        """
+        return self.geometry.distance(getattr(other, 'geometry', other))
+
     def __str__(self):
         return str(self.lat) + "," + str(self.lng)
 
@@ -72,7 +119,6 @@ class LatLng(Point):
         https://docs.python.org/3.1/library/pickle.html#pickle.object.__reduce__
         http://stackoverflow.com/questions/19855156/whats-the-exact-usage-of-reduce-in-pickler
         """
-        p = loads(super(LatLng, self).wkt)
         return (self.__class__, (self.lat, self.lng))
 
 
@@ -96,6 +142,71 @@ def haversine(lon1, lat1, lon2, lat2):
     return c * r
 
 
+def haversine_array(lon1, lat1, lon2, lat2):
+    """
+    Vectorized version of haversine. Takes arrays (or scalars that broadcast against them) of coordinates in radians
+    and returns an array of distances in meters. It performs the same floating point operations as haversine, so the
+    results are identical to calling haversine element-wise.
+
+    :param lon1: Longitudes of the first points
+    :param lat1: Latitudes of the first points
+    :param lon2: Longitudes of the second points
+    :param lat2: Latitudes of the second points
+    :return: An array of distances in meters
+    """
+    dlon = np.subtract(lon2, lon1)
+    dlat = np.subtract(lat2, lat1)
+    # Note: np.power(x, 2.) calls pow() like x ** 2 on a float does. ndarray ** 2 computes x * x, which can differ in
+    # the last bit.
+    a = np.power(np.sin(dlat / 2), 2.) + np.cos(lat1) * np.cos(lat2) * np.power(np.sin(dlon / 2), 2.)
+    c = 2 * np.arcsin(np.sqrt(a))
+    r = 6371000  # Radius of earth in kilometers. Use 3956 for miles
+    return c * r
+
+
+def angle_to_array(lat1, lng1, lat2, lng2):
+    """
+    Vectorized version of LatLng.angle_to. Takes arrays (or scalars that broadcast against them) of coordinates.
+
+    :param lat1: Latitudes of the origins
+    :param lng1: Longitudes of the origins
+    :param lat2: Latitudes of the targets
+    :param lng2: Longitudes of the targets
+    :return: An array of angles in radians
+    """
+    return np.arctan2(np.subtract(lat2, lat1), np.subtract(lng2, lng1))
+
+
+def vector_to_array(origins, targets, normalize=False):
+    """
+    Vectorized version of LatLng.vector_to.
+
+    :param origins: A (n, 2) array of (lat, lng) coordinates
+    :param targets: A (n, 2) array of (lat, lng) coordinates
+    :param normalize: Boolean. Zero vectors are left as they are
+    :return: A (n, 2) array of vectors
+    """
+    vectors = np.subtract(targets, origins, dtype=np.float64).reshape(-1, 2)
+    if normalize:
+        norms = np.sqrt(vectors[:, 0] * vectors[:, 0] + vectors[:, 1] * vectors[:, 1])
+        nonzero = norms != 0
+        vectors[nonzero] /= norms[nonzero, np.newaxis]
+    return vectors
+
+
+def distance_in_meters_array(origins, targets):
+    """
+    Vectorized version of LatLng.distance_in_meters.
+
+    :param origins: A (n, 2) array of (lat, lng) coordinates in degrees
+    :param targets: A (n, 2) array of (lat, lng) coordinates in degrees
+    :return: An array of distances in meters
+    """
+    origins = np.radians(np.reshape(origins, (-1, 2)))
+    targets = np.radians(np.reshape(targets, (-1, 2)))
+    return haversine_array(origins[:, 1], origins[:, 0], targets[:, 1], targets[:, 0])
+
+
 if __name__ == "__main__":
     latlng = LatLng(10., 10.)
 
@@ -1,22 +1,24 @@
-from xml.etree import cElementTree as ET
 from shapely.geometry import Polygon, Point, LineString
 from types import StringType
 from itertools import combinations
-from heapq import heappush, heappop, heapify
-from scipy import spatial
-from operator import itemgetter
 from rtree import index
-import json
+from cStringIO import StringIO
+import copy
 import logging as log
 import math
 import time
 import sys
 import numpy as np
 
+from adjacency import Adjacency
+from hough import HoughIndex, HOUGH_ORIGIN
+from ids import IdAllocator, is_large_id
+from latlng import haversine_array, distance_in_meters_array
 from node import Node
 from nodes import Nodes
 from ways import Street, Streets, Ways
-from utilities import window, area, foot, points_to_line
+from utilities import window, foot, points_to_line, iterparse_osm, highway_node_ids, visvalingam, douglas_peucker
+from writers import GeoJSONWriter, OSMWriter
 
 
 class Network(object):
@@ -36,14 +38,25 @@ class Network(object):
 
         self.bounds = [100000.0, 100000.0, -100000.0, -100000.0]  # min lat, min lng, max lat, and max lng
         self.rtree = None
-        self.linestring_street_dict = {}
+        self.hough_origin = HOUGH_ORIGIN
+
+        # Incremented whenever the ways change (see ways_changed). The Hough index is rebuilt when it is stale
+        self.way_version = 0
+        self._hough_index = None
+        self._hough_index_version = None
+
+        # Ids of the new nodes and ways are allocated from these, so they are unique within this network and
+        # reproducible between runs
+        self.node_ids = IdAllocator()
+        self.way_ids = IdAllocator()
+        for nid in self.nodes.get_ids():
+            self.node_ids.reserve(nid)
+        for wid in self.ways.ways:
+            self.way_ids.reserve(wid)
+
         # Initialize the bounding box
-        for node in self.nodes.get_list():
-            # lat, lng = node.latlng.location(radian=False)
-            self.bounds[0] = min(node.lat, self.bounds[0])
-            self.bounds[2] = max(node.lat, self.bounds[2])
-            self.bounds[1] = min(node.lng, self.bounds[1])
-            self.bounds[3] = max(node.lng, self.bounds[3])
+        if len(self.nodes):
+            self.bounds = self.nodes.get_bounds()
 
     def add_node(self, node):
         """
@@ -53,6 +66,8 @@ class Network(object):
         :return:
         """
         self.nodes.add(node)
+        self.node_ids.reserve(node.id)
+        self.ways_changed()
 
     def add_nodes(self, nodes):
         """
@@ -70,10 +85,13 @@ class Network(object):
         :param way: A Way object to add
         """
         self.ways.add(way)
+        self.way_ids.reserve(way.id)
         for nid in way.nids:
             # self.nodes.get(nid).way_ids.append(way.id)
             node = self.get_node(nid)
             node.append_way(way.id)
+        self.update_rtree([way.id])
+        self.ways_changed()
 
     def add_ways(self, ways):
         """
@@ -88,12 +106,19 @@ class Network(object):
         """
         Create a new node and add it to the network
 
-        :param node_id: A node id
+        :param node_id: A node id. If it is None, a new id is allocated. If it does not fit in 32 bits (e.g., a
+            recent OSM id), it is mapped to a new id and kept as the node's osm_id
         :param lat: Latitude
         :param lng: Longitude
         :return: The new Node object
         """
-        node = Node(node_id, lat, lng)
+        if node_id is None:
+            node = Node(self.node_ids.allocate(), lat, lng)
+        elif is_large_id(node_id):
+            node = Node(self.node_ids.map_osm_id(node_id), lat, lng)
+            node.osm_id = node_id
+        else:
+            node = Node(node_id, lat, lng)
         self.add_node(node)
         return node
 
@@ -101,12 +126,19 @@ class Network(object):
         """
         Create a new street and add it to the network
 
-        :param street_id: A street id
+        :param street_id: A street id. If it is None, a new id is allocated. If it does not fit in 32 bits, it is
+            mapped to a new id and kept in the street's original ways
         :param nids: A list of node ids
         :param type: A street type
         :return: A new Street object
         """
-        street = Street(street_id, nids, type)
+        if street_id is None:
+            street = Street(self.way_ids.allocate(), nids, type)
+        elif is_large_id(street_id):
+            street = Street(self.way_ids.map_osm_id(street_id), nids, type)
+            street.add_original_way(str(street_id))
+        else:
+            street = Street(street_id, nids, type)
         for nid in nids:
             node = self.get_node(nid)
             node.append_way(street.id)
@@ -114,6 +146,52 @@ class Network(object):
         self.add_way(street)
         return street
 
+    def __reduce__(self):
+        """
+        Pickle the network as plain data, e.g., to send it to a worker process. Node objects are not pickled. The
+        nodes are rebuilt from their coordinates and the ways from their attributes (see rebuild_network). Derived
+        indexes such as the r-tree are rebuilt on demand.
+        """
+        nids = self.nodes.get_ids()
+        ways = [(way.__class__, way_state(way)) for way in self.get_ways()]
+        return (rebuild_network, (self.__class__, self.ways.__class__, self.bounds, nids,
+                                  self.nodes.get_coordinates(nids), ways, self.node_ids, self.way_ids,
+                                  list(self.nodes.crosswalk_node_ids)))
+
+    def extract(self, way_ids):
+        """
+        Copy a part of this network. The copy has copies of the passed ways and of the nodes they refer to, with the
+        same ids, so it can be modified (e.g., preprocessed) without changing this network.
+
+        :param way_ids: A list of way ids
+        :return: A new network of the same class
+        """
+        ways = [self.get_way(way_id) for way_id in way_ids]
+        nids = list(set(nid for way in ways for nid in way.nids))
+        # Keep the nodes in the order of this network
+        nids = [nids[i] for i in np.argsort(self.nodes.get_rows(nids), kind="mergesort")]
+        return rebuild_network(self.__class__, self.ways.__class__, list(self.bounds), nids,
+                               self.nodes.get_coordinates(nids), [(way.__class__, way_state(way)) for way in ways],
+                               copy.deepcopy(self.node_ids), copy.deepcopy(self.way_ids))
+
+    def get_adjacency(self):
+        """
+        Build a CSR adjacency snapshot of this network over the node ids. Two nodes are adjacent if they are
+        consecutive in a way. Ways that share a segment count it once. Build a new snapshot after modifying the
+        network.
+
+        :return: An Adjacency object
+        """
+        keys = self.nodes.get_ids()
+        index = dict((nid, i) for i, nid in enumerate(keys))
+        sources, targets = [], []
+        for way in self.get_ways():
+            for nid1, nid2 in window(way.nids, 2):
+                if nid1 in index and nid2 in index:
+                    sources.append(index[nid1])
+                    targets.append(index[nid2])
+        return Adjacency(keys, sources, targets, unique=True)
+
     def get_adjacent_nodes(self, node):
         """
         Get adjacent nodes for the passed node
@@ -173,95 +251,50 @@ class Network(object):
         :return: A list of all the ways in the network
         """
         return self.ways.get_list()
-    def get_nearby_ways(self, base_street):
+
+    def get_hough_index(self):
+        """
+        Get a Hough-space KD-tree index of the ways in this network. The index is built once and reused until the
+        ways change (see ways_changed).
+
+        :return: A HoughIndex object
+        """
+        if self._hough_index is None or self._hough_index_version != self.way_version:
+            self._hough_index = HoughIndex(self.get_ways(), self.hough_origin)
+            self._hough_index_version = self.way_version
+        return self._hough_index
+
+    def get_nearby_ways(self, base_street, k=10):
         """
         Retrieves streets near the input street using hough transform and kdtree
         :param base_street: Street for which to look for nearby streets
+        :param k: The number of streets to retrieve
         :return: A list of nearby streets
         """
-        # Calculate hough points for all ways and build the tree
-        streets = self.get_ways()
-        # Dictionary will allow retrieval of original street using hough point as key
-        hough_point_street_dict = {}
-        allpoints = []
-        for street in streets:
-            houghpoint = street.get_hough_point()
-            hough_point_street_dict[houghpoint[0]] = street
-            allpoints.append(houghpoint)
-        # Build the tree
-        tree = spatial.KDTree(allpoints)
-        # Convert to regular list
-        treedata = tree.data.tolist()
-        #print("Treedata")
-        #print(treedata)
-
-        base_hough_point = base_street.get_hough_point()
-
-        # Find 20 points closest to base
-        neighbors = tree.query(base_hough_point, k=10)
-        #print("Neighbors")
-        #print(neighbors)
-        # Go through each index and retrieve the street. Store streets in array.
-        nearby_streets = []
-        for index in neighbors[1]:
-            found_street = hough_point_street_dict[treedata[index][0]]
-            nearby_streets.append(found_street)
-         #   print(found_street)
-        return nearby_streets
-
-    def get_nearest_neighbor_pairs(self):
+        return self.get_hough_index().query([base_street], k)[0]
+
+    def get_nearest_neighbor_pairs(self, threshold=10):
         """
         Finds pairs of streets for merging using hough transformation and kdtree
-        :return:
+        :param threshold: Maximum distance between the Hough points of a pair
+        :return: A list of pairs of streets, sorted by the distance between their Hough points
         """
-        streets = self.get_ways()
-        # Dictionary will allow retrieval of original street using hough point as key
-        hough_point_street_dict = {}
-        allpoints = []
-        for street in streets:
-            houghpoint = street.get_hough_point()
-            hough_point_street_dict[houghpoint[0]] = street
-            allpoints.append(houghpoint)
-        tree = spatial.KDTree(allpoints)
-        treedata = tree.data.tolist()
-        treedata_unsorted = tree.data.tolist()
-        print(hough_point_street_dict)
-        for index,pair in enumerate(treedata):
-
-            neighbors = tree.query(pair,k=2)
-
-            if(neighbors[0][0] != 0):
-                distance_and_index = [neighbors[0][0],neighbors[1][0]]
-
-            else:
-                distance_and_index = [neighbors[0][1], neighbors[1][1]]
-
-            treedata[index].append(distance_and_index[0])
-            treedata[index].append(distance_and_index[1])
+        hough_index = self.get_hough_index()
+        distances, rows = hough_index.nearest_neighbors()
 
         # Sort these pairs by distance
-        treedata = sorted(treedata,key=itemgetter(2))
         parallel_pairs = []
-        for entry in treedata:
-            if 0.0 < entry[2] < 10:
-                new_pair = []
-                new_pair.append(entry[0])
-                new_pair.append(entry[1])
-                new_pair.append(treedata_unsorted[entry[3]][0])
-                new_pair.append(treedata_unsorted[entry[3]][1])
-                parallel_pairs.append(new_pair)
-        for pair in parallel_pairs:
-            street1 = hough_point_street_dict[pair[0]]
-            street2 = hough_point_street_dict[pair[2]]
-            street_pair = [street1, street2]
-            print("Streets " + str(street_pair[0].id) + " and " + str(street_pair[1].id))
-            print(street1.get_node_ids()[0])
-            print(street1.get_node_ids()[-1])
-            print(street2.get_node_ids()[0])
-            print(street2.get_node_ids()[-1])
-        #print("Parallel pairs" + str(parallel_pairs))
-        #print("Tree data "+ str(treedata))
-        #print "\n".join(str(x) for x in treedata)
+        for row in np.argsort(distances, kind='mergesort'):
+            if 0.0 < distances[row] < threshold:
+                street_pair = (hough_index.streets[row], hough_index.streets[rows[row]])
+                parallel_pairs.append(street_pair)
+                log.debug("Streets %s and %s (%s-%s, %s-%s)" % (street_pair[0].id, street_pair[1].id,
+                                                             street_pair[0].get_node_ids()[0],
+                                                             street_pair[0].get_node_ids()[-1],
+                                                             street_pair[1].get_node_ids()[0],
+                                                             street_pair[1].get_node_ids()[-1]))
+        return parallel_pairs
+
     def parse_intersections(self):
         """
         TBD
@@ -293,6 +326,8 @@ class Network(object):
             #     raise
 
         self.nodes.remove(nid)
+        self.update_rtree(node.get_way_ids())
+        self.ways_changed()
 
     def remove_way(self, way_id):
         """
@@ -325,6 +360,16 @@ class Network(object):
 
             self.ways.remove(way_id)
             assert way_id not in self.ways.ways.keys()
+            self.update_rtree([way_id])
+            self.ways_changed()
+
+    def ways_changed(self):
+        """
+        Mark the ways of this network as changed, so the Hough index is rebuilt when it is used next (see
+        get_hough_index). add_way, remove_way and remove_node call this. Methods that change way.nids in place
+        (e.g., merge_nodes and simplify_ways) must call it too.
+        """
+        self.way_version += 1
 
     def join_ways(self, way_id_1, way_id_2):
         """
@@ -371,6 +416,7 @@ class Network(object):
                 way = self.get_way(way_id)
                 way.swap_nodes(node_from, node_to)
                 # self.ways.get(way_id).swap_nodes(nid_from, nid_to)
+            self.ways_changed()
             # self.nodes.remove(nid_from)
             self.remove_node(node_from.id)
         return
@@ -387,6 +433,83 @@ class Network(object):
         node_to = self.get_node(nid_to)
         return node_from.vector_to(node_to, normalize)
 
+    def create_rtree(self):
+        """
+        Creates an r-tree from this street network and updates the self.rtree field. Each way is indexed by the
+        bounding box of its start and end nodes (in (lat, lng)), and the index entries are keyed by way id. Once the
+        r-tree exists, it is kept up to date by add_way, remove_way, remove_node, and update_rtree, so it does not
+        have to be rebuilt after the network is modified.
+        """
+        self.rtree = index.Index()
+        self._rtree_entries = {}  # way id -> (r-tree key, bounding box)
+        self._rtree_way_ids = {}  # r-tree key -> way id
+        self._rtree_next_key = 0
+        for street in self.get_ways():
+            self._rtree_insert(street)
+
+    def _rtree_bbox(self, way):
+        """
+        Get the bounding box of a way that is used as its r-tree entry and query box. The box is expanded a bit.
+        Returns None if the way's end nodes are not in the network (e.g., while the way is being removed).
+        """
+        start_node = self.get_node(way.nids[0])
+        end_node = self.get_node(way.nids[-1])
+        if start_node is None or end_node is None:
+            return None
+        bbox = [min(start_node.lat, end_node.lat), min(start_node.lng, end_node.lng),
+                max(start_node.lat, end_node.lat), max(start_node.lng, end_node.lng)]
+        return tuple(np.array(bbox) + np.array([-0.0010, -0.00010, 0.00010, 0.00010]))
+
+    def _rtree_insert(self, way):
+        bbox = self._rtree_bbox(way)
+        if bbox is None:
+            return
+        key = self._rtree_next_key
+        self._rtree_next_key += 1
+        self.rtree.insert(key, bbox)
+        self._rtree_entries[way.id] = (key, bbox)
+        self._rtree_way_ids[key] = way.id
+
+    def _rtree_delete(self, way_id):
+        if way_id in self._rtree_entries:
+            key, bbox = self._rtree_entries.pop(way_id)
+            self.rtree.delete(key, bbox)
+            del self._rtree_way_ids[key]
+
+    def update_rtree(self, way_ids):
+        """
+        Re-index the ways whose geometry has changed (e.g., because their nodes were moved). Way ids that are no
+        longer in the network are removed from the r-tree.
+
+        :param way_ids: A list of way ids
+        """
+        if self.rtree is None:
+            return
+        for way_id in set(way_ids):
+            self._rtree_delete(way_id)
+            way = self.get_way(way_id)
+            if way is not None and len(way.nids) > 1:
+                self._rtree_insert(way)
+
+    def get_rtree_nearby_ways(self, base_street):
+        """
+        This method queries self.rtree to retrieve the streets near the input base_street.
+        :param base_street: Street for which to search for neighboring streets
+        :return: List of streets around the base_street
+        """
+        if self.rtree is None:
+            self.create_rtree()
+        # Find the streets whose (expanded) bounding boxes intersect with the input street's expanded bounding box
+        street_objects = []
+        bbox = self._rtree_bbox(base_street)
+        if bbox is None:
+            return []
+        for key in self.rtree.intersection(bbox):
+            street = self.get_way(self._rtree_way_ids[key])
+            if street is not None:
+                street_objects.append(street)
+        return street_objects
+
 
 class OSM(Network):
     @staticmethod
@@ -460,64 +583,54 @@ class OSM(Network):
 
     def export(self, format="geojson", data_type="ways"):
         """
-        Export the node and way data.
-        Todo: Implement geojson format for export.
+        Export the node and way data as a string (see export_to).
+        """
+        output = StringIO()
+        self.export_to(output, format, data_type)
+        return output.getvalue()
+
+    def export_to(self, fileobj, format="osm", data_type="ways", compress=False):
+        """
+        Write the node and way data to a file object in chunks (see writers.ChunkedWriter), so exporting a large
+        network does not build the whole document in memory.
+
+        :param fileobj: A file object opened for writing in binary mode
+        :param format: "osm", "geojson" (a FeatureCollection), or "geojsonseq" (newline-delimited GeoJSON features)
+        :param data_type: "ways", "nodes", or "all" to write the features of both. Only used for geojson
+        :param compress: If True, the output is gzip-compressed
         """
         if format == 'osm':
-            header = """<?xml version="1.0" encoding="UTF-8"?>
-<osm version="0.6">
-<bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s" />
-""" % (str(self.bounds[0]), str(self.bounds[1]), str(self.bounds[2]), str(self.bounds[3]))
-
-            footer = "</osm>"
-            node_list = []
-            for node in self.get_nodes():
-                node_str = """<node id="%s" visible="true" user="%s" lat="%s" lon="%s" />""" % (str(node.id), str(node.user), str(node.lat), str(node.lng))
-                node_list.append(node_str)
-
-            way_list = []
-            for way in self.ways.get_list():
-                way_str = """<way id="%s" visible="true" user="%s">""" % (str(way.id), str(way.user))
-                way_list.append(way_str)
-                for nid in way.get_node_ids():
-                    nid_str = """<nd ref="%s" />""" % (str(nid))
-                    way_list.append(nid_str)
-
-                if way.type is not None:
-                    tag = """<tag k="%s" v="%s" />""" % ("highway", way.type)
-                    if way.type == "footway":
-                        # How to tag sidewalks in OpenStreetMap
-                        # https://help.openstreetmap.org/questions/1236/should-i-map-sidewalks
-                        # http://wiki.openstreetmap.org/wiki/Tag:footway%3Dsidewalk
-                        tag = """<tag k="%s" v="%s" />""" % ("footway", "sidewalk")
-                    way_list.append(tag)
-
-                for tag in way.get_tags():
-                    tag_string = """<tag k="%s" v="%s" />""" % (tag["k"], tag["v"])
-                    way_list.append(tag_string)
-                way_list.append("</way>")
-
-            osm = header + "\n".join(node_list) + "\n" + "\n".join(way_list) + "\n" + footer
-
-            return osm
+            with OSMWriter(fileobj, compress) as writer:
+                writer.start(self.bounds)
+                for node in self.get_nodes():
+                    writer.node((("id", node.id), ("visible", "true"), ("user", node.user),
+                                 ("lat", node.lat), ("lon", node.lng)))
+
+                for way in self.ways.get_list():
+                    tags = []
+                    if way.type is not None:
+                        if way.type == "footway":
+                            # How to tag sidewalks in OpenStreetMap
+                            # https://help.openstreetmap.org/questions/1236/should-i-map-sidewalks
+                            # http://wiki.openstreetmap.org/wiki/Tag:footway%3Dsidewalk
+                            tags.append(("footway", "sidewalk"))
+                        else:
+                            tags.append(("highway", way.type))
+                    tags += [(tag["k"], tag["v"]) for tag in way.get_tags()]
+                    writer.way((("id", way.id), ("visible", "true"), ("user", way.user)), way.get_node_ids(), tags)
+                writer.end()
         else:
             # Mapbox GeoJson format
             # https://github.com/mapbox/simplestyle-spec/tree/master/1.1.0
-            geojson = {}
-            geojson['type'] = "FeatureCollection"
-            geojson['features'] = []
-
-            if data_type == "ways":
-                # Add ways
-                for way in self.get_ways():
-                    feature = way.get_geojson_features()
-                    geojson['features'].append(feature)
-            elif data_type == "nodes":
-                # Add nodes
-                for node in self.get_nodes():
-                    feature = node.get_geojson_features()
-                    geojson['features'].append(feature)
-            return json.dumps(geojson)
+            with GeoJSONWriter(fileobj, format == "geojsonseq", compress) as writer:
+                writer.start()
+                if data_type in ("ways", "all"):
+                    for way in self.get_ways():
+                        writer.feature(way.get_geojson_features(self.nodes.get_coordinates(way.nids)))
+                if data_type in ("nodes", "all"):
+                    for node in self.get_nodes():
+                        writer.feature(node.get_geojson_features())
+                writer.end()
 
     def find_parallel_street_segments(self):
         """
@@ -547,22 +660,28 @@ class OSM(Network):
             poly.nids = [start_node_id, end_node_id]
             street_polygons.append(poly)
 
-        # Find pair of polygons that intersect each other.
-        polygon_combinations = combinations(street_polygons, 2)
-        # Create a list for storing parallel pairs
+        # A pair of streets is identified by the index of the first polygon that is equal to each street's polygon
+        # (i.e., streets with the same rectangle share an index)
+        first_index = {}
+        polygon_indices = []
+        for i, poly in enumerate(street_polygons):
+            polygon_indices.append(first_index.setdefault(tuple(poly.exterior.coords), i))
+
+        # Find pair of polygons that intersect each other. Candidate pairs are the polygons whose bounding boxes
+        # intersect, found with an STR bulk-loaded r-tree. Pairs are visited in the same order as
+        # combinations(street_polygons, 2), and the cheap angle test is done before the intersection test.
+        angles = np.array([poly.angle for poly in street_polygons])
         parallel_pairs = []
-        # All possible pairs are stored for debugging purposes
-        for pair_poly in polygon_combinations:
-            # pair_poly[0] and pair_poly[1] are polygons
-            # Add the pair to the list of all possible pairs for debug, but limit size to 50
-            # Get node id of street being checked
-            # street1 = streets[street_polygons.index(pair_poly[0])]
-            # street2 = streets[street_polygons.index(pair_poly[1])]
-            angle_diff = ((pair_poly[0].angle - pair_poly[1].angle) + 360.) % 180.
-            if pair_poly[0].intersects(pair_poly[1]) and (angle_diff < 10. or angle_diff > 170.):
-                # If the polygon intersects, and they have a kind of similar angle, and they don't share a node,
-                # then they should be merged together.
-                parallel_pairs.append((street_polygons.index(pair_poly[0]), street_polygons.index(pair_poly[1])))
+        if street_polygons:
+            rtree = index.Index((i, poly.bounds, None) for i, poly in enumerate(street_polygons))
+            for i, poly in enumerate(street_polygons):
+                candidates = sorted(j for j in rtree.intersection(poly.bounds) if j > i)
+                for j in candidates:
+                    angle_diff = ((angles[i] - angles[j]) + 360.) % 180.
+                    if (angle_diff < 10. or angle_diff > 170.) and poly.intersects(street_polygons[j]):
+                        # If the polygon intersects, and they have a kind of similar angle, and they don't share a
+                        # node, then they should be merged together.
+                        parallel_pairs.append((polygon_indices[i], polygon_indices[j]))
         filtered_parallel_pairs = []
 
         # Filter parallel_pairs and store in filtered_parallel_pairs
@@ -611,14 +730,10 @@ class OSM(Network):
         :param lnglat: If true, return a list of lnglat coordinates instead of latlng coordinates.
         :return:
         """
-        coords = []
-        for nid in way.get_node_ids():
-            node = self.get_node(nid)
-            if lnglat:
-                coords.append([node.lng, node.lat])
-            else:
-                coords.append([node.lat, node.lng])
-        return coords
+        coords = self.nodes.get_coordinates(way.get_node_ids())
+        if lnglat:
+            coords = coords[:, ::-1]
+        return coords.tolist()
 
     def get_distance(self, way):
         """ Get a distance of the passed way
@@ -636,6 +751,19 @@ class OSM(Network):
             log.debug("Network.get_distance(): Debug")
         return distance
 
+    def get_distances(self, ways):
+        """
+        Get the distances between the end points of the passed ways with a single vectorized haversine call
+
+        :param ways: A list of way objects
+        :return: An array of distances in meters
+        """
+        if not ways:
+            return np.zeros(0)
+        starts = self.nodes.get_coordinates([way.nids[0] for way in ways])
+        ends = self.nodes.get_coordinates([way.nids[-1] for way in ways])
+        return distance_in_meters_array(starts, ends)
+
     def join_connected_ways(self, segments_to_merge):
         """
         This methods searches through the pairs of way ids that need to be merged, and checks to see if there
@@ -753,6 +881,12 @@ class OSM(Network):
                     break
 
             # Merge nodes in between if necessary...
+            if len(set(street.nids)) == len(street.nids):
+                self._merge_consecutive_nodes(street, distance_threshold)
+                continue
+
+            # Way.remove_node removes every occurrence of a node id, so streets that visit a node more than once
+            # are merged with the original restart-on-every-merge scan.
             while True:
                 nids = street.get_node_ids()[1:-1]
                 do_break = True
@@ -773,11 +907,60 @@ class OSM(Network):
                         except AttributeError:
                             print street
                             raise
+                        self.ways_changed()
                         do_break = False
                         break
                 if do_break:
                     break
 
+    def _merge_consecutive_nodes(self, street, distance_threshold):
+        """
+        Merge the consecutive middle nodes of a street that are closer than distance_threshold in a single pass.
+
+        A node that is close to its predecessor is merged with it into a new node at their midpoint, and the new node
+        is then compared with its own predecessor again. This yields the same merges, in the same order, as
+        repeatedly merging the first close pair and rescanning the street from the beginning. The distances between
+        the original consecutive nodes are computed with one vectorized haversine call.
+
+        :param street: A Street object whose node ids are unique
+        :param distance_threshold: A distance in meters
+        """
+        nids = street.nids[1:-1]
+        if len(nids) < 2:
+            return
+
+        coords = np.radians(self.nodes.get_coordinates(nids))
+        distances = haversine_array(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0])
+
+        merged = [self.get_node(nids[0])]
+        is_original = [True]  # Whether merged[i] is the original node at merged_index[i]
+        merged_index = [0]
+        for i in range(1, len(nids)):
+            node = self.get_node(nids[i])
+            node_is_original = True
+            while merged:
+                prev = merged[-1]
+                if is_original[-1] and node_is_original and merged_index[-1] == i - 1:
+                    distance = distances[i - 1]
+                else:
+                    distance = prev.distance_to(node)
+                if distance >= distance_threshold:
+                    break
+
+                new_node = self.create_node(None, (prev.lat + node.lat) / 2, (prev.lng + node.lng) / 2)
+                new_node.append_ways(prev.get_way_ids() + node.get_way_ids())
+                merged.pop()
+                is_original.pop()
+                merged_index.pop()
+                node = new_node
+                node_is_original = False
+            merged.append(node)
+            is_original.append(node_is_original)
+            merged_index.append(i)
+
+        street.nids = [street.nids[0]] + [node.id for node in merged] + [street.nids[-1]]
+        self.ways_changed()
+
     def merge_parallel_street_segments(self, parallel_pairs):
         """
         Note: Maybe I don't even have to merge any path (which breaks the original street network data structure.
@@ -976,81 +1159,6 @@ class OSM(Network):
             self.remove_way(way_id)
             self.join_connected_ways(segments_to_merge)
 
-    def create_rtree(self):
-        """
-        Creates an r-tree from this street network and updates the self.rtree field
-
-        """
-        #print("Creating rtree")
-        streets = self.get_ways()
-        """
-        # Make a list of start and end coordinates for each street
-
-        List structure:
-        [
-        [[x1, y1], [x2, y2]],
-        [[x3, y3], [x4, y4]],
-        ...
-        ]
-        """
-        coords_list = []
-        linestrings = []
-
-        for street in streets:
-            start_lat = street.get_start_latitude()
-            start_long = street.get_start_longitude()
-            end_lat = street.get_end_latitude()
-            end_long = street.get_end_longitude()
-            coords_list.append([[start_lat, start_long], [end_lat, end_long]])
-            # Create a linestring from the coordinates we just added and put it into the linestrings list
-            linestrings.append(LineString(coords_list[-1]))
-            # Add the linestring we just added to the dictionary.
-            # Key is the x coordinate of the linestring's start point
-            # Value is the street object
-            # Dictionary allows later retrieval of street object from linestring.
-            self.linestring_street_dict[linestrings[-1].coords[0][0]] = street
-
-        idx = index.Index()  # r-tree index
-        # Insert the linestrings into the rtree
-        for i, linestring in enumerate(linestrings):
-            idx.insert(i, linestring.bounds + np.array([-0.0010, -0.00010, 0.00010, 0.00010]), linestring)
-        self.rtree = idx
-    def get_rtree_nearby_ways(self, base_street):
-        """
-        This method queries self.rtree to retrieve the streets near the input base_street.
-        :param base_street: Street for which to search for neighboring streets
-        :return: List of streets around the base_street
-        """
-        if self.rtree is None:
-            self.create_rtree()
-        # Create a linestring for the input street
-        base_start_lat = base_street.get_start_latitude()
-        base_start_long = base_street.get_start_longitude()
-        base_end_lat = base_street.get_end_latitude()
-        base_end_long = base_street.get_end_longitude()
-        input_street_coords = [[base_start_lat,base_start_long],[base_end_lat,base_end_long]]
-        input_street_linestring = LineString(input_street_coords)
-        # Create a bounding box by expanding the input street's bounding box
-        # Then count the number of objects that are in that bounding box and store them in a list.
-        bbox = np.array(input_street_linestring.bounds) + np.array([-0.0010, -0.00010, 0.00010, 0.00010])  # Expand the bounding box a bit
-        num = self.rtree.count(bbox)  # Count the number of items that are in this bounding box
-        # print ("There are " + str(num) + " items in this bounding box.")
-        # Get the raw objects (linestrings) in the bounding box
-        linestring_objects = self.rtree.nearest(input_street_linestring.bounds, num, objects='raw')
-        # Convert the linestring objects back into street objects and store them in list
-        street_objects = []
-        for linestring in linestring_objects:
-            street_objects.append(self.linestring_street_dict[linestring.coords[0][0]])
-        # Debugging -------
-        # Print the base street start and end node ids followed by start and end node ids of found nearby streets
-        # print "Input street starts at node " + str(base_street.get_node_ids()[0]) + " and ends at " + str(base_street.get_node_ids()[-1])
-        # print "Here are the nearby streets:"
-        # for street in street_objects:
-        #     print str(street.get_node_ids()[0]) + "\t" + str(street.get_node_ids()[-1])
-        # -----------------
-        # Return the list of street objects; these are the streets near the input street
-        # print("\n")
-        return street_objects
     def merge_parallel_street_segments3(self, threshold=0.3):
         """
         My freaking third attempt to merge parallel segemnts.
@@ -1142,8 +1250,9 @@ class OSM(Network):
                     for new_street in new_streets:
                         streets.append(new_street)
                     if use_rtree:
-                        # Create new rtree
-                        self.create_rtree()
+                        # The new streets were indexed by add_way and the old ones removed by remove_way. Re-index
+                        # the other streets that share the moved nodes.
+                        self.update_rtree([way_id for node in flattened for way_id in node.get_way_ids()])
                     do_break = False
             print("Iteration took %s seconds ---" % (time.time() - start))
             if do_break:
@@ -1321,8 +1430,14 @@ class OSM(Network):
 
         :param distance_threshold: A ditance threshold in meters.
         """
-        for way in self.get_ways():
-            d = self.get_distance(way)
+        # The distances are computed up front in one call. Only the ways whose end nodes are swapped while the
+        # short segments are collapsed need to be measured again.
+        ways = self.get_ways()
+        distances = self.get_distances(ways)
+        dirty_way_ids = set()
+        for way, d in zip(ways, distances):
+            if way.id in dirty_way_ids:
+                d = self.get_distance(way)
 
             if d < distance_threshold:
                 node1 = self.get_node(way.nids[0])
@@ -1351,6 +1466,8 @@ class OSM(Network):
                         if node2.id in temp_way.nids:
                             temp_way.swap_nodes(node2.id, new_node.id)
                         new_node.append_way(way_id)
+                        dirty_way_ids.add(way_id)
+                        self.ways_changed()
 
                 node1.remove_way_id(way.id)
                 node2.remove_way_id(way.id)
@@ -1367,6 +1484,10 @@ class OSM(Network):
         if type(street_pair[0]) == StringType:
             street_pair = [self.get_way(street_pair[0]), self.get_way(street_pair[1])]
 
+        # The nids of the streets are changed in place below. The Hough index is not used in this method, so marking
+        # the ways as changed up front is enough.
+        self.ways_changed()
+
         # Take the two points from street_pair[0], and use it as a base vector.
         # Project all the points along the base vector and sort them.
         base_node0 = self.nodes.get(street_pair[0].nids[0])
@@ -1632,69 +1753,58 @@ class OSM(Network):
 
             return overlapping_segment, street1_segmentation, street2_segmentation
 
-    def simplify(self, way_id, threshold=0.5):
+    def simplify(self, way_id, threshold=0.5, tolerance=None, method="visvalingam"):
         """
-        Need a line simplification with a Visvalingam's algorithm.
+        Simplify a way with a Visvalingam's algorithm (or Douglas-Peucker algorithm). See simplify_ways.
 
         http://bost.ocks.org/mike/simplify/
         https://hydra.hull.ac.uk/assets/hull:8343/content
-        http://stackoverflow.com/questions/12749622/creating-a-heap-in-python
-        http://stackoverflow.com/questions/3954530/how-to-make-heapq-evaluate-the-heap-off-of-a-specific-attribute
-        """
-        nodes = [self.nodes.get(nid) for nid in self.ways.get(way_id).get_node_ids()]
-        latlngs = [node.location() for node in nodes]
-        groups = list(window(range(len(latlngs)), 3))
-
-        class Triangle(object):
-            def __init__(self, prev_idx, idx, next_idx):
-                self.idx = idx
-                self.prev_idx = idx - 1
-                self.next_idx = idx + 1
-                self.area = area(latlngs[self.prev_idx], latlngs[self.idx], latlngs[self.next_idx])
-
-            def update_area(self):
-                self.area = area(latlngs[self.prev_idx], latlngs[self.idx], latlngs[self.next_idx])
-
-            def __cmp__(self, other):
-                if self.area < other.area:
-                    return -1
-                elif self.area == other.area:
-                    return 0
-                else:
-                    return 1
+        """
+        self.simplify_ways([way_id], threshold, tolerance, method)
 
-            def _str__(self):
-                return str(self.idx) + " area=" + str(self.area)
+    def simplify_ways(self, way_ids=None, threshold=0.5, tolerance=None, method="visvalingam"):
+        """
+        Simplify ways in one batch to thin out dense geometry. The coordinates of all the ways are read with a single
+        call. The end nodes of each way and the nodes that are shared with other ways (e.g., intersections) are
+        always kept. The removed nodes are detached from the way, and deleted if they do not belong to any other way.
 
-        dict = {}
-        heap = []
-        for i, group in enumerate(groups):
-            t = Triangle(group[0], group[1], group[2])
-            dict[group[1]] = t
-            heappush(heap, t)
+        :param way_ids: A list of way ids. Defaults to all the ways in the network
+        :param threshold: With the Visvalingam's algorithm, the ratio of the nodes to keep in each way
+        :param tolerance: With the Visvalingam's algorithm, an area in squared degrees. If given, nodes are removed
+            while their effective area is below this value instead of using the threshold. With the Douglas-Peucker
+            algorithm, a distance in degrees (required)
+        :param method: "visvalingam" or "douglas-peucker"
+        """
+        if method not in ("visvalingam", "douglas-peucker"):
+            raise ValueError("Unknown simplification method: %s" % method)
+        if method == "douglas-peucker" and tolerance is None:
+            raise ValueError("Douglas-Peucker simplification needs a tolerance")
 
-        while float(len(heap) + 2) / len(latlngs) > threshold:
-            try:
-                t = heappop(heap)
-                if (t.idx + 1) in dict:
-                    dict[t.idx + 1].prev_idx = t.prev_idx
-                    dict[t.idx + 1].update_area()
-                if (t.idx - 1) in dict:
-                    dict[t.idx - 1].next_idx = t.next_idx
-                    dict[t.idx - 1].update_area()
-                heapify(heap)
-            except IndexError:
-                break
+        ways = self.get_ways() if way_ids is None else [self.get_way(way_id) for way_id in way_ids]
+        # (lng, lat) of the nodes of all the ways
+        coordinates = self.nodes.get_coordinates([nid for way in ways for nid in way.nids])[:, ::-1].tolist()
 
-        l = [t.idx for t in heap]
-        l.sort()
-        new_nids = [nodes[0].id]
-        for idx in l:
-            new_nids.append(nodes[idx].id)
-        new_nids.append(nodes[-1].id)
-        self.ways.get(way_id).nids = new_nids
+        start = 0
+        for way in ways:
+            nids = way.nids
+            points = coordinates[start:start + len(nids)]
+            start += len(nids)
 
-        return
+            fixed = [i for i, nid in enumerate(nids) if len(self.get_node(nid).get_way_ids()) > 1]
+            if method == "visvalingam":
+                keep = visvalingam(points, threshold, tolerance, fixed)
+            else:
+                keep = douglas_peucker(points, tolerance, fixed)
+            if len(keep) == len(nids):
+                continue
+
+            way.nids = [nids[i] for i in keep]
+            self.ways_changed()
+            for nid in set(nids) - set(way.nids):
+                node = self.get_node(nid)
+                node.remove_way_id(way.id)
+                if not node.get_way_ids():
+                    self.remove_node(nid)
 
     def split_streets(self):
         """
@@ -1756,62 +1866,133 @@ class OSM(Network):
                     node.append_way(street.id)
 
 
-def parse(filename):
+def way_state(way):
     """
-    Parse a OSM file
+    Copy the attributes of a way without its references to other objects in the network (i.e., the parent Ways and
+    the neighboring streets)
+
+    :param way: A Way object
+    :return: A dictionary of attributes
     """
-    with open(filename, "rb") as osm:
-        # Find element
-        # http://stackoverflow.com/questions/222375/elementtree-xpath-select-element-based-on-attribute
-        tree = ET.parse(osm)
+    state = dict((key, value) for key, value in way.__dict__.items() if key not in ("_parent_ways", "neighbors"))
+    return copy.deepcopy(state)
 
-        nodes_tree = tree.findall(".//node")
-        ways_tree = tree.findall(".//way")
-        bounds_elem = tree.find(".//bounds")
-        bounds = [bounds_elem.get("minlat"), bounds_elem.get("minlon"), bounds_elem.get("maxlat"), bounds_elem.get("maxlon")]
 
+def rebuild_network(network_class, ways_class, bounds, nids, coordinates, ways, node_ids=None, way_ids=None,
+                    crosswalk_node_ids=()):
+    """
+    Build a network from plain data. This is the inverse of Network.__reduce__. The nodes and the ways are added in
+    the order they are passed, so a copy iterates over them in the same order as the original network
+    (preprocessing depends on the order).
+
+    :param network_class: A Network class (e.g., OSM)
+    :param ways_class: A Ways class (e.g., Streets)
+    :param bounds: The bounds of the network
+    :param nids: A list of node ids
+    :param coordinates: A (n, 2) array of the (lat, lng) of the nodes
+    :param ways: A list of (Way class, attributes) tuples (see way_state)
+    :param node_ids: An IdAllocator for the nodes. If None, a new one is created
+    :param way_ids: An IdAllocator for the ways. If None, a new one is created
+    :param crosswalk_node_ids: Ids of the crosswalk nodes
+    :return: A network object
+    """
+    nodes = Nodes(capacity=max(len(nids), 1))
+    for nid, (lat, lng) in zip(nids, coordinates.tolist()):
+        nodes.add_latlng(nid, lat, lng)
+    nodes.crosswalk_node_ids = list(crosswalk_node_ids)
+
+    network = network_class.__new__(network_class)
+    Network.__init__(network, nodes, ways_class())
+    network.bounds = bounds
+    if node_ids is not None:
+        network.node_ids = node_ids
+    if way_ids is not None:
+        network.way_ids = way_ids
+
+    for way_class, state in ways:
+        way = way_class.__new__(way_class)
+        way.__dict__.update(state)
+        if hasattr(way_class, "add_neighbor"):
+            way.neighbors = []
+        network.add_way(way)
+
+    for nid in nids:
+        osm_id = network.node_ids.get_osm_id(nid)
+        if osm_id != nid:
+            network.get_node(nid).osm_id = osm_id
+    return network
+
+
+def parse(filename, highway_nodes_only=False):
+    """
+    Parse a OSM file
+
+    The file is streamed with iterparse (see utilities.iterparse_osm) instead of loading the whole element tree,
+    and the network is built incrementally as <node> and <way> elements are read. Each element is discarded
+    right after the corresponding Node/Street object is created, so the peak memory is proportional to the
+    retained nodes and ways rather than to the size of the XML document.
+
+    :param filename: A file name of an OSM file
+    :param highway_nodes_only: If True, parse the file in two passes. The first pass collects the ids of the nodes
+        that are referenced by the ways in valid_highways, and the second pass only creates those nodes. Nodes that
+        are not part of any street (e.g., buildings and POIs) are not added to the network.
+    """
     log.debug("Start parsing the file: %s" % filename)
     # Parse nodes and ways. Only read the ways that have the tags specified in valid_highways
     streets = Streets()
     street_nodes = Nodes()
-    street_network = OSM(street_nodes, streets, bounds)
+    street_network = OSM(street_nodes, streets, None)
     node_id_mapping = {}
-    for node in nodes_tree:
-        # mynode = Node(node.get("id"), node.get("lat"), node.get("lon"))
-        # street_network.add_node(mynode)
-
-        new_node = street_network.create_node(int(node.get("id")), node.get("lat"), node.get("lon"))
-        node_id_mapping[int(node.get("id"))] = new_node.id
-
     valid_highways = {'primary', 'secondary', 'tertiary', 'residential'}
-    for way in ways_tree:
-        highway_tag = way.find(".//tag[@k='highway']")
-        oneway_tag = way.find(".//tag[@k='oneway']")
-        ref_tag = way.find(".//tag[@k='ref']")
-        if highway_tag is not None and highway_tag.get("v") in valid_highways:
-            node_elements = filter(lambda elem: elem.tag == "nd", list(way))
-            nids = [node_id_mapping[int(node.get("ref"))] for node in node_elements]
-
-            # Sort the nodes by longitude.
-            if street_nodes.get(nids[0]).lng > street_nodes.get(nids[-1]).lng:
-                nids = nids[::-1]
-
-            way_type = highway_tag.get('v')
-            street = street_network.create_street(int(way.get("id")), nids, way_type)
-
-            for tag in way.findall('tag'):
-                if tag.attrib['k'] != "highway":
-                    street.add_tag(tag.attrib)
-
-
-
-            if oneway_tag is not None:
-                street.set_oneway_tag('yes')
-            else:
-                street.set_oneway_tag('no')
-            street.set_ref_tag(ref_tag)
 
+    referenced_node_ids = None
+    if highway_nodes_only:
+        with open(filename, "rb") as osm:
+            referenced_node_ids = highway_node_ids(osm, valid_highways)
 
+    with open(filename, "rb") as osm:
+        for elem in iterparse_osm(osm):
+            if elem.tag == "node":
+                if referenced_node_ids is not None and int(elem.get("id")) not in referenced_node_ids:
+                    continue
+                # Map the OSM ids through the network's allocator, so an OSM id that does not fit in 32 bits never
+                # collides with another OSM id
+                osm_id = int(elem.get("id"))
+                new_node = street_network.create_node(street_network.node_ids.map_osm_id(osm_id), elem.get("lat"),
+                                                      elem.get("lon"))
+                if new_node.id != osm_id:
+                    new_node.osm_id = osm_id
+                node_id_mapping[osm_id] = new_node.id
+            elif elem.tag == "way":
+                way = elem
+                highway_tag = way.find(".//tag[@k='highway']")
+                oneway_tag = way.find(".//tag[@k='oneway']")
+                ref_tag = way.find(".//tag[@k='ref']")
+                if highway_tag is not None and highway_tag.get("v") in valid_highways:
+                    node_elements = filter(lambda e: e.tag == "nd", list(way))
+                    nids = [node_id_mapping[int(node.get("ref"))] for node in node_elements]
+
+                    # Sort the nodes by longitude.
+                    if street_nodes.get(nids[0]).lng > street_nodes.get(nids[-1]).lng:
+                        nids = nids[::-1]
+
+                    way_type = highway_tag.get('v')
+                    osm_id = int(way.get("id"))
+                    street = street_network.create_street(street_network.way_ids.map_osm_id(osm_id), nids, way_type)
+                    if street.id != str(osm_id):
+                        street.add_original_way(str(osm_id))
+
+                    for tag in way.findall('tag'):
+                        if tag.attrib['k'] != "highway":
+                            street.add_tag(tag.attrib)
+
+                    if oneway_tag is not None:
+                        street.set_oneway_tag('yes')
+                    else:
+                        street.set_oneway_tag('no')
+                    street.set_ref_tag(ref_tag.get("v") if ref_tag is not None else None)
+            elif elem.tag == "bounds":
+                street_network.bounds = [elem.get("minlat"), elem.get("minlon"), elem.get("maxlat"), elem.get("maxlon")]
 
     return street_network
 
@@ -1,21 +1,26 @@
 from latlng import LatLng
+from ids import default_ids, is_large_id
 import json
 import numpy as np
-import random
 from types import *
 
 
 class Node(LatLng):
+    __slots__ = ('id', 'edges', '_tags', 'user', 'way_ids', 'sidewalk_nodes', 'min_intersection_cardinality',
+                 'crosswalk_distance', 'confirmed', 'made_from', '_parent_nodes', '_osm_id', 'parents', 'children')
+
     def __init__(self, nid, lat, lng):
         # self.latlng = latlng  # Note: Would it be cleaner to inherit LatLng?
         super(Node, self).__init__(lat, lng)
 
-        if type(nid) is IntType and nid > 0x7fffffff:
-            nid = random.randint(0, 0x7fffffff)  # Generate a random unsigned integer.
+        # Nodes created without an id, or with an id that does not fit in 32 bits, are given an id by the default
+        # allocator. Networks and graphs pass ids from their own allocators instead (see ids.IdAllocator).
+        if is_large_id(nid):
+            self.osm_id = nid
+            nid = default_ids.map_osm_id(nid)
 
         if nid is None:
-            ri = random.randint(0, 0x7fffffff)  # Generate a random positive integer.
-            self.id = int(ri)
+            self.id = default_ids.allocate()
         else:
             self.id = int(nid)
 
@@ -1,24 +1,126 @@
 import numpy as np
 import logging as log
+from collections import MutableMapping
 from types import *
 from shapely.geometry import Polygon, LineString, Point
+from node import Node
 from utilities import latlng_offset_size, window
 
 
+class NodeMapping(MutableMapping):
+    """
+    A dict-like view of a Nodes data structure (i.e., Nodes.nodes) that maps a node id to a Node object. Looking up a
+    node that has not been materialized yet creates its Node object.
+    """
+    def __init__(self, nodes):
+        self._nodes = nodes
+
+    def __contains__(self, nid):
+        return nid in self._nodes._index
+
+    def __delitem__(self, nid):
+        self._nodes.remove(nid)
+
+    def __getitem__(self, nid):
+        node = self._nodes.get(nid)
+        if node is None:
+            raise KeyError(nid)
+        return node
+
+    def __iter__(self):
+        return iter(self._nodes.get_ids())
+
+    def __len__(self):
+        return len(self._nodes._index)
+
+    def __setitem__(self, nid, node):
+        self._nodes.update(nid, node)
+
+
 class Nodes(object):
-    def __init__(self):
-        self.nodes = {}
+    """
+    A columnar node store. The coordinates of the nodes are kept in contiguous float64 arrays (one row per node) with
+    an id-to-row index, so bulk operations such as computing the bounds or distances can work on arrays. Node objects
+    are only created when a node is accessed (see get()), and nodes that are added with add_latlng() and never
+    accessed do not carry the per-node overhead of a Node object.
+    """
+    def __init__(self, capacity=64):
         self.crosswalk_node_ids = []
         self._parent_network = None
+
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._lat = np.zeros(capacity, dtype=np.float64)
+        self._lng = np.zeros(capacity, dtype=np.float64)
+        self._alive = np.zeros(capacity, dtype=np.bool_)
+        self._size = 0  # Number of used rows, including the rows of removed nodes
+        self._index = {}  # Node id to row
+        self._views = {}  # Node id to materialized Node object
+        self._mapping = NodeMapping(self)
         return
 
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def nodes(self):
+        return self._mapping
+
+    def _append_row(self, nid, lat, lng):
+        """
+        Append a row to the arrays, doubling their capacity if they are full
+        :return: The new row
+        """
+        if self._size == len(self._lat):
+            capacity = 2 * max(len(self._lat), 1)
+            for name in ("_ids", "_lat", "_lng", "_alive"):
+                column = getattr(self, name)
+                resized = np.zeros(capacity, dtype=column.dtype)
+                resized[:self._size] = column[:self._size]
+                setattr(self, name, resized)
+        row = self._size
+        self._ids[row] = nid
+        self._lat[row] = lat
+        self._lng[row] = lng
+        self._alive[row] = True
+        self._index[nid] = row
+        self._size += 1
+        return row
+
+    def _compact(self):
+        """
+        Drop the rows of removed nodes. The order of the rows (and thus of get_list()) is preserved.
+        """
+        rows = np.flatnonzero(self._alive[:self._size])
+        for name in ("_ids", "_lat", "_lng", "_alive"):
+            column = getattr(self, name)
+            column[:len(rows)] = column[rows]
+            column[len(rows):self._size] = 0
+        new_rows = dict(zip(self._ids[:len(rows)].tolist(), range(len(rows))))
+        for nid in self._index:
+            self._index[nid] = new_rows[nid]
+        self._size = len(rows)
+
     def add(self, node):
         """
         Add a Node object to self
         :param node: A Node object
         """
         node._parent_nodes = self
-        self.nodes[node.id] = node
+        self._set(node.id, node)
+
+    def add_latlng(self, nid, lat, lng):
+        """
+        Add a node to self without creating a Node object. The Node object is created when the node is accessed.
+        :param nid: A node id
+        :param lat: Latitude
+        :param lng: Longitude
+        """
+        self._views.pop(nid, None)
+        if nid in self._index:
+            row = self._index[nid]
+            self._lat[row], self._lng[row] = float(lat), float(lng)
+        else:
+            self._append_row(nid, float(lat), float(lng))
 
     def belongs_to(self):
         """
@@ -66,24 +168,69 @@ class Nodes(object):
         :param nid: A node id
         :return: A Node object
         """
-        if nid in self.nodes:
-            return self.nodes[nid]
+        if nid in self._views:
+            return self._views[nid]
+        elif nid in self._index:
+            row = self._index[nid]
+            node = Node(nid, self._lat[row], self._lng[row])
+            node._parent_nodes = self
+            self._views[nid] = node
+            return node
         else:
             return None
 
+    def get_bounds(self):
+        """
+        Get the bounding box of the nodes
+        :return: A list [min lat, min lng, max lat, max lng], or None if there are no nodes
+        """
+        if not self._index:
+            return None
+        alive = self._alive[:self._size]
+        lat, lng = self._lat[:self._size][alive], self._lng[:self._size][alive]
+        return [float(lat.min()), float(lng.min()), float(lat.max()), float(lng.max())]
+
+    def get_coordinates(self, nids=None):
+        """
+        Get the coordinates of nodes as an array
+        :param nids: A list of node ids. If None, the coordinates of all the nodes are returned in the order of
+            get_ids()
+        :return: A (n, 2) float64 array of (lat, lng)
+        """
+        rows = self.get_rows(nids)
+        return np.column_stack((self._lat[rows], self._lng[rows]))
+
+    def get_ids(self):
+        """
+        Get the node ids in the order the nodes were added, which is also the order of get_list()
+        :return: A list of node ids
+        """
+        return self._ids[self.get_rows()].tolist()
+
     def get_intersection_nodes(self):
         """
         Get a list of Node objects, in which each node is an intersection node.
         :return: A list of Node objects
         """
-        return [self.nodes[nid] for nid in self.nodes if self.nodes[nid].is_intersection()]
+        return [node for node in self.get_list() if node.is_intersection()]
 
     def get_list(self):
         """
         Get a list of node objects
         :return: A list of Node objects
         """
-        return self.nodes.values()
+        return [self.get(nid) for nid in self.get_ids()]
+
+    def get_rows(self, nids=None):
+        """
+        Get the rows of nodes in the coordinate arrays
+        :param nids: A list of node ids. If None, the rows of all the nodes are returned in the order of get_ids()
+        :return: An int array of rows
+        """
+        if nids is None:
+            return np.flatnonzero(self._alive[:self._size])
+        index = self._index
+        return np.fromiter((index[nid] for nid in nids), dtype=np.intp)
 
     def remove(self, nid):
         """
@@ -91,16 +238,33 @@ class Nodes(object):
         http://stackoverflow.com/questions/5844672/delete-an-element-from-a-dictionary
         :param nid: A node id
         """
-        del self.nodes[nid]
+        row = self._index.pop(nid)
+        self._views.pop(nid, None)
+        self._alive[row] = False
+
+        n_removed = self._size - len(self._index)
+        if n_removed > 1024 and n_removed > self._size / 2:
+            self._compact()
 
     def update(self, nid, new_node):
         """TBD
         :param nid:
         :param new_node:
         """
-        self.nodes[nid] = new_node
+        self._set(nid, new_node)
         return
 
+    def _set(self, nid, node):
+        """
+        Store a Node object under nid, keeping the coordinate arrays in sync
+        """
+        if nid in self._index:
+            row = self._index[nid]
+            self._lat[row], self._lng[row] = node.lat, node.lng
+        else:
+            self._append_row(nid, node.lat, node.lng)
+        self._views[nid] = node
+
 
 def print_intersections(nodes):
     for node in nodes.get_list():
@@ -0,0 +1,363 @@
+"""
+A reader for the OSM PBF format (http://wiki.openstreetmap.org/wiki/PBF_Format).
+
+The file is a sequence of blobs. Each blob is decompressed and decoded independently, so the OSMData blobs are
+handed to a pool of worker processes and decoded in parallel while the main process reads the next blobs from the
+file. The decoded primitives are yielded as the same <bounds>, <node>, and <way> elements that
+utilities.iterparse_osm yields for an OSM XML file, so the parsers can consume either format.
+
+Only the subset of the protobuf wire format that the OSM PBF schema (fileformat.proto and osmformat.proto) uses is
+implemented here, hence there is no dependency on the protobuf package.
+"""
+import multiprocessing
+import struct
+import zlib
+from xml.etree import cElementTree as ET
+
+# Wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+NANO = 1000000000
+
+
+def read_varint(data, pos):
+    """
+    Read a base 128 varint from a byte string
+
+    :param data: A byte string
+    :param pos: A position to start reading
+    :return: A tuple of the decoded (unsigned) integer and the position right after the varint
+    """
+    result = 0
+    shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    """
+    Decode a zigzag encoded integer (sint32/sint64)
+    """
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value):
+    """
+    Interpret an unsigned varint as a two's complement int64
+    """
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def iter_fields(data):
+    """
+    Iterate over the fields of a protobuf message
+
+    :param data: A serialized message
+    :return: A generator of (field number, wire type, value). The value is an integer for varint fields and a
+        byte string for length delimited fields
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == FIXED64:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type: %d" % wire_type)
+        yield field, wire_type, value
+
+
+def packed_varints(data):
+    """
+    Decode a packed repeated varint field
+
+    :param data: The payload of the packed field
+    :return: A list of unsigned integers
+    """
+    values = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def delta_decode(values):
+    """
+    Decode a list of zigzag encoded, delta coded integers (e.g., DenseNodes.id and Way.refs)
+    """
+    decoded = []
+    current = 0
+    for value in values:
+        current += zigzag(value)
+        decoded.append(current)
+    return decoded
+
+
+def nano_to_str(value):
+    """
+    Format an integer in nanodegrees as a decimal string. Unlike formatting a float, this is exact, so parsing the
+    returned string gives the same float as parsing the corresponding coordinate in an OSM XML file.
+    """
+    sign = "-" if value < 0 else ""
+    integer, fraction = divmod(abs(value), NANO)
+    fraction = ("%09d" % fraction).rstrip("0") or "0"
+    return "%s%d.%s" % (sign, integer, fraction)
+
+
+def is_pbf(source):
+    """
+    Check if a file is an OSM PBF file. The first blob of a PBF file is always an OSMHeader blob.
+
+    :param source: A file name or a seekable file object
+    :return: A boolean
+    """
+    if hasattr(source, "read"):
+        position = source.tell()
+        head = source.read(64)
+        source.seek(position)
+    else:
+        with open(source, "rb") as f:
+            head = f.read(64)
+    return len(head) > 4 and "\x0a\x09OSMHeader" in head[4:20]
+
+
+def read_blobs(f):
+    """
+    Read the blobs in a PBF file
+
+    :param f: A file object opened in binary mode
+    :return: A generator of (blob type, serialized Blob message)
+    """
+    while True:
+        size = f.read(4)
+        if len(size) < 4:
+            return
+        header_size, = struct.unpack("!I", size)
+        blob_type, data_size = None, 0
+        for field, _, value in iter_fields(f.read(header_size)):
+            if field == 1:
+                blob_type = value
+            elif field == 3:
+                data_size = value
+        yield blob_type, f.read(data_size)
+
+
+def decode_blob(blob):
+    """
+    Decompress a Blob message
+
+    :param blob: A serialized Blob message
+    :return: The uncompressed payload
+    """
+    for field, _, value in iter_fields(blob):
+        if field == 1:
+            return value
+        elif field == 3:
+            return zlib.decompress(value)
+        elif field in (4, 5, 6):
+            raise ValueError("Unsupported blob compression (field %d)" % field)
+    raise ValueError("Empty blob")
+
+
+def decode_header_block(data):
+    """
+    Decode a HeaderBlock
+
+    :param data: An uncompressed HeaderBlock message
+    :return: A bounding box [minlat, minlon, maxlat, maxlon] in nanodegrees, or None if the header has no bbox
+    """
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            bbox = {}
+            for bbox_field, _, bbox_value in iter_fields(value):
+                bbox[bbox_field] = zigzag(bbox_value)
+            # HeaderBBox: left = 1, right = 2, top = 3, bottom = 4
+            return [bbox.get(4), bbox.get(1), bbox.get(3), bbox.get(2)]
+    return None
+
+
+def decode_primitive_block(data, kinds=("node", "way")):
+    """
+    Decode a PrimitiveBlock into plain tuples that can be sent across processes.
+
+    :param data: An uncompressed PrimitiveBlock message
+    :param kinds: Kinds of primitives to decode. Groups of the other kinds are skipped without decoding them
+    :return: A list of ("node", id, lat, lon, tags) and ("way", id, refs, tags) tuples, where lat and lon are in
+        nanodegrees and tags is a list of (key, value) pairs
+    """
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            strings = [s for f, _, s in iter_fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = signed(value)
+        elif field == 20:
+            lon_offset = signed(value)
+
+    primitives = []
+    for group in groups:
+        for field, _, value in iter_fields(group):
+            if field == 1 and "node" in kinds:
+                nid, keys, vals, lat, lon = 0, [], [], 0, 0
+                for node_field, _, node_value in iter_fields(value):
+                    if node_field == 1:
+                        nid = zigzag(node_value)
+                    elif node_field == 2:
+                        keys = packed_varints(node_value)
+                    elif node_field == 3:
+                        vals = packed_varints(node_value)
+                    elif node_field == 8:
+                        lat = zigzag(node_value)
+                    elif node_field == 9:
+                        lon = zigzag(node_value)
+                tags = [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+                primitives.append(("node", nid, lat_offset + granularity * lat, lon_offset + granularity * lon, tags))
+            elif field == 2 and "node" in kinds:
+                ids, lats, lons, keys_vals = [], [], [], []
+                for dense_field, _, dense_value in iter_fields(value):
+                    if dense_field == 1:
+                        ids = delta_decode(packed_varints(dense_value))
+                    elif dense_field == 8:
+                        lats = delta_decode(packed_varints(dense_value))
+                    elif dense_field == 9:
+                        lons = delta_decode(packed_varints(dense_value))
+                    elif dense_field == 10:
+                        keys_vals = packed_varints(dense_value)
+
+                # keys_vals is a sequence of (key, value) string indices per node, each node terminated by 0
+                j = 0
+                for nid, lat, lon in zip(ids, lats, lons):
+                    tags = []
+                    while j < len(keys_vals) and keys_vals[j] != 0:
+                        tags.append((strings[keys_vals[j]], strings[keys_vals[j + 1]]))
+                        j += 2
+                    j += 1
+                    primitives.append(("node", nid, lat_offset + granularity * lat, lon_offset + granularity * lon, tags))
+            elif field == 3 and "way" in kinds:
+                wid, keys, vals, refs = 0, [], [], []
+                for way_field, _, way_value in iter_fields(value):
+                    if way_field == 1:
+                        wid = signed(way_value)
+                    elif way_field == 2:
+                        keys = packed_varints(way_value)
+                    elif way_field == 3:
+                        vals = packed_varints(way_value)
+                    elif way_field == 8:
+                        refs = delta_decode(packed_varints(way_value))
+                tags = [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+                primitives.append(("way", wid, refs, tags))
+    return primitives
+
+
+def _decode_data_blob(args):
+    """
+    Decompress and decode an OSMData blob. Defined at the module level so that it can be run by a worker process.
+    """
+    blob, kinds = args
+    return decode_primitive_block(decode_blob(blob), kinds)
+
+
+def _to_element(primitive):
+    """
+    Convert a decoded primitive into the element that an OSM XML file would have for it.
+    """
+    if primitive[0] == "node":
+        _, nid, lat, lon, tags = primitive
+        elem = ET.Element("node", {"id": str(nid), "lat": nano_to_str(lat), "lon": nano_to_str(lon)})
+    else:
+        _, wid, refs, tags = primitive
+        elem = ET.Element("way", {"id": str(wid)})
+        for ref in refs:
+            ET.SubElement(elem, "nd", {"ref": str(ref)})
+    for k, v in tags:
+        ET.SubElement(elem, "tag", {"k": k.decode("utf-8"), "v": v.decode("utf-8")})
+    return elem
+
+
+def iterparse_pbf(source, tags=("bounds", "node", "way"), processes=None):
+    """
+    Stream the bounds, nodes, and ways in an OSM PBF file as elements, in the order they appear in the file.
+
+    The OSMData blobs are decoded by a pool of worker processes. At most a few blobs per worker are in flight at a
+    time, so the memory footprint does not grow with the size of the file.
+
+    :param source: A file name or a file object of a PBF file
+    :param tags: Tags of the elements to yield (i.e., bounds, node, and/or way)
+    :param processes: The number of worker processes. Defaults to the number of CPUs. If it is 1, the blobs are
+        decoded in the calling process
+    """
+    if not hasattr(source, "read"):
+        with open(source, "rb") as f:
+            for elem in iterparse_pbf(f, tags, processes):
+                yield elem
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    kinds = tuple(tag for tag in tags if tag in ("node", "way"))
+
+    def data_blobs():
+        for blob_type, blob in read_blobs(source):
+            if blob_type == "OSMHeader":
+                bounds = decode_header_block(decode_blob(blob))
+                if "bounds" in tags and bounds is not None and None not in bounds:
+                    yield ET.Element("bounds", dict(zip(["minlat", "minlon", "maxlat", "maxlon"],
+                                                        map(nano_to_str, bounds))))
+            elif blob_type == "OSMData" and kinds:
+                yield blob
+
+    if processes <= 1:
+        for item in data_blobs():
+            if isinstance(item, str):
+                for primitive in _decode_data_blob((item, kinds)):
+                    yield _to_element(primitive)
+            else:
+                yield item
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = []
+        for item in data_blobs():
+            if isinstance(item, str):
+                pending.append(pool.apply_async(_decode_data_blob, ((item, kinds),)))
+                if len(pending) < 2 * processes:
+                    continue
+                for primitive in pending.pop(0).get():
+                    yield _to_element(primitive)
+            else:
+                yield item
+        for result in pending:
+            for primitive in result.get():
+                yield _to_element(primitive)
+    finally:
+        pool.terminate()
@@ -37,7 +37,7 @@ class Path(object):
 
     @property
     def multi_line_string(self):
-        return MultiLineString(self.edges)
+        return MultiLineString([edge.coords for edge in self.edges])
 
     @property
     def geojson_feature(self):
@@ -51,6 +51,7 @@ class Path(object):
     @edges.setter
     def edges(self, edges):
         self._edges = edges
+        self._nodes = None
 
     @osm_ids.setter
     def osm_ids(self, ids):
@@ -63,31 +64,50 @@ class Path(object):
         :param edge:
         :return:
         """
+        # Removing the first or the last edge drops the node at that end. Otherwise the node order is recomputed.
+        nodes = self._nodes
+        if nodes is not None and len(self.edges) > 1 and edge is self.edges[0]:
+            nodes = nodes[1:]
+        elif nodes is not None and len(self.edges) > 1 and edge is self.edges[-1]:
+            nodes = nodes[:-1]
+        else:
+            nodes = None
+
         edge.source.edges.remove(edge)
         edge.target.edges.remove(edge)
         self.edges.remove(edge)
+        self._nodes = nodes
+
+    def invalidate_nodes(self):
+        """
+        Discard the cached node order. This should be called after modifying self.edges in place.
+        """
+        self._nodes = None
 
     def get_nodes(self):
         """
-        Returns all the nodes in this path in topologically ordered manner
+        Returns all the nodes in this path in topologically ordered manner. The order is computed from the edges on
+        the first call and cached until the edges change.
 
         :return:
         """
-        if len(self.edges) == 1:
-            return [self.edges[0].source, self.edges[0].target]
-        else:
-            second_node = list({self.edges[0].source, self.edges[0].target} & {self.edges[1].source, self.edges[1].target})[0]
-            if self.edges[0].target == second_node:
+        if self._nodes is None:
+            if len(self.edges) == 1:
                 nodes = [self.edges[0].source, self.edges[0].target]
             else:
-                nodes = [self.edges[0].target, self.edges[0].source]
-
-            for edge in self.edges[1:]:
-                if nodes[-1] == edge.source:
-                    nodes.append(edge.target)
+                second_node = list({self.edges[0].source, self.edges[0].target} & {self.edges[1].source, self.edges[1].target})[0]
+                if self.edges[0].target == second_node:
+                    nodes = [self.edges[0].source, self.edges[0].target]
                 else:
-                    nodes.append(edge.source)
-            return nodes
+                    nodes = [self.edges[0].target, self.edges[0].source]
+
+                for edge in self.edges[1:]:
+                    if nodes[-1] == edge.source:
+                        nodes.append(edge.target)
+                    else:
+                        nodes.append(edge.source)
+            self._nodes = nodes
+        return list(self._nodes)
 
     def merge_edges(self, edge1, edge2):
         """
@@ -99,6 +119,22 @@ class Path(object):
         assert len(self.edges) > 1
         assert edge1 in self.edges
         assert edge2 in self.edges
+
+        new_edge = self.join_edges(edge1, edge2)
+        self.edges.insert(self.edges.index(edge1), new_edge)
+        self.edges.remove(edge1)
+        self.edges.remove(edge2)
+        self.invalidate_nodes()
+        return new_edge
+
+    def join_edges(self, edge1, edge2):
+        """
+        Create an edge that spans two consecutive edges in this path, and detach the two edges from their nodes.
+        Unlike merge_edges, this does not update self.edges, so the caller can rebuild the list of edges in one go.
+        :param edge1:
+        :param edge2:
+        :return: The new edge
+        """
         assert len({edge1.source, edge1.target} & {edge2.source, edge2.target}) == 1
 
         shared_node = list({edge1.source, edge1.target} & {edge2.source, edge2.target})[0]
@@ -112,7 +148,6 @@ class Path(object):
             node2 = edge2.source
         new_edge = Edge(node1, node2)
         new_edge.path = self
-        self.edges.insert(self.edges.index(edge1), new_edge)
 
         # Clean up
         edge1.source.remove_edge(edge1)
@@ -121,9 +156,6 @@ class Path(object):
         edge2.target.remove_edge(edge2)
         edge1.path = None
         edge2.path = None
-
-        self.edges.remove(edge1)
-        self.edges.remove(edge2)
         return new_edge
 
     def remove_node(self, node):
@@ -147,6 +179,7 @@ class Path(object):
             new_edges = self.edges[:idx - 1] + [new_edge] + self.edges[idx + 1:]
             self.remove_edge(self.edges[idx])
             self.edges = new_edges
+            self._nodes = nodes[:idx] + nodes[idx + 1:]
 
     def to_string(self):
         """
@@ -33,6 +33,32 @@ class TestToSidewalkMethods(unittest.TestCase):
             self.assertTrue(node1.lat == node2.lat)
             self.assertTrue(node1.lng == node2.lng)
 
+    def test_make_sidewalk_coordinates(self):
+        # A straight street. The sidewalk points are perpendicular to the street, including at the end nodes
+        p1, p2, p1_first = make_sidewalk_coordinates([(0, 0), (0, 1), (0, 2)], 0.1)
+        self.assertEqual(p1.tolist(), [[0.1, 0.], [0.1, 1.], [0.1, 2.]])
+        self.assertEqual(p2.tolist(), [[-0.1, 0.], [-0.1, 1.], [-0.1, 2.]])
+        self.assertEqual(p1_first.tolist(), [False, False, False])
+
+        # A corner. The sidewalk point is on the bisector of the corner
+        p1, p2, p1_first = make_sidewalk_coordinates([(0, 0), (0, 1), (1, 1)], 0.1)
+        self.assertAlmostEqual(p1[1, 0], 0.1 / math.sqrt(2))
+        self.assertAlmostEqual(p1[1, 1], 1 - 0.1 / math.sqrt(2))
+        self.assertAlmostEqual(p2[1, 0], - 0.1 / math.sqrt(2))
+        self.assertAlmostEqual(p2[1, 1], 1 + 0.1 / math.sqrt(2))
+
+        # Streets concatenated in a ragged array give the same points as separate calls
+        street1 = [(0, 0), (0, 1), (1, 1)]
+        street2 = [(2, 2), (3, 2.5), (3.5, 4), (3, 5)]
+        p1, p2, p1_first = make_sidewalk_coordinates(street1 + street2, [0.1] * 3 + [0.2] * 4, [3, 4])
+        for street, d, rows in [(street1, 0.1, slice(0, 3)), (street2, 0.2, slice(3, 7))]:
+            q1, q2, q1_first = make_sidewalk_coordinates(street, d)
+            self.assertEqual(p1[rows].tolist(), q1.tolist())
+            self.assertEqual(p2[rows].tolist(), q2.tolist())
+            self.assertEqual(p1_first[rows].tolist(), q1_first.tolist())
+
+        self.assertRaises(ValueError, make_sidewalk_coordinates, [(0, 0), (0, 1), (1, 1)], 0.1, [2, 1])
+
     def test_make_crosswalk_node(self):
         clat, clng = 0, 0
         lat1, lng1 = 0, 1
@@ -160,6 +186,113 @@ class TestToSidewalkMethods(unittest.TestCase):
 
             self.assertFalse(does_cross)  # should not cross
 
+    def test_split_network(self):
+        street_network = parse("../../resources/SmallMap_02.osm")
+        grid, tiles = split_network(street_network, 2, 2, halo=0.0005)
+        lat_edges, lng_edges = grid
+        self.assertEqual(len(lat_edges), 3)
+        self.assertEqual(len(lng_edges), 3)
+
+        # Every street is copied to at least one tile, and the copies do not share objects with the network
+        tile_way_ids = set(way.id for _, tile in tiles for way in tile.get_ways())
+        self.assertEqual(tile_way_ids, set(way.id for way in street_network.get_ways()))
+        for (row, column), tile in tiles:
+            for way in tile.get_ways():
+                self.assertIsNot(way, street_network.get_way(way.id))
+                self.assertEqual(way.nids, street_network.get_way(way.id).nids)
+                for nid in way.nids:
+                    self.assertEqual((tile.get_node(nid).lat, tile.get_node(nid).lng),
+                                     (street_network.get_node(nid).lat, street_network.get_node(nid).lng))
+
+        rows, columns = get_cells([[lat_edges[0], lng_edges[0]], [lat_edges[1], lng_edges[2]], [90., -180.]], grid)
+        self.assertEqual(rows.tolist(), [0, 1, 1])
+        self.assertEqual(columns.tolist(), [0, 1, 0])
+
+    def test_make_sidewalks_in_tiles(self):
+        def coordinates(sidewalk_networks):
+            return [sorted([(network.get_node(nid).lat, network.get_node(nid).lng) for nid in way.nids]
+                           for way in network.get_ways()) for network in sidewalk_networks]
+
+        street_network = parse("../../resources/SmallMap_02.osm")
+        serial = make_sidewalks_in_tiles(street_network, 2, 2, processes=1)
+        parallel = make_sidewalks_in_tiles(street_network, 2, 2, processes=2)
+        self.assertEqual(coordinates(serial), coordinates(parallel))
+        self.assertGreater(sum(len(network.get_ways()) for network in serial), 0)
+
+        stitched = stitch_sidewalks(serial)
+        self.assertEqual(len(stitched.get_ways()), sum(len(network.get_ways()) for network in serial))
+
+    def test_make_sidewalks_in_one_tile(self):
+        def coordinates(network):
+            return sorted([(network.get_node(nid).lat, network.get_node(nid).lng) for nid in way.nids]
+                          for way in network.get_ways())
+
+        # The only tile is a copy of the whole network, so it gives the same sidewalks as main()
+        street_network = parse("../../resources/SmallMap_02.osm")
+        sidewalk_networks = make_sidewalks_in_tiles(street_network, 1, 1, processes=1)
+        self.assertEqual(len(sidewalk_networks), 1)
+
+        street_network.preprocess()
+        self.assertEqual(coordinates(sidewalk_networks[0]), coordinates(main(street_network)))
+
+    def test_stitch_sidewalks(self):
+        def sidewalk_network(coordinates_list):
+            network = OSM(Nodes(), Sidewalks(), None)
+            for coordinates in coordinates_list:
+                nids = [network.create_node(None, lat, lng).id for lat, lng in coordinates]
+                network.add_way(Sidewalk(network.way_ids.allocate(), nids, "footway"))
+            return network
+
+        # The two networks have the same node and way ids. They share the node at (1, 1) (up to rounding) and the
+        # sidewalk between (1, 1) and (2, 2)
+        network1 = sidewalk_network([[(0., 0.), (1., 1.)], [(1., 1.), (2., 2.)]])
+        network2 = sidewalk_network([[(1. + 1e-9, 1.), (3., 3.)], [(2., 2.), (1., 1.)]])
+        stitched = stitch_sidewalks([network1, None, network2])
+
+        self.assertEqual(len(stitched.get_nodes()), 4)
+        self.assertEqual(len(stitched.get_ways()), 3)
+        shared = [node for node in stitched.get_nodes() if (node.lat, node.lng) == (1., 1.)]
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(len(shared[0].get_way_ids()), 3)
+        self.assertEqual(sorted(sorted((stitched.get_node(nid).lat, stitched.get_node(nid).lng) for nid in way.nids)
+                                for way in stitched.get_ways()),
+                         [[(0., 0.), (1., 1.)], [(1., 1.), (2., 2.)], [(1., 1.), (3., 3.)]])
+        self.assertEqual(len(stitch_sidewalks([]).get_ways()), 0)
+
+    def test_stitch_cropped_sidewalks(self):
+        def sidewalk_network():
+            # A footway in the cell (0, 0) and a crosswalk in the cell (0, 1)
+            network = OSM(Nodes(), Sidewalks(), None)
+            for way_type, coordinates in [("footway", [(0.5, 0.2), (0.5, 0.8)]),
+                                          ("crosswalk", [(0.5, 1.2), (0.5, 1.8)])]:
+                nids = [network.create_node(None, lat, lng).id for lat, lng in coordinates]
+                network.add_way(Sidewalk(network.way_ids.allocate(), nids, way_type))
+                if way_type == "crosswalk":
+                    network.nodes.crosswalk_node_ids.extend(nids)
+            return network
+
+        def crosswalk_coordinates(network):
+            return sorted((network.get_node(nid).lat, network.get_node(nid).lng)
+                          for nid in network.nodes.crosswalk_node_ids)
+
+        grid = make_grid([0., 0., 1., 2.], 1, 2)
+        tile1 = crop_sidewalks(sidewalk_network(), grid, (0, 0))
+        tile2 = crop_sidewalks(sidewalk_network(), grid, (0, 1))
+        self.assertEqual(tile1.nodes.crosswalk_node_ids, [])
+        self.assertEqual(len(tile2.nodes.crosswalk_node_ids), 2)
+
+        stitched = stitch_sidewalks([tile1, tile2])
+        self.assertEqual(sorted(way.type for way in stitched.get_ways()), ["crosswalk", "footway"])
+        self.assertEqual(crosswalk_coordinates(stitched), [(0.5, 1.2), (0.5, 1.8)])
+
+        # The ids of removed crosswalk nodes that are left in crosswalk_node_ids are skipped
+        network = sidewalk_network()
+        network.remove_way([way.id for way in network.get_ways() if way.type == "crosswalk"][0])
+        self.assertEqual(len(network.nodes.crosswalk_node_ids), 2)
+        stitched = stitch_sidewalks([network])
+        self.assertEqual(len(stitched.get_ways()), 1)
+        self.assertEqual(stitched.nodes.crosswalk_node_ids, [])
+
     def test_main(self):
         filenames = [
             "../../resources/Simple4WayIntersection_01.osm",
@@ -0,0 +1,134 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from shapely import wkb
+
+from ToSidewalk.ids import IdAllocator, MAX_ID
+from ToSidewalk.network import parse
+
+try:
+    from sqlalchemy import Column, Float, Integer, MetaData, Table, create_engine
+    from ToSidewalk.db import bulk
+except ImportError:
+    bulk = None
+
+
+@unittest.skipIf(bulk is None, "sqlalchemy or geoalchemy2 is not installed")
+class TestBulkMethods(unittest.TestCase):
+
+    def test_ewkb(self):
+        point = wkb.loads(bulk.point_ewkb(-77.037852, 38.898556), hex=True)
+        self.assertEqual((point.geom_type, point.x, point.y), ("Point", -77.037852, 38.898556))
+
+        coordinates = [(-77.1, 38.9), (-77.2, 38.8), (-77.25, 38.85)]
+        line = wkb.loads(bulk.linestring_ewkb(coordinates), hex=True)
+        self.assertEqual(line.geom_type, "LineString")
+        self.assertEqual(list(line.coords), coordinates)
+
+        # The type code has the SRID flag and is followed by the SRID (4326 = 0x10e6)
+        self.assertEqual(bulk.point_ewkb(0, 0)[:18], "0101000020e6100000")
+
+    def test_copy_value(self):
+        self.assertEqual(bulk._copy_value(None), "\\N")
+        self.assertEqual(bulk._copy_value(True), "t")
+        self.assertEqual(bulk._copy_value(False), "f")
+        self.assertEqual(bulk._copy_value(0.1), "0.1")
+        self.assertEqual(bulk._copy_value(12), "12")
+        self.assertEqual(bulk._copy_value("a\tb\nc\rd\\e"), "a\\tb\\nc\\rd\\\\e")
+        self.assertEqual(bulk._copy_value(u"Caf\xe9"), "Caf\xc3\xa9")
+
+    def test_batches(self):
+        self.assertEqual(list(bulk.batches(iter(range(7)), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(bulk.batches(range(6), 3)), [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(list(bulk.batches([], 3)), [])
+
+    def test_street_rows(self):
+        street_network = parse("../../resources/SmallMap_01.osm")
+        ways = street_network.get_ways()
+
+        node_rows = list(bulk.street_node_rows(street_network))
+        self.assertEqual(len(node_rows), len(street_network.get_nodes()))
+        for nid, geom, lat, lng in node_rows:
+            node = street_network.get_node(nid)
+            self.assertEqual((lat, lng), (node.lat, node.lng))
+            point = wkb.loads(geom, hex=True)
+            self.assertEqual((point.x, point.y), (lng, lat))
+
+        edge_rows = list(bulk.street_edge_rows(street_network))
+        self.assertEqual(sorted(row[0] for row in edge_rows), sorted(int(way.id) for way in ways))
+        for row in edge_rows:
+            self.assertEqual(len(row), len(bulk.STREET_EDGE_COLUMNS))
+            street = street_network.get_way(str(row[0]))
+            coordinates = street_network.get_coordinates(street, lnglat=True)
+            self.assertEqual(list(wkb.loads(row[1], hex=True).coords), [tuple(c) for c in coordinates])
+            self.assertEqual(row[2:], (coordinates[0][0], coordinates[0][1], coordinates[-1][0],
+                                       coordinates[-1][1], street.type, street.nids[0], street.nids[-1], False))
+
+        self.assertEqual(list(bulk.street_edge_street_node_rows(street_network)),
+                         [(int(way.id), nid) for way in ways for nid in way.get_node_ids()])
+        self.assertEqual(list(bulk.street_edge_parent_edge_rows(street_network)),
+                         [(int(way.id), int(parent)) for way in ways for parent in way.get_original_ways()])
+
+    def test_copy_rows(self):
+        engine = create_engine("sqlite://")
+        metadata = MetaData()
+        table = Table("street_node", metadata, Column("street_node_id", Integer, primary_key=True, key="node_id"),
+                      Column("lat", Float), Column("lng", Float))
+        metadata.create_all(engine)
+
+        connection = engine.connect()
+        with connection.begin():
+            columns = ("street_node_id", "lat", "lng")
+            rows = ((i, float(i), -float(i)) for i in range(25))
+            self.assertEqual(bulk.copy_rows(connection, table, columns, rows, 10, skip_existing=True), 25)
+            # Rows that are already in the table are skipped, including whole batches of them
+            rows = ((i, 0., 0.) for i in range(16, 30))
+            self.assertEqual(bulk.copy_rows(connection, table, columns, rows, 4, skip_existing=True), 5)
+
+        result = connection.execute(table.select().order_by(table.c.node_id)).fetchall()
+        self.assertEqual([tuple(row) for row in result],
+                         [(i, float(i), -float(i)) for i in range(25)] + [(i, 0., 0.) for i in range(25, 30)])
+
+    def test_geojson_features(self):
+        features = [{"type": "Feature", "properties": {"way_id": i}, "geometry": None} for i in range(3)]
+        collection = {"type": "FeatureCollection", "features": features}
+        inputs = [
+            json.dumps(collection),
+            json.dumps(collection, indent=2),
+            "".join(json.dumps(feature) + "\n" for feature in features),
+            # RFC 8142 records, and a blank first line
+            "\n" + "".join("\x1e" + json.dumps(feature) + "\n" for feature in features),
+            "\x1e" + "\n\x1e".join(json.dumps(feature) for feature in features)
+        ]
+        for string in inputs:
+            self.assertEqual(list(bulk.geojson_features(StringIO(string))), features)
+        self.assertEqual(list(bulk.geojson_features(StringIO("\n\n"))), [])
+
+    def test_sidewalk_edge_feature_rows(self):
+        def feature(way_id, source, target, coordinates):
+            return {"type": "Feature", "id": str(way_id),
+                    "properties": {"way_id": str(way_id), "way_type": "footway", "source": source, "target": target},
+                    "geometry": {"type": "LineString", "coordinates": coordinates}}
+
+        features = [
+            feature(5, 1, 2, [[-77.0, 38.9], [-77.1, 38.8]]),
+            feature(3099890832, 4294967297, 1, [[-77.2, 38.7], [-77.0, 38.9]]),
+            feature(6, 2, 4294967297, [[-77.1, 38.8], [-77.2, 38.7]]),
+            # Node features and features without a geometry are skipped
+            {"type": "Feature", "properties": {}, "geometry": {"type": "Point", "coordinates": [-77.0, 38.9]}},
+            {"type": "Feature", "properties": {"way_id": "7"}, "geometry": None}
+        ]
+        edge_ids, node_ids = IdAllocator(), IdAllocator()
+        rows = list(bulk.sidewalk_edge_feature_rows(features, edge_ids, node_ids))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row[0] for row in rows], [5, 1, 6])
+        self.assertEqual([(row[7], row[8]) for row in rows], [(1, 2), (3, 1), (2, 3)])
+        self.assertTrue(all(value <= MAX_ID for row in rows for value in (row[0], row[7], row[8])))
+        self.assertEqual(edge_ids.get_osm_id(1), 3099890832)
+        self.assertEqual(node_ids.get_osm_id(3), 4294967297)
+        self.assertEqual(rows[0][2:7], (-77.0, 38.9, -77.1, 38.8, "footway"))
+
+
+if __name__ == '__main__':
+    unittest.main()
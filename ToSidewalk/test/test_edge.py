@@ -15,5 +15,15 @@ class TestEdgeMethods(unittest.TestCase):
 
         self.assertEqual(edge1.distance(edge2), 1.)
 
+    def test_geometry(self):
+        node1 = Node(0, 0, 0)
+        node2 = Node(1, 3, 4)
+        edge = Edge(node1, node2)
+        self.assertIsNone(edge._geometry)
+        self.assertEqual(edge.coords, [(0., 0.), (4., 3.)])
+        self.assertEqual(edge.length, 5.)
+        self.assertEqual(edge.length, edge.geometry.length)
+        self.assertEqual(edge.bounds, edge.geometry.bounds)
+
 if __name__ == '__main__':
     unittest.main()
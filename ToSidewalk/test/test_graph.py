@@ -1,6 +1,13 @@
+import gzip
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from multiprocessing import Pool
 
-from ToSidewalk.graph import GeometricGraph
+from ToSidewalk.graph import GeometricGraph, clean_edge_segmentation, make_sidewalks, make_sidewalks_in_cells, \
+    parse_osm, remove_short_edges, split_graph
 
 
 class TestGeometricGraphMethods(unittest.TestCase):
@@ -27,6 +34,37 @@ class TestGeometricGraphMethods(unittest.TestCase):
 
         self.assertEqual(len(self.graph.get_adjacent_nodes(n0)), 4)
 
+    def test_get_adjacency(self):
+        n0 = self.graph.create_node(0., 0.)
+        n1 = self.graph.create_node(1., 0.)
+        n2 = self.graph.create_node(0., 1.)
+        n3 = self.graph.create_node(-1., 0.)
+        n4 = self.graph.create_node(5., 5.)
+        n5 = self.graph.create_node(6., 5.)
+
+        self.graph.create_path(nodes=[n1, n0, n2])
+        self.graph.create_path(nodes=[n0, n3])
+        self.graph.create_path(nodes=[n4, n5])
+
+        adjacency = self.graph.get_adjacency()
+        self.assertEqual(len(adjacency), 6)
+        self.assertEqual(adjacency.degree(n0.id), 3)
+        self.assertEqual(adjacency.degree(n4.id), 1)
+        self.assertEqual(sorted(adjacency.neighbors(n0.id)), sorted([n1.id, n2.id, n3.id]))
+        self.assertEqual(adjacency.intersections(), [n0.id])
+        self.assertEqual(sorted((degree, node.id) for degree, node in self.graph.get_degrees()),
+                         sorted((len(node.edges), node.id) for node in self.graph.get_nodes()))
+
+        n_components, labels = adjacency.connected_components()
+        self.assertEqual(n_components, 2)
+        self.assertTrue(adjacency.is_connected(n1.id, n3.id))
+        self.assertFalse(adjacency.is_connected(n1.id, n5.id))
+
+        # The snapshot does not change with the graph
+        self.graph.create_path(nodes=[n3, n4])
+        self.assertFalse(adjacency.is_connected(n1.id, n5.id))
+        self.assertTrue(self.graph.get_adjacency().is_connected(n1.id, n5.id))
+
     def test_get_degrees(self):
         n0 = self.graph.create_node(0., 0.)
         n1 = self.graph.create_node(1., 0.)
@@ -64,5 +102,143 @@ class TestGeometricGraphMethods(unittest.TestCase):
         self.graph.remove_path(path1.id)
         self.assertEqual(len(node.edges), 1)
 
+    def test_clean_edge_segmentation(self):
+        # A street segmented into three paths, and a T intersection at its end
+        nodes = [self.graph.create_node(float(i), 0.) for i in range(4)]
+        for n1, n2 in zip(nodes, nodes[1:]):
+            self.graph.create_path(nodes=[n1, n2])
+        self.graph.create_path(nodes=[nodes[-1], self.graph.create_node(3., 1.)])
+        self.graph.create_path(nodes=[nodes[-1], self.graph.create_node(3., -1.)])
+
+        clean_edge_segmentation(self.graph)
+        paths = sorted(self.graph.get_paths(), key=lambda path: len(path.edges))
+        self.assertEqual([len(path.edges) for path in paths], [1, 1, 3])
+        self.assertEqual([node.x for node in paths[-1].get_nodes()], [0., 1., 2., 3.])
+
+    def test_remove_short_edges(self):
+        # Edges of about 11m, except for the last one
+        nodes = [self.graph.create_node(0., lat) for lat in [0., 0.0001, 0.0002, 0.0003, 0.0004, 0.001]]
+        path = self.graph.create_path(nodes=nodes)
+
+        remove_short_edges(self.graph, distance_threshold=15)
+        self.assertEqual([(edge.source.lat, edge.target.lat) for edge in path.edges],
+                         [(0., 0.0002), (0.0002, 0.0004), (0.0004, 0.001)])
+        self.assertEqual([len(node.edges) for node in nodes], [1, 0, 2, 0, 2, 1])
+
+    def test_make_sidewalks(self):
+        n0 = self.graph.create_node(0., 0.)
+        adjacent_nodes = [self.graph.create_node(x, y) for x, y in [(0.001, 0.), (0., 0.001), (-0.001, 0.), (0., -0.001)]]
+        for n in adjacent_nodes:
+            self.graph.create_path(nodes=[n0, n])
+
+        sidewalk_graph = make_sidewalks(self.graph, distance_to_sidewalk=15)
+
+        # Two sidewalks for each street and four crosswalks around the intersection
+        paths = sidewalk_graph.get_paths()
+        self.assertEqual(len(paths), 12)
+        crosswalk_nodes = [node for node in sidewalk_graph.get_nodes() if len(node.parents) == 2]
+        self.assertEqual(len(crosswalk_nodes), 4)
+
+        # Each crosswalk node is at a corner, where the two crosswalks and the sidewalks of the two streets meet
+        for node in crosswalk_nodes:
+            self.assertEqual(len(node.edges), 4)
+            self.assertNotEqual(node.lat, 0.)
+            self.assertNotEqual(node.lng, 0.)
+            self.assertTrue(node.lat * node.parents[0].lat + node.lng * node.parents[0].lng > 0)
+            self.assertTrue(node.lat * node.parents[1].lat + node.lng * node.parents[1].lng > 0)
+
+        # The sidewalk nodes that were created next to the intersection are replaced by the crosswalk nodes, so each
+        # sidewalk has one crosswalk node and each crosswalk has two
+        counts = [len([node for node in path.get_nodes() if any(node is n for n in crosswalk_nodes)]) for path in paths]
+        self.assertEqual(sorted(counts), [1] * 8 + [2] * 4)
+
+    def test_parse_osm_highway_nodes_only(self):
+        filename = "../../resources/SmallMap_01.osm"
+        graph = parse_osm(filename)
+        graph_two_pass = parse_osm(filename, highway_nodes_only=True)
+
+        referenced = set(edge.source.osm_id for path in graph.get_paths() for edge in path.edges) | \
+            set(edge.target.osm_id for path in graph.get_paths() for edge in path.edges)
+        self.assertEqual(set(n.osm_id for n in graph_two_pass.get_nodes()), referenced)
+        self.assertLess(len(graph_two_pass.get_nodes()), len(graph.get_nodes()))
+        self.assertEqual(sorted(path.osm_ids for path in graph.get_paths()),
+                         sorted(path.osm_ids for path in graph_two_pass.get_paths()))
+
+    def test_export_to(self):
+        graph = parse_osm("../../resources/SmallMap_01.osm")
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "graph.osm.gz")
+            with open(filename, "wb") as f:
+                graph.export_to(f, format="osm", compress=True)
+            with open(os.path.join(directory, "graph.osm"), "wb") as f:
+                f.write(gzip.open(filename).read())
+            graph2 = parse_osm(os.path.join(directory, "graph.osm"))
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(sorted((n.osm_id, n.lat, n.lng) for n in graph2.get_nodes()),
+                         sorted((n.osm_id, float(str(n.lat)), float(str(n.lng))) for n in graph.get_nodes()))
+        self.assertEqual(sorted(p.id for p in graph2.get_paths()), sorted(p.id for p in graph.get_paths()))
+
+    def test_pickle(self):
+        graph = parse_osm("../../resources/SmallMap_01.osm")
+        graph2 = pickle.loads(pickle.dumps(graph, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(graph2.bounds, graph.bounds)
+        self.assertEqual(sorted((n.id, n.lat, n.lng, n.osm_id) for n in graph2.get_nodes()),
+                         sorted((n.id, n.lat, n.lng, n.osm_id) for n in graph.get_nodes()))
+        self.assertEqual(sorted((p.id, [n.id for n in p.get_nodes()], p.osm_ids) for p in graph2.get_paths()),
+                         sorted((p.id, [n.id for n in p.get_nodes()], p.osm_ids) for p in graph.get_paths()))
+        self.assertEqual(graph2.node_ids.allocate(), graph.node_ids.allocate())
+
+    def test_split_graph(self):
+        graph = parse_osm("../../resources/SmallMap_01.osm")
+        subgraphs = split_graph(graph, 2, 2)
+        self.assertEqual(len(subgraphs), 4)
+
+        # Every path with a node in the bounds is copied to the cells of its nodes
+        path_ids = set(p.id for subgraph in subgraphs if subgraph for p in subgraph.get_paths())
+        self.assertEqual(path_ids, set(p.id for p in graph.get_paths()))
+        for subgraph in subgraphs:
+            if subgraph:
+                for path in subgraph.get_paths():
+                    self.assertIsNot(path, graph.paths[path.id])
+                    self.assertEqual([n.id for n in path.get_nodes()],
+                                     [n.id for n in graph.paths[path.id].get_nodes()])
+
+        # The subgraphs are the same when they are built by a pool of workers
+        pool = Pool(2)
+        try:
+            pooled = split_graph(graph, 2, 2, pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+        for subgraph, subgraph2 in zip(subgraphs, pooled):
+            self.assertEqual(sorted(p.id for p in subgraph.get_paths()) if subgraph else None,
+                             sorted(p.id for p in subgraph2.get_paths()) if subgraph2 else None)
+
+        # With remove=True, each path goes to one cell and is removed from the graph
+        n_paths = len(graph.get_paths())
+        subgraphs = split_graph(graph, 2, 2, remove=True)
+        self.assertEqual(sum(len(subgraph.get_paths()) for subgraph in subgraphs if subgraph), n_paths)
+        self.assertEqual(len(graph.get_paths()), 0)
+
+    def test_make_sidewalks_in_cells(self):
+        graph = parse_osm("../../resources/SmallMap_01.osm")
+        serial = make_sidewalks_in_cells(graph, 2, 1)
+        pool = Pool(2)
+        try:
+            pooled = make_sidewalks_in_cells(graph, 2, 1, pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(len(pooled), 2)
+        self.assertTrue(any(sidewalks and sidewalks.get_paths() for sidewalks in pooled))
+        for sidewalks, sidewalks2 in zip(serial, pooled):
+            self.assertEqual(sorted((n.lat, n.lng) for n in sidewalks.get_nodes()) if sidewalks else None,
+                             sorted((n.lat, n.lng) for n in sidewalks2.get_nodes()) if sidewalks2 else None)
+
 if __name__ == '__main__':
     unittest.main()
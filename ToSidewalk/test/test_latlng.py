@@ -11,6 +11,14 @@ class TestLatLngMethods(unittest.TestCase):
     def test_distance(self):
         self.assertAlmostEqual(LatLng(0, 0).distance(LatLng(1, 1)), math.sqrt(2))
 
+    def test_geometry(self):
+        latlng = LatLng(1, 2)
+        self.assertFalse(hasattr(latlng, '__dict__'))
+        self.assertIsNone(latlng._geometry)
+        self.assertEqual((latlng.geometry.x, latlng.geometry.y), (2., 1.))
+        self.assertIs(latlng.geometry, latlng.geometry)
+        self.assertEqual(latlng.coords, [(2., 1.)])
+
     def test_haversine(self):
         """
         Haversine ground truth is from:
@@ -34,6 +42,24 @@ class TestLatLngMethods(unittest.TestCase):
         error = abs(distance - haversine(latlng1[1], latlng1[0], latlng2[1], latlng2[0]))
         self.assertTrue(error < 1)  # Error should be below 1m
 
+    def test_array_kernels(self):
+        """
+        The vectorized kernels should give the same results as the scalar methods
+        """
+        rng = np.random.RandomState(0)
+        origins = np.column_stack((rng.uniform(38.8, 39., 100), rng.uniform(-77.1, -76.9, 100)))
+        targets = np.column_stack((rng.uniform(38.8, 39., 100), rng.uniform(-77.1, -76.9, 100)))
+        targets[0] = origins[0]
+        pairs = [(LatLng(o[0], o[1]), LatLng(t[0], t[1])) for o, t in zip(origins, targets)]
+
+        self.assertEqual(distance_in_meters_array(origins, targets).tolist(),
+                         [o.distance_in_meters(t) for o, t in pairs])
+        self.assertEqual(angle_to_array(origins[:, 0], origins[:, 1], targets[:, 0], targets[:, 1]).tolist(),
+                         [o.angle_to(t) for o, t in pairs])
+        self.assertEqual(vector_to_array(origins, targets).tolist(), [o.vector_to(t).tolist() for o, t in pairs])
+        self.assertEqual(vector_to_array(origins, targets, normalize=True).tolist(),
+                         [o.vector_to(t, normalize=True).tolist() for o, t in pairs])
+
     def test_equal(self):
         latlng1 = [38.898556, -77.037852]
         latlng2 = [38.897147, -77.043934]
@@ -1,4 +1,8 @@
+import gzip
+import json
 import unittest
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
 from ToSidewalk.network import *
 from ToSidewalk.nodes import *
 from ToSidewalk.ways import *
@@ -32,6 +36,25 @@ class TestNetworkMethods(unittest.TestCase):
         adj = network.get_adjacent_nodes(n0)
         self.assertEqual(len(adj), 3)
 
+    def test_get_adjacency(self):
+        network = Network(Nodes(), Streets())
+        n0 = Node(0, 0, 0)
+        n1 = Node(1, 0, 1)
+        n2 = Node(2, 1, 0)
+        n3 = Node(3, 0, -1)
+        n4 = Node(4, 2, 0)
+        network.add_nodes([n0, n1, n2, n3, n4])
+        network.add_ways([Street(1, [n1.id, n0.id, n3.id]), Street('2_1', [n0.id, n2.id]),
+                          Street('2_2', [n0.id, n2.id])])
+
+        # The segment shared by the two parallel ways is counted once
+        adjacency = network.get_adjacency()
+        self.assertEqual(adjacency.degree(n0.id), 3)
+        self.assertEqual(sorted(adjacency.neighbors(n0.id)), [1, 2, 3])
+        self.assertEqual(adjacency.intersections(), [n0.id])
+        self.assertEqual(adjacency.degree(n4.id), 0)
+        self.assertEqual(adjacency.connected_components()[0], 2)
+
     def test_segment_parallel_streets_1(self):
         """
         Test segment parallel streets
@@ -314,6 +337,22 @@ class TestNetworkMethods(unittest.TestCase):
         self.assertEqual(segments2[2], [])
         self.assertListEqual(segments2[1], segment2_node_ids[1:])
 
+    def test_merge_nodes(self):
+        network = OSM(Nodes(), Streets(), None)
+        meter = 1. / 111195  # Roughly a meter in degrees along the equator
+        lngs = [0, 100, 105, 200, 300, 305, 312, 400, 500]
+        network.add_nodes([Node(i + 1, 0, lng * meter) for i, lng in enumerate(lngs)])
+        street = network.create_street('1', range(1, len(lngs) + 1))
+
+        network.merge_nodes(distance_threshold=15)
+        # (100, 105) is merged into 102.5. (300, 305) is merged into 302.5, which is then merged with 312
+        nids = street.get_node_ids()
+        self.assertEqual(len(nids), 6)
+        self.assertEqual([nids[0], nids[2], nids[4], nids[5]], [1, 4, 8, 9])
+        self.assertAlmostEqual(network.get_node(nids[1]).lng / meter, 102.5)
+        self.assertAlmostEqual(network.get_node(nids[3]).lng / meter, 307.25)
+        self.assertEqual(network.get_node(nids[3]).get_way_ids(), ['1'])
+
     def test_merge_parallel_street_segments(self):
         """
         Test the constructor
@@ -359,6 +398,50 @@ class TestNetworkMethods(unittest.TestCase):
         street_network.merge_parallel_street_segments(parallel_segments)
         return
 
+    def test_find_parallel_street_segments(self):
+        nodes = Nodes()
+        streets = Streets()
+        network = OSM(nodes, streets, None)
+        network.add_nodes([Node(0, 0, 0), Node(1, 0, 0.001), Node(2, 0.00002, 0), Node(3, 0.00002, 0.001),
+                           Node(4, -0.0005, 0.0005), Node(5, 0.0005, 0.0005), Node(6, 0.1, 0), Node(7, 0.1, 0.001)])
+        network.create_street('1', [0, 1])
+        network.create_street('2', [2, 3])  # Parallel to and overlapping with 1
+        network.create_street('3', [4, 5])  # Crosses 1 and 2, but is perpendicular to them
+        network.create_street('4', [6, 7])  # Parallel to 1 and 2, but far away
+
+        pairs = network.find_parallel_street_segments()
+        self.assertEqual(sorted(tuple(sorted(pair)) for pair in pairs), [('1', '2')])
+
+    def test_hough_index(self):
+        network = OSM(Nodes(), Streets(), None)
+        network.hough_origin = (0, 0)
+        network.add_nodes([Node(i, lat, lng) for i, (lat, lng) in
+                           enumerate([(1, 0), (1, 1), (1.01, 2), (1.01, 3), (5, 0), (5, 1)])])
+        s1 = network.create_street('1', [0, 1])
+        s2 = network.create_street('2', [2, 3])
+        s3 = network.create_street('3', [4, 5])
+
+        hough_index = network.get_hough_index()
+        self.assertEqual([s.id for s in network.get_nearby_ways(s1, k=2)], ['1', '2'])
+        self.assertEqual([[s.id for s in streets] for streets in hough_index.query([s1, s3], k=10)],
+                         [['1', '2', '3'], ['3', '2', '1']])
+        self.assertEqual(sorted(tuple(sorted([a.id, b.id])) for a, b in network.get_nearest_neighbor_pairs()),
+                         [('1', '2'), ('1', '2'), ('2', '3')])
+
+        # The index is reused until the ways change
+        self.assertIs(network.get_hough_index(), hough_index)
+
+        # It is rebuilt after the nids of a way are changed in place, and after a way is removed
+        s3.nids[:] = [0, 1]
+        network.ways_changed()
+        rebuilt = network.get_hough_index()
+        self.assertIsNot(rebuilt, hough_index)
+        self.assertEqual(sorted(s.id for s in network.get_nearby_ways(s1, k=2)), ['1', '3'])
+        self.assertIs(network.get_hough_index(), rebuilt)
+        network.remove_way('2')
+        self.assertIsNot(network.get_hough_index(), rebuilt)
+        self.assertEqual(sorted(s.id for s in network.get_nearby_ways(s1, k=10)), ['1', '3'])
+
     def test_simplify(self):
         segment1_coordinates = [
             (0., 2.),
@@ -382,11 +465,148 @@ class TestNetworkMethods(unittest.TestCase):
         network = OSM(nodes, streets, None)
         network.simplify(street1.id)
 
+    def test_simplify_ways(self):
+        coordinates = [(0., 2.), (3., 0.), (6., 1.), (9., 0.), (12., 0.5), (15., 2.)]
+
+        def make_network():
+            network = OSM(Nodes(), Streets(), None)
+            network.add_nodes([Node(i, y, x) for i, (x, y) in enumerate(coordinates)] + [Node(10, 5., 9.)])
+            # Node 3 is an intersection
+            network.add_ways([Street(1, range(6)), Street(2, [3, 10])])
+            return network
+
+        network = make_network()
+        network.simplify_ways(threshold=0.5)
+        self.assertEqual(network.get_way("1").nids, [0, 3, 5])
+        self.assertEqual(network.get_way("2").nids, [3, 10])
+        self.assertEqual(sorted(network.nodes.get_ids()), [0, 3, 5, 10])
+        self.assertEqual(sorted(network.get_node(3).get_way_ids()), ["1", "2"])
+
+        network = make_network()
+        network.simplify("1", tolerance=10., method="douglas-peucker")
+        self.assertEqual(network.get_way("1").nids, [0, 3, 5])
+
+        self.assertRaises(ValueError, network.simplify_ways, method="douglas-peucker")
+        self.assertRaises(ValueError, network.simplify_ways, method="unknown")
+
     def test_parse(self):
         filename = "../../resources/SmallMap_01.osm"
         street_network = parse(filename)
         # Todo: Write a test to see the parsing worked
 
+    def test_parse_streaming(self):
+        from xml.etree import cElementTree as ET
+        filename = "../../resources/SmallMap_01.osm"
+        street_network = parse(filename)
+
+        tree = ET.parse(filename)
+        valid_highways = {'primary', 'secondary', 'tertiary', 'residential'}
+        way_ids = [way.get("id") for way in tree.findall(".//way")
+                   if way.find(".//tag[@k='highway']") is not None and
+                   way.find(".//tag[@k='highway']").get("v") in valid_highways]
+        self.assertEqual(len(street_network.get_nodes()), len(tree.findall(".//node")))
+        self.assertEqual(sorted(way.id for way in street_network.get_ways()), sorted(way_ids))
+        self.assertEqual(street_network.bounds, ["38.8958400", "-76.9811500", "38.8969600", "-76.9796600"])
+
+    def test_id_allocation(self):
+        from ToSidewalk.ids import IdAllocator, MAX_ID
+        ids = IdAllocator()
+        ids.reserve(1)
+        ids.reserve("2_1")
+        self.assertEqual(ids.allocate(), 2)
+        self.assertEqual(ids.map_osm_id(5), 5)
+        self.assertEqual(ids.map_osm_id(3099890832), 3)
+        self.assertEqual(ids.map_osm_id(3099890832), 3)
+        # A small OSM id that was given to a large one, or that was allocated, is mapped to a new id
+        self.assertEqual(ids.map_osm_id(3), 4)
+        self.assertEqual(ids.map_osm_id(2), 6)
+        self.assertEqual(ids.get_osm_id(3), 3099890832)
+        self.assertEqual(ids.get_id(3099890832), 3)
+        self.assertEqual(ids.get_osm_id(5), 5)
+        self.assertEqual(ids.allocate(), 7)
+
+        # A kept OSM id near MAX_ID does not use up the ids below it
+        ids = IdAllocator()
+        self.assertEqual(ids.map_osm_id(MAX_ID - 7), MAX_ID - 7)
+        self.assertEqual(ids.map_osm_id(MAX_ID), MAX_ID)
+        self.assertEqual([ids.map_osm_id(3099890832 + i) for i in range(1000)], range(1, 1001))
+        self.assertEqual(ids.allocate(), 1001)
+
+        # Allocation skips the reserved ids up to MAX_ID
+        ids = IdAllocator(start=MAX_ID - 3)
+        ids.reserve(MAX_ID - 2)
+        ids.reserve(MAX_ID)
+        self.assertEqual([ids.allocate(), ids.allocate()], [MAX_ID - 3, MAX_ID - 1])
+        self.assertRaises(OverflowError, ids.allocate)
+
+        # Parsing the same file twice gives the same ids, and the OSM ids that do not fit in 32 bits are kept
+        filename = "../../resources/SmallMap_01.osm"
+        network1 = parse(filename)
+        network2 = parse(filename)
+        self.assertEqual(sorted(network1.nodes.get_ids()), sorted(network2.nodes.get_ids()))
+        self.assertTrue(all(nid <= 0x7fffffff for nid in network1.nodes.get_ids()))
+        node = network1.get_node(network1.node_ids.get_id(3099890832))
+        self.assertEqual(node.osm_id, 3099890832)
+        self.assertEqual(network1.create_node(None, 0, 0).id, network2.create_node(None, 0, 0).id)
+
+    def test_pickle(self):
+        import pickle
+        street_network = parse("../../resources/SmallMap_01.osm")
+        copied = pickle.loads(pickle.dumps(street_network, 2))
+
+        def way_coordinates(network):
+            return sorted((way.id, way.type, way.get_tags(), [(network.get_node(nid).lat, network.get_node(nid).lng)
+                                                             for nid in way.get_node_ids()])
+                          for way in network.get_ways())
+        self.assertIsInstance(copied, OSM)
+        self.assertEqual(way_coordinates(copied), way_coordinates(street_network))
+        # The copy iterates over the nodes and the ways in the same order, so it is preprocessed the same way
+        self.assertEqual(copied.nodes.get_ids(), street_network.nodes.get_ids())
+        self.assertEqual([way.id for way in copied.get_ways()], [way.id for way in street_network.get_ways()])
+        self.assertEqual(copied.bounds, street_network.bounds)
+        node = copied.get_node(copied.node_ids.get_id(3099890832))
+        self.assertEqual(node.osm_id, 3099890832)
+        self.assertEqual(copied.create_node(None, 0, 0).id, street_network.create_node(None, 0, 0).id)
+
+    def test_parse_highway_nodes_only(self):
+        filename = "../../resources/SmallMap_01.osm"
+        street_network = parse(filename)
+        street_network_two_pass = parse(filename, highway_nodes_only=True)
+
+        referenced = set(nid for way in street_network_two_pass.get_ways() for nid in way.get_node_ids())
+        self.assertEqual(set(node.id for node in street_network_two_pass.get_nodes()), referenced)
+        self.assertLess(len(street_network_two_pass.get_nodes()), len(street_network.get_nodes()))
+
+        def way_coordinates(network):
+            return sorted((way.id, [(network.get_node(nid).lat, network.get_node(nid).lng) for nid in way.get_node_ids()])
+                          for way in network.get_ways())
+        self.assertEqual(way_coordinates(street_network), way_coordinates(street_network_two_pass))
+
+
+    def test_rtree(self):
+        nodes = Nodes()
+        streets = Streets()
+        network = OSM(nodes, streets, None)
+        network.add_nodes([Node(0, 0, 0), Node(1, 0, 0.001), Node(2, 0, 0.01), Node(3, 0, 0.011),
+                           Node(4, 0.00005, 0), Node(5, 0.00005, 0.001)])
+        s1 = network.create_street('1', [0, 1])
+        s2 = network.create_street('2', [2, 3])  # Starts at the same latitude as s1, but far away
+        network.create_rtree()
+
+        self.assertEqual([s.id for s in network.get_rtree_nearby_ways(s1)], ['1'])
+        self.assertEqual([s.id for s in network.get_rtree_nearby_ways(s2)], ['2'])
+
+        # The r-tree is updated when ways are added or removed
+        s3 = network.create_street('3', [4, 5])
+        self.assertEqual(sorted(s.id for s in network.get_rtree_nearby_ways(s1)), ['1', '3'])
+        network.remove_way('1')
+        self.assertEqual([s.id for s in network.get_rtree_nearby_ways(s3)], ['3'])
+
+        # ... and ways whose nodes are moved are re-indexed with update_rtree
+        network.create_node(5, 0.00005, 0.0105)
+        network.create_node(4, 0.00005, 0.0095)
+        network.update_rtree(['3'])
+        self.assertEqual(sorted(s.id for s in network.get_rtree_nearby_ways(s2)), ['2', '3'])
 
     def test_split_streets(self):
         filename = "../../resources/SmallMap_01.osm"
@@ -474,6 +694,50 @@ class TestNetworkMethods(unittest.TestCase):
         string = """{"type": "FeatureCollection", "features": [{"geometry": {"type": "LineString", "coordinates": [[0.0, 0.0], [1.0, 0.0]]}, "type": "Feature", "properties": {"stroke": "#555555", "type": null, "id": "1", "user": "test"}, "id": "way/1"}, {"geometry": {"type": "LineString", "coordinates": [[0.0, 0.0], [-1.0, 0.0]]}, "type": "Feature", "properties": {"stroke": "#555555", "type": null, "id": "3", "user": "test"}, "id": "way/3"}, {"geometry": {"type": "LineString", "coordinates": [[0.0, 0.0], [0.0, 1.0]]}, "type": "Feature", "properties": {"stroke": "#555555", "type": null, "id": "2", "user": "test"}, "id": "way/2"}, {"geometry": {"type": "LineString", "coordinates": [[0.0, 0.0], [0.0, -1.0]]}, "type": "Feature", "properties": {"stroke": "#555555", "type": null, "id": "4", "user": "test"}, "id": "way/4"}]}"""
         self.assertEqual(mygeojson, string)
 
+    def test_export_to(self):
+        nodes = Nodes()
+        ways = Ways()
+        network = OSM(nodes, ways, None)
+        network.add_nodes([Node(0, 0, 0), Node(1, 0, 1), Node(2, 1, 0)])
+        way = Way(1, (0, 1, 2), "residential")
+        way.add_tag({"k": "name", "v": u'"A" & <B> Caf\xe9'})
+        network.add_way(way)
+
+        osm = StringIO()
+        network.export_to(osm, format="osm")
+        self.assertEqual(osm.getvalue(), network.export(format="osm"))
+        root = ElementTree.fromstring(osm.getvalue())
+        self.assertEqual([nd.get("ref") for nd in root.find("way").findall("nd")], ["0", "1", "2"])
+        tags = dict((tag.get("k"), tag.get("v")) for tag in root.find("way").findall("tag"))
+        self.assertEqual(tags, {"highway": "residential", "name": u'"A" & <B> Caf\xe9'})
+
+        compressed = StringIO()
+        network.export_to(compressed, format="osm", compress=True)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed.getvalue())).read(), osm.getvalue())
+
+    def test_export_to_geojson(self):
+        nodes = Nodes()
+        ways = Ways()
+        network = OSM(nodes, ways, None)
+        network.add_nodes([Node(0, 0, 0), Node(1, 0, 1), Node(2, 1, 0)])
+        network.add_ways([Way(1, (0, 1)), Way(2, (1, 0, 2))])
+
+        collection = StringIO()
+        network.export_to(collection, format="geojson", data_type="all")
+        geojson = json.loads(collection.getvalue())
+        self.assertEqual(geojson["type"], "FeatureCollection")
+        self.assertEqual(len(geojson["features"]), 5)
+        way2 = [feature for feature in geojson["features"] if feature.get("id") == "2"][0]
+        self.assertEqual(way2["geometry"]["coordinates"], [[1., 0.], [0., 0.], [0., 1.]])
+        self.assertEqual((way2["properties"]["source"], way2["properties"]["target"]), (1, 2))
+        self.assertEqual(way2, json.loads(json.dumps(ways.get("2").get_geojson_features())))
+
+        # Newline-delimited features are the same as the features of the collection
+        sequence = StringIO()
+        network.export_to(sequence, format="geojsonseq", data_type="all")
+        self.assertEqual([json.loads(line) for line in sequence.getvalue().splitlines()], geojson["features"])
+        self.assertEqual(json.loads(network.export(data_type="nodes"))["features"], geojson["features"][2:])
+
 
 if __name__ == '__main__':
     unittest.main()
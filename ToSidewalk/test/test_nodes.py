@@ -83,6 +83,49 @@ class TestNodesMethods(unittest.TestCase):
         network = Network(nodes, ways)
         self.assertEqual(nodes.belongs_to(), network)
 
+    def test_columnar_store(self):
+        nodes = Nodes(capacity=2)
+        node1 = Node(1, 0, 0)
+        nodes.add(node1)
+        nodes.add_latlng(2, 1, 2)
+        nodes.add_latlng(3, -1, 3)
+
+        self.assertEqual(len(nodes), 3)
+        self.assertIs(nodes.get(1), node1)
+        self.assertIn(2, nodes.nodes)
+        self.assertIsNone(nodes.get(4))
+
+        # A node added with add_latlng is materialized on access, and the same Node object is returned afterwards
+        node2 = nodes.get(2)
+        self.assertEqual((node2.lat, node2.lng), (1., 2.))
+        self.assertEqual(node2.belongs_to(), nodes)
+        self.assertIs(nodes.nodes[2], node2)
+
+        self.assertEqual(nodes.get_bounds(), [-1., 0., 1., 3.])
+        self.assertEqual(nodes.get_coordinates([3, 1]).tolist(), [[-1., 3.], [0., 0.]])
+
+        nodes.remove(3)
+        self.assertNotIn(3, nodes.nodes)
+        self.assertEqual(sorted(nodes.nodes.keys()), [1, 2])
+        self.assertEqual(nodes.get_bounds(), [0., 0., 1., 2.])
+
+        nodes.update(1, Node(1, 5, 5))
+        self.assertEqual(nodes.get_coordinates([1]).tolist(), [[5., 5.]])
+
+    def test_columnar_store_compaction(self):
+        nodes = Nodes()
+        for i in range(3000):
+            nodes.add_latlng(i, i, -i)
+        for i in range(0, 3000, 3):
+            nodes.remove(i)
+        for i in range(1, 3000, 3):
+            nodes.remove(i)
+
+        self.assertEqual(len(nodes), 1000)
+        self.assertEqual(sorted(nodes.get_ids()), [nid for nid in range(3000) if nid % 3 == 2])
+        self.assertEqual(nodes.get_coordinates([2, 2999]).tolist(), [[2., -2.], [2999., -2999.]])
+        self.assertEqual(nodes.get_bounds(), [2., -2999., 2999., -2.])
+
 
 if __name__ == '__main__':
     unittest.main()
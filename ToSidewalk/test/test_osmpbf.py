@@ -0,0 +1,163 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+from decimal import Decimal
+from xml.etree import cElementTree as ET
+
+from ToSidewalk.graph import parse_osm
+from ToSidewalk.network import parse
+from ToSidewalk.osmpbf import is_pbf, iterparse_pbf, nano_to_str
+
+
+def varint(value):
+    out = ""
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out += chr(b | 0x80)
+        else:
+            return out + chr(b)
+
+
+def sint(value):
+    return varint((value << 1) ^ (value >> 63))
+
+
+def field(number, payload=None, value=None):
+    if payload is not None:
+        return varint(number << 3 | 2) + varint(len(payload)) + payload
+    return varint(number << 3) + varint(value)
+
+
+def packed(values, encode=varint):
+    return "".join(encode(v) for v in values)
+
+
+def delta(values):
+    previous, out = 0, []
+    for v in values:
+        out.append(v - previous)
+        previous = v
+    return out
+
+
+def nano(coordinate):
+    return int(Decimal(coordinate) * 10 ** 9)
+
+
+def blob(blob_type, data):
+    body = field(2, value=len(data)) + field(3, zlib.compress(data))
+    header = field(1, blob_type) + field(3, value=len(body))
+    return struct.pack("!I", len(header)) + header + body
+
+
+def osm_to_pbf(filename, block_size=50):
+    """
+    Encode the nodes and ways of an OSM XML file as a PBF file with DenseNodes, writing block_size entities per block
+    """
+    tree = ET.parse(filename)
+    b = tree.find("bounds")
+    bbox = ""
+    for number, key in [(1, "minlon"), (2, "maxlon"), (3, "maxlat"), (4, "minlat")]:
+        bbox += varint(number << 3) + sint(nano(b.get(key)) // 100 * 100)
+    out = blob("OSMHeader", field(1, bbox) + field(4, "OsmSchema-V0.6"))
+
+    def block(strings, group):
+        table = "".join(field(1, s) for s in strings)
+        return blob("OSMData", field(1, table) + field(2, group))
+
+    nodes = tree.findall("node")
+    for i in range(0, len(nodes), block_size):
+        strings, keys_vals = [""], []
+        chunk = nodes[i:i + block_size]
+        for node in chunk:
+            for tag in node.findall("tag"):
+                for s in (tag.get("k").encode("utf-8"), tag.get("v").encode("utf-8")):
+                    if s not in strings:
+                        strings.append(s)
+                    keys_vals.append(strings.index(s))
+            keys_vals.append(0)
+        dense = field(1, packed(delta([int(n.get("id")) for n in chunk]), sint)) + \
+            field(8, packed(delta([nano(n.get("lat")) // 100 for n in chunk]), sint)) + \
+            field(9, packed(delta([nano(n.get("lon")) // 100 for n in chunk]), sint)) + \
+            field(10, packed(keys_vals))
+        out += block(strings, field(2, dense))
+
+    ways = tree.findall("way")
+    for i in range(0, len(ways), block_size):
+        strings, group = [""], ""
+        for way in ways[i:i + block_size]:
+            keys, vals = [], []
+            for tag in way.findall("tag"):
+                for s, indices in ((tag.get("k").encode("utf-8"), keys), (tag.get("v").encode("utf-8"), vals)):
+                    if s not in strings:
+                        strings.append(s)
+                    indices.append(strings.index(s))
+            refs = [int(nd.get("ref")) for nd in way.findall("nd")]
+            group += field(3, field(1, value=int(way.get("id"))) + field(2, packed(keys)) + field(3, packed(vals)) +
+                           field(8, packed(delta(refs), sint)))
+        out += block(strings, group)
+    return out
+
+
+class TestOSMPBFMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.xml_filename = "../../resources/SmallMap_01.osm"
+        fd, self.pbf_filename = tempfile.mkstemp(suffix=".pbf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(osm_to_pbf(self.xml_filename))
+
+    def tearDown(self):
+        os.remove(self.pbf_filename)
+
+    def test_nano_to_str(self):
+        self.assertEqual(nano_to_str(38896954000), "38.896954")
+        self.assertEqual(nano_to_str(-76981150000), "-76.98115")
+        self.assertEqual(nano_to_str(-500000000), "-0.5")
+        self.assertEqual(nano_to_str(0), "0.0")
+
+    def test_is_pbf(self):
+        self.assertTrue(is_pbf(self.pbf_filename))
+        self.assertFalse(is_pbf(self.xml_filename))
+        self.assertFalse(is_pbf("../../resources/tests/out2340_3134.pbfr"))
+
+    def test_iterparse_pbf(self):
+        tree = ET.parse(self.xml_filename)
+        for processes in (1, 2):
+            elements = list(iterparse_pbf(self.pbf_filename, processes=processes))
+            self.assertEqual(elements[0].tag, "bounds")
+            nodes = [e for e in elements if e.tag == "node"]
+            ways = [e for e in elements if e.tag == "way"]
+            self.assertEqual([n.get("id") for n in nodes], [n.get("id") for n in tree.findall("node")])
+            self.assertEqual([float(n.get("lat")) for n in nodes], [float(n.get("lat")) for n in tree.findall("node")])
+            self.assertEqual([[nd.get("ref") for nd in w.findall("nd")] for w in ways],
+                             [[nd.get("ref") for nd in w.findall("nd")] for w in tree.findall("way")])
+            self.assertEqual([[t.attrib for t in w.findall("tag")] for w in ways],
+                             [[t.attrib for t in w.findall("tag")] for w in tree.findall("way")])
+
+    def test_parse(self):
+        xml_network = parse(self.xml_filename)
+        pbf_network = parse(self.pbf_filename)
+
+        def way_coordinates(network):
+            return sorted((way.id, [(network.get_node(nid).lat, network.get_node(nid).lng) for nid in way.nids])
+                          for way in network.get_ways())
+        self.assertEqual(way_coordinates(xml_network), way_coordinates(pbf_network))
+        self.assertEqual(len(xml_network.get_nodes()), len(pbf_network.get_nodes()))
+        self.assertEqual(map(float, xml_network.bounds), map(float, pbf_network.bounds))
+
+    def test_parse_osm(self):
+        xml_graph = parse_osm(self.xml_filename)
+        pbf_graph = parse_osm(self.pbf_filename, highway_nodes_only=True)
+        self.assertEqual(sorted(path.osm_ids for path in xml_graph.get_paths()),
+                         sorted(path.osm_ids for path in pbf_graph.get_paths()))
+        xml_nodes = dict((n.osm_id, (n.x, n.y)) for n in xml_graph.get_nodes())
+        for n in pbf_graph.get_nodes():
+            self.assertEqual(xml_nodes[n.osm_id], (n.x, n.y))
+
+if __name__ == '__main__':
+    unittest.main()
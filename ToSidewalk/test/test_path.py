@@ -31,5 +31,39 @@ class TestPathMethods(unittest.TestCase):
 
         self.assertTrue(path == new_edge.path)
 
+    def test_cached_nodes(self):
+        nodes = [Node(i, i, 0) for i in range(6)]
+        edges = [Edge(source, target) for source, target in window(nodes, 2)]
+        path = Path(0, edges)
+
+        def walk(p):
+            # Node order recomputed from the edges, bypassing the cache
+            cached = p.get_nodes()
+            p.invalidate_nodes()
+            self.assertEqual(p.get_nodes(), cached)
+            return cached
+
+        self.assertEqual(path.get_nodes(), nodes)
+        path.get_nodes().pop()
+        self.assertEqual(path.get_nodes(), nodes)
+
+        path.merge_edges(path.edges[1], path.edges[2])
+        self.assertEqual(path.get_nodes(), walk(path))
+        self.assertEqual(path.get_nodes(), [nodes[0], nodes[1], nodes[3], nodes[4], nodes[5]])
+
+        path.remove_node(nodes[4])
+        self.assertEqual(path.get_nodes(), [nodes[0], nodes[1], nodes[3], nodes[5]])
+        self.assertEqual(path.get_nodes(), walk(path))
+
+        path.remove_edge(path.edges[0])
+        self.assertEqual(path.get_nodes(), [nodes[1], nodes[3], nodes[5]])
+        path.remove_edge(path.edges[-1])
+        self.assertEqual(path.get_nodes(), [nodes[1], nodes[3]])
+
+        new_node = Node(10, 10, 0)
+        path.edges.append(Edge(nodes[3], new_node))
+        path.invalidate_nodes()
+        self.assertEqual(path.get_nodes(), [nodes[1], nodes[3], new_node])
+
 if __name__ == '__main__':
     unittest.main()
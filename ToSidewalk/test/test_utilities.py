@@ -0,0 +1,82 @@
+import unittest
+from StringIO import StringIO
+import numpy as np
+from ToSidewalk.utilities import iterparse_osm, latlng_offset_size, latlng_offset_size_array, visvalingam, \
+    douglas_peucker
+
+
+class TestUtilitiesMethods(unittest.TestCase):
+
+    def test_iterparse_osm(self):
+        osm = StringIO("""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+<bounds minlat="0" minlon="0" maxlat="1" maxlon="1"/>
+<node id="1" lat="0" lon="0"><tag k="highway" v="traffic_signals"/></node>
+<node id="2" lat="1" lon="1"/>
+<way id="3"><nd ref="1"/><nd ref="2"/><tag k="highway" v="residential"/></way>
+<relation id="4"><member type="way" ref="3" role=""/></relation>
+</osm>""")
+        tags = []
+        for elem in iterparse_osm(osm):
+            tags.append(elem.tag)
+            if elem.tag == "node" and elem.get("id") == "1":
+                self.assertEqual(elem.find("tag").get("v"), "traffic_signals")
+            elif elem.tag == "way":
+                self.assertEqual([nd.get("ref") for nd in elem.findall("nd")], ["1", "2"])
+        self.assertEqual(tags, ["bounds", "node", "node", "way"])
+
+    def test_latlng_offset_size_array(self):
+        lats = np.array([0., 38.9, 60.])
+        vectors = np.array([[1., 0.], [1., 1.], [-0.3, 2.]])
+        sizes = latlng_offset_size_array(lats, vector=vectors, distance=10)
+        for lat, vector, size in zip(lats, vectors, sizes):
+            self.assertEqual(size, latlng_offset_size(lat, vector=vector.copy(), distance=10))
+
+        sizes = latlng_offset_size_array(lats, dx=[3., 0., -5.], dy=[4., 2., 1.])
+        for lat, dx, dy, size in zip(lats, [3., 0., -5.], [4., 2., 1.], sizes):
+            self.assertEqual(size, latlng_offset_size(lat, dx=dx, dy=dy))
+
+    def test_visvalingam(self):
+        points = [(0., 2.), (3., 0.), (6., 1.), (9., 0.), (12., 0.5), (15., 2.)]
+        # The areas are 4.5, 3, 2.25, 1.5. Removing the point 4 makes the area of the point 3 6
+        self.assertEqual(visvalingam(points, threshold=0.7), [0, 1, 3, 5])
+        self.assertEqual(visvalingam(points, threshold=0.5), [0, 3, 5])
+        self.assertEqual(visvalingam(points, threshold=0.), [0, 5])
+        self.assertEqual(visvalingam(points, threshold=0.5, fixed=[2]), [0, 2, 5])
+        self.assertEqual(visvalingam(points, tolerance=2.), [0, 1, 2, 3, 5])
+        self.assertEqual(visvalingam(points[:2]), [0, 1])
+
+        def naive(points, threshold):
+            # Find the smallest effective area with a linear scan instead of a heap
+            indices = range(len(points))
+            areas = {}
+
+            def triangle_area(i, j, k):
+                (x1, y1), (x2, y2), (x3, y3) = points[i], points[j], points[k]
+                return abs((x1 - x2) * (y3 - y2) - (y1 - y2) * (x3 - x2)) / 2
+            for p, i, q in zip(indices, indices[1:], indices[2:]):
+                areas[i] = triangle_area(p, i, q)
+            while float(len(indices)) / len(points) > threshold and len(indices) > 2:
+                a, i = min((areas[i], i) for i in indices[1:-1])
+                position = indices.index(i)
+                indices.remove(i)
+                for j in (position - 1, position):
+                    if 0 < j < len(indices) - 1:
+                        areas[indices[j]] = max(triangle_area(indices[j - 1], indices[j], indices[j + 1]), a)
+            return indices
+
+        rng = np.random.RandomState(0)
+        for _ in range(20):
+            points = rng.uniform(0, 10, (50, 2)).tolist()
+            for threshold in (0.2, 0.5, 0.9):
+                self.assertEqual(visvalingam(points, threshold), naive(points, threshold))
+
+    def test_douglas_peucker(self):
+        points = [(0., 2.), (3., 0.), (6., 1.), (9., 0.), (12., 0.5), (15., 2.)]
+        self.assertEqual(douglas_peucker(points, 1.), [0, 1, 3, 5])
+        self.assertEqual(douglas_peucker(points, 10.), [0, 5])
+        self.assertEqual(douglas_peucker(points, 10., fixed=[2]), [0, 2, 5])
+        self.assertEqual(douglas_peucker(points, 0.), range(6))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,19 @@ class TestWaysMethods(unittest.TestCase):
         self.assertEqual(ways.belongs_to(), network)
 
 
+class TestStreetMethods(unittest.TestCase):
+    def test_get_hough_point(self):
+        network = Network(Nodes(), Streets())
+        network.add_nodes([Node(0, 1, 1), Node(1, 1, 3)])
+        street = network.create_street('1', [0, 1])
+
+        r, theta = street.get_hough_point(origin=(0, 0))
+        self.assertAlmostEqual(r, 1.)
+        r, theta = street.get_hough_point(origin=(1, 0))
+        self.assertAlmostEqual(r, 0.)
+        self.assertEqual(street.get_hough_point(), street.get_hough_point((38.9, -76.988)))
+
+
 class TestSidewalkMethods(unittest.TestCase):
     def test_swap_nodes(self):
         # Todo
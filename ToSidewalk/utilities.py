@@ -1,3 +1,4 @@
+from heapq import heapify, heappop, heappush
 from itertools import islice
 import math
 import numpy as np
@@ -19,6 +20,105 @@ def area(p1, p2, p3):
     return abs(area)
 
 
+def visvalingam(points, threshold=0.5, tolerance=None, fixed=()):
+    """
+    Simplify a polyline with Visvalingam-Whyatt algorithm. The point that forms the triangle with the smallest area
+    with its neighbors is removed repeatedly, and the areas of the neighbors' triangles are updated. Updated triangles
+    are pushed to the heap again and the outdated entries are skipped when they are popped (i.e., lazy deletion), so
+    simplifying n points takes O(n log n).
+    http://bost.ocks.org/mike/simplify/
+
+    :param points: A list of points (e.g., [(x1, y1), (x2, y2), ...])
+    :param threshold: Points are removed while the ratio of the remaining points is above this value
+    :param tolerance: An area. If given, points are removed while their effective area is below this value instead
+    :param fixed: Indices of points that should not be removed. The end points are never removed
+    :return: A sorted list of the indices of the points to keep
+    """
+    n = len(points)
+    if n < 3:
+        return range(n)
+
+    def triangle_area(i, j, k):
+        (x1, y1), (x2, y2), (x3, y3) = points[i], points[j], points[k]
+        return abs((x1 - x2) * (y3 - y2) - (y1 - y2) * (x3 - x2)) / 2
+
+    prev_idx = range(-1, n - 1)
+    next_idx = range(1, n + 1)
+    areas = [None] * n
+    removed = [False] * n
+    fixed = set(fixed)
+    heap = []
+    for i in range(1, n - 1):
+        if i not in fixed:
+            areas[i] = triangle_area(i - 1, i, i + 1)
+            heap.append((areas[i], i))
+    heapify(heap)
+
+    remaining = n
+    while heap:
+        a, i = heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue  # An outdated entry
+        if tolerance is None and float(remaining) / n <= threshold:
+            break
+        if tolerance is not None and a >= tolerance:
+            break
+
+        removed[i] = True
+        remaining -= 1
+        p, q = prev_idx[i], next_idx[i]
+        next_idx[p] = q
+        prev_idx[q] = p
+        for j in (p, q):
+            if areas[j] is not None and 0 < j < n - 1:
+                # The effective area of a point is never smaller than that of a point removed before it
+                areas[j] = max(triangle_area(prev_idx[j], j, next_idx[j]), a)
+                heappush(heap, (areas[j], j))
+
+    return [i for i in range(n) if not removed[i]]
+
+
+def douglas_peucker(points, tolerance, fixed=()):
+    """
+    Simplify a polyline with Douglas-Peucker algorithm. The point farthest from the segment between the two end points
+    is kept if it is farther than the tolerance, and the two halves are simplified recursively.
+
+    :param points: A list of points (e.g., [(x1, y1), (x2, y2), ...])
+    :param tolerance: A distance
+    :param fixed: Indices of points that should not be removed. The polyline is simplified separately between them
+    :return: A sorted list of the indices of the points to keep
+    """
+    n = len(points)
+    if n < 3:
+        return range(n)
+
+    def distance_to_segment(i, start, end):
+        (x, y), (x1, y1), (x2, y2) = points[i], points[start], points[end]
+        dx, dy = x2 - x1, y2 - y1
+        d2 = dx * dx + dy * dy
+        if d2 == 0:
+            return math.hypot(x - x1, y - y1)
+        t = max(0., min(1., ((x - x1) * dx + (y - y1) * dy) / d2))
+        return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+    keep = [False] * n
+    anchors = sorted(set(fixed) | {0, n - 1})
+    for i in anchors:
+        keep[i] = True
+    stack = list(window(anchors, 2))
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distance, farthest = max((distance_to_segment(i, start, end), i) for i in range(start + 1, end))
+        if distance > tolerance:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+
+    return [i for i in range(n) if keep[i]]
+
+
 def foot(x1, y1, a, b, c):
     """
     Get a foot M(x2, y2) drawn from a point (x1, y1) to the line ax + by + c = 0
@@ -103,6 +203,83 @@ def latlng_offset_size(lat_origin, **kwargs):
     return math.sqrt(dlat * dlat + dlng * dlng)
 
 
+def latlng_offset_size_array(lat_origin, dx=None, dy=None, vector=None, distance=None):
+    """
+    Vectorized version of latlng_offset_size. Either dx and dy, or vector and distance should be passed.
+
+    :param lat_origin: An array of latitudes of the origins
+    :param dx: An array of displacements along the x axis in meters
+    :param dy: An array of displacements along the y axis in meters
+    :param vector: A (n, 2) array of direction vectors
+    :param distance: An array (or a scalar) of displacements in meters
+    :return: An array of sizes of the offsets
+    """
+    if vector is not None and distance is not None:
+        v = np.array(vector, dtype=np.float64).reshape(-1, 2)
+        v /= np.sqrt(v[:, 0] * v[:, 0] + v[:, 1] * v[:, 1])[:, np.newaxis]
+        angle = np.arctan2(v[:, 1], v[:, 0])
+        dx = np.multiply(distance, np.cos(angle))
+        dy = np.multiply(distance, np.sin(angle))
+    dlat = np.asarray(dy, dtype=np.float64) / 111111
+    dlng = np.asarray(dx, dtype=np.float64) / (111111 * np.cos(np.radians(lat_origin)))
+    return np.sqrt(dlat * dlat + dlng * dlng)
+
+
+def iterparse_osm(source, tags=("bounds", "node", "way")):
+    """
+    Stream the top level elements (e.g., bounds, node, way) of an OSM file using cElementTree.iterparse.
+    Each element is yielded once it is fully read, and it is cleared (and detached from the root) as soon as the
+    caller is done with it. This keeps the memory footprint independent of the size of the XML document.
+    http://effbot.org/zone/element-iterparse.htm
+
+    OSM PBF files are detected by their content (not by the extension) and decoded with osmpbf.iterparse_pbf,
+    which yields the same elements.
+
+    :param source: A file name or a file object of an OSM file
+    :param tags: Tags of the top level elements to yield. Other elements (e.g., relation) are skipped.
+    """
+    from osmpbf import is_pbf, iterparse_pbf
+    if is_pbf(source):
+        for elem in iterparse_pbf(source, tags):
+            yield elem
+        return
+
+    from xml.etree import cElementTree as ET
+    context = ET.iterparse(source, events=("start", "end"))
+    event, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 0:
+            # elem is a direct child of the <osm> element
+            if elem.tag in tags:
+                yield elem
+            elem.clear()
+            root.clear()
+
+
+def highway_node_ids(source, valid_highways):
+    """
+    Scan the ways in an OSM file and collect the ids of the nodes that are referenced by the ways with a highway tag
+    in valid_highways. This is the first pass of a two-pass parse: the second pass only needs to create the nodes
+    in the returned set, which skips buildings, POIs, etc. that are never used to build a street network.
+
+    :param source: A file name or a file object of an OSM file
+    :param valid_highways: A set of highway tag values (e.g., {'primary', 'residential'})
+    :return: A set of osm node ids (int)
+    """
+    node_ids = set()
+    for way in iterparse_osm(source, tags=("way",)):
+        highway_tag = way.find("tag[@k='highway']")
+        if highway_tag is not None and highway_tag.get("v") in valid_highways:
+            node_ids.update(int(nd.get("ref")) for nd in way.iterfind("nd"))
+    return node_ids
+
+
 def window(seq, n=2, padding=None):
     """
     Returns a sliding window (of width n) over data from the iterable
@@ -3,7 +3,7 @@ import math
 import numpy as np
 import itertools
 import logging as log
-import random
+from ids import default_ids, is_large_id
 from utilities import latlng_offset_size, window
 from types import *
 from node import Node
@@ -12,13 +12,12 @@ from node import Node
 class Way(object):
     def __init__(self, wid=None, nids=[], way_type=None):
         self._original_ways = []
-        if type(wid) is IntType and wid > 0x7fffffff:
+        if is_large_id(wid):
             self._original_ways.append(str(wid))
-            wid = random.randint(0, 0x7fffffff)  # Generate a random unsigned integer.
+            wid = default_ids.map_osm_id(wid)
 
         if wid is None:
-            ri = random.randint(0, 0x7fffffff)  # Generate a random unsigned integer.
-            self.id = str(ri)
+            self.id = str(default_ids.allocate())
         else:
             self.id = str(wid)
         self.nids = list(nids)
@@ -87,17 +86,17 @@ class Way(object):
             geojson['features'].append(feature)
             return json.dumps(geojson)
 
-    def get_geojson_features(self):
+    def get_geojson_features(self, latlngs=None):
         """
         A utilitie method to export the data as a geojson dump
+        :param latlngs: A (n, 2) array of the (lat, lng) of the nodes of the way (see Nodes.get_coordinates). If None,
+            the nodes are looked up in the network one by one
         :return: A dictionary of geojson features
         """
-        coordinates = []
-        ways = self.belongs_to()
-        network = ways.belongs_to()
-
-        start = network.get_node(self.nids[0])
-        end = network.get_node(self.nids[-1])
+        if latlngs is None:
+            network = self.belongs_to().belongs_to()
+            latlngs = [(node.lat, node.lng) for node in map(network.get_node, self.nids)]
+        coordinates = [[lng, lat] for lat, lng in latlngs]
 
         feature = dict()
         feature['properties'] = {
@@ -105,22 +104,19 @@ class Way(object):
             'way_id': self.id,
             'user': self.user,
             'osm_ways': self._original_ways,
-            'source': start.id,
-            'target': end.id,
+            'source': self.nids[0],
+            'target': self.nids[-1],
             'cost': 1.0,
             'reverse_cost': 1.0,
-            'x1': start.lng,
-            'y1': start.lat,
-            'x2': end.lng,
-            'y2': end.lat,
+            'x1': coordinates[0][0],
+            'y1': coordinates[0][1],
+            'x2': coordinates[-1][0],
+            'y2': coordinates[-1][1],
             'node_ids': self.nids
         }
         feature['type'] = 'Feature'
         feature['id'] = '%s' % (self.id)
 
-        for nid in self.nids:
-            node = network.get_node(nid)
-            coordinates.append([node.lng, node.lat])
         feature['geometry'] = {
             'type': 'LineString',
             'coordinates': coordinates
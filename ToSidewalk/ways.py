@@ -1,11 +1,13 @@
 import math
+from collections import OrderedDict
 import numpy as np
+from hough import HOUGH_ORIGIN
 from way import Way
 
 
 class Ways(object):
     def __init__(self):
-        self.ways = {}
+        self.ways = OrderedDict()  # Way id to Way object, iterated in the order the ways were added
         self.intersection_node_ids = []
         self._parent_network = None
 
@@ -96,19 +98,23 @@ class Street(Way):
     def get_end_longitude(self):
         end_node = self.get_nodes()[-1]
         return end_node.lng
-    def get_hough_point(self):
+    def get_hough_point(self, origin=HOUGH_ORIGIN):
+        """
+        Get the Hough transform (r, theta) of the line through the start and end nodes of this street
 
+        :param origin: The (lat, lng) origin that r is measured from
+        :return: A list [r, theta]
+        """
         start_lat = self.get_start_latitude()
         start_long = self.get_start_longitude()
         end_lat = self.get_end_latitude()
         end_long = self.get_end_longitude()
 
-
         # Recenter the origin
-        start_lat -= 38.9
-        start_long += 76.988
-        end_lat -= 38.9
-        end_long += 76.988
+        start_lat -= origin[0]
+        start_long -= origin[1]
+        end_lat -= origin[0]
+        end_long -= origin[1]
         # Calculate what m and b are in slope-intercept form
         x1 = start_lat
         y1 = start_long
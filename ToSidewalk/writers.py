@@ -0,0 +1,178 @@
+import gzip
+import json
+from types import UnicodeType
+from xml.sax.saxutils import escape
+
+# The number of bytes that are buffered before they are written to the file object
+BUFFER_SIZE = 1 << 16
+
+# Characters that have to be escaped in a double-quoted XML attribute value, in addition to &, <, and >. Whitespace
+# is escaped so it survives attribute value normalization.
+_ATTRIBUTE_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+def quote_attribute(value):
+    """
+    Format a value as a double-quoted XML attribute value. Unicode strings are encoded in UTF-8, and other values
+    are converted with str.
+
+    :param value: An attribute value
+    :return: A quoted and escaped byte string
+    """
+    if type(value) is UnicodeType:
+        value = value.encode("utf-8")
+    else:
+        value = str(value)
+    return '"%s"' % escape(value, _ATTRIBUTE_ENTITIES)
+
+
+class ChunkedWriter(object):
+    """
+    A writer that collects small strings and writes them to a file object in chunks of about buffer_size bytes,
+    optionally gzip-compressed. Closing the writer flushes the buffer and finishes the gzip stream, but does not
+    close the file object.
+    """
+    def __init__(self, fileobj, compress=False, buffer_size=BUFFER_SIZE):
+        """
+        :param fileobj: A file object opened for writing in binary mode
+        :param compress: If True, the output is gzip-compressed
+        :param buffer_size: The number of bytes to buffer before writing to fileobj
+        """
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode="wb") if compress else None
+        self.fileobj = self._gzip if compress else fileobj
+        self.buffer_size = buffer_size
+        self._chunks = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, string):
+        """
+        Buffer a string, and write the buffer to the file object when it is full
+        """
+        self._chunks.append(string)
+        self._size += len(string)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered strings to the file object
+        """
+        if self._chunks:
+            self.fileobj.write("".join(self._chunks))
+            self._chunks = []
+            self._size = 0
+
+    def close(self):
+        self.flush()
+        if self._gzip is not None:
+            self._gzip.close()
+            self._gzip = None
+
+
+class OSMWriter(ChunkedWriter):
+    """
+    A streaming writer of OSM XML. Each element is formatted and buffered as it is written, so the document is never
+    held in memory as a whole. Call start, then node and way for each element, then end.
+    """
+    def start(self, bounds=None):
+        """
+        Write the XML declaration, the <osm> start tag, and the <bounds> element
+
+        :param bounds: (minlat, minlng, maxlat, maxlng), or None to omit the <bounds> element
+        """
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        if bounds is not None:
+            self.element("bounds", zip(("minlat", "minlon", "maxlat", "maxlon"), bounds))
+
+    def element(self, name, attributes, indent=""):
+        """
+        Write an empty element, e.g., <nd ref="1" />
+
+        :param name: A tag name
+        :param attributes: A list of (name, value) pairs in the order they should be written
+        """
+        self.write("%s<%s %s />\n" % (indent, name, " ".join("%s=%s" % (key, quote_attribute(value))
+                                                             for key, value in attributes)))
+
+    def node(self, attributes, tags=()):
+        """
+        Write a <node> element
+
+        :param attributes: A list of (name, value) pairs, e.g., [("id", 1), ("lat", 38.9), ("lon", -77.0)]
+        :param tags: A list of (key, value) pairs that are written as <tag> elements
+        """
+        if not tags:
+            self.element("node", attributes)
+            return
+        self.write("<node %s>\n" % " ".join("%s=%s" % (key, quote_attribute(value)) for key, value in attributes))
+        for key, value in tags:
+            self.element("tag", (("k", key), ("v", value)), "  ")
+        self.write("</node>\n")
+
+    def way(self, attributes, node_ids, tags=()):
+        """
+        Write a <way> element
+
+        :param attributes: A list of (name, value) pairs, e.g., [("id", 1)]
+        :param node_ids: The ids of the nodes of the way, which are written as <nd> elements
+        :param tags: A list of (key, value) pairs that are written as <tag> elements
+        """
+        self.write("<way %s>\n" % " ".join("%s=%s" % (key, quote_attribute(value)) for key, value in attributes))
+        for nid in node_ids:
+            self.element("nd", (("ref", nid),), "  ")
+        for key, value in tags:
+            self.element("tag", (("k", key), ("v", value)), "  ")
+        self.write("</way>\n")
+
+    def end(self):
+        """
+        Write the </osm> end tag
+        """
+        self.write("</osm>\n")
+
+
+class GeoJSONWriter(ChunkedWriter):
+    """
+    A streaming writer of GeoJSON. Features are serialized one at a time, either into a FeatureCollection or, if
+    sequence is True, as newline-delimited GeoJSON (GeoJSONSeq) with one feature per line. Call start, then feature
+    for each feature, then end.
+    """
+    def __init__(self, fileobj, sequence=False, compress=False, buffer_size=BUFFER_SIZE):
+        """
+        :param sequence: If True, write newline-delimited features instead of a FeatureCollection
+        """
+        super(GeoJSONWriter, self).__init__(fileobj, compress, buffer_size)
+        self.sequence = sequence
+        self._count = 0
+
+    def start(self):
+        """
+        Write the beginning of the FeatureCollection
+        """
+        if not self.sequence:
+            self.write('{"type": "FeatureCollection", "features": [')
+
+    def feature(self, feature):
+        """
+        Write a feature
+
+        :param feature: A dictionary of a GeoJSON feature
+        """
+        if self.sequence:
+            self.write(json.dumps(feature) + "\n")
+        else:
+            self.write((", " if self._count else "") + json.dumps(feature))
+        self._count += 1
+
+    def end(self):
+        """
+        Write the end of the FeatureCollection
+        """
+        if not self.sequence:
+            self.write("]}")
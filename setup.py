@@ -32,6 +32,8 @@ setup(
     tests_require=['pytest'],
     install_requires=['numpy>=1.9.2',
                       'shapely>=1.5.8',
+                      'scipy>=0.13.0',
+                      'Rtree>=0.8.2',
                       'GeoAlchemy2>=0.2.5'],
     cmdclass={},
     author_email='koe.bluebear@gmail.com',